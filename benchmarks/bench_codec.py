@@ -0,0 +1,149 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import argparse
+import ast
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from idaconnect.shared.packets import CODECS  # noqa: E402
+
+EVENTS_PATH = os.path.join(os.path.dirname(__file__), '..', 'idaconnect',
+                           'core', 'events.py')
+
+# Words in the attribute names of the integers and the booleans
+INT_WORDS = ('ea', 'flag', 'size', 'tid', 'off', 'value', 'mask', 'serial',
+             'delta', 'idx', 'enum', 'struc', 'n', 'op', 'base', 'bits',
+             'align', 'comb', 'perm', 'sel', 'type')
+BOOL_WORDS = ('is', 'local', 'rptble', 'repeatable')
+
+
+def find_events():
+    """
+    Find the event classes of the plugin and the parameters of their
+    constructor. The module is parsed rather than imported, as it depends
+    on the IDA modules.
+
+    :return: the event types and parameter names
+    """
+    with open(EVENTS_PATH) as f:
+        tree = ast.parse(f.read())
+    events = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        eventType, params = None, []
+        for item in node.body:
+            if isinstance(item, ast.Assign) \
+                    and getattr(item.targets[0], 'id', None) == '__event__':
+                eventType = item.value.s
+            elif isinstance(item, ast.FunctionDef) \
+                    and item.name == '__init__':
+                params = [arg.arg if hasattr(arg, 'arg') else arg.id
+                          for arg in item.args.args[1:]]
+        if eventType:
+            events.append((eventType, params))
+    return events
+
+
+def generate_value(rand, param):
+    """
+    Generate a plausible value for an event attribute.
+
+    :param rand: the random generator
+    :param param: the attribute name
+    :return: the value
+    """
+    words = param.split('_')
+    if any(word in BOOL_WORDS for word in words):
+        return rand.random() < 0.5
+    if any(word in INT_WORDS for word in words):
+        return rand.randint(0x400000, 0x800000)
+    return 'name_%X' % rand.randint(0, 0xffffff)
+
+
+def generate_packets(events, count, seed):
+    """
+    Generate the dictionaries of some events, of every type in turn.
+
+    :param events: the event types and parameter names
+    :param count: the number of events of each type
+    :param seed: the random seed
+    :return: the dictionaries, by event type
+    """
+    rand = random.Random(seed)
+    packets = {}
+    for eventType, params in events:
+        packets[eventType] = []
+        for tick in range(count):
+            dct = {'type': 'event', 'event_type': eventType, 'tick': tick}
+            for param in params:
+                dct[param] = generate_value(rand, param)
+            packets[eventType].append(dct)
+    return packets
+
+
+def run(codec, dcts):
+    """
+    Encode then decode all the dictionaries.
+
+    :param codec: the codec
+    :param dcts: the dictionaries
+    :return: the encode time, the decode time and the wire size
+    """
+    start = time.time()
+    encoded = [codec.encode(dct) for dct in dcts]
+    encodeTime = time.time() - start
+    start = time.time()
+    decoded = [codec.decode(data) for data in encoded]
+    decodeTime = time.time() - start
+    assert decoded == dcts, "%s: round trip failed" % codec.__codec__
+    return encodeTime, decodeTime, sum(len(data) for data in encoded)
+
+
+def main(args):
+    events = find_events()
+    packets = generate_packets(events, args.count, args.seed)
+    print("%d event types, %d events of each"
+          % (len(events), args.count))
+
+    totals = {name: [0, 0, 0] for name in CODECS}
+    print("%-24s %-6s : %10s %10s %8s"
+          % ('event', 'codec', 'enc/s', 'dec/s', 'bytes'))
+    for eventType, dcts in sorted(packets.items()):
+        for name, codec in sorted(CODECS.items()):
+            result = run(codec, dcts)
+            totals[name] = [a + b for a, b in zip(totals[name], result)]
+            if args.verbose:
+                encodeTime, decodeTime, size = result
+                print("%-24s %-6s : %10.0f %10.0f %8.1f"
+                      % (eventType, name, len(dcts) / max(encodeTime, 1e-9),
+                         len(dcts) / max(decodeTime, 1e-9),
+                         size / float(len(dcts))))
+
+    count = len(events) * args.count
+    for name, (encodeTime, decodeTime, size) in sorted(totals.items()):
+        print("%-24s %-6s : %10.0f %10.0f %8.1f"
+              % ('all', name, count / max(encodeTime, 1e-9),
+                 count / max(decodeTime, 1e-9), size / float(count)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from idaconnect.shared.framing import Framer  # noqa: E402
+
+
+class LegacyFramer(object):
+    """
+    The framing algorithm previously used by ClientSocket._read_raw.
+    """
+
+    def __init__(self):
+        self._read_buffer = b''
+
+    def feed(self, data):
+        self._read_buffer += data
+        lines = []
+        while b'\n' in self._read_buffer:
+            parts = self._read_buffer.split(b'\n')
+            self._read_buffer = b'\n'.join(parts[1:])
+            lines.append(parts[0])
+        return lines
+
+
+class IncrementalFramer(object):
+    """
+    A thin wrapper around the new framer with the same interface.
+    """
+
+    def __init__(self):
+        self._framer = Framer()
+
+    def feed(self, data):
+        self._framer.feed(data)
+        lines = []
+        while True:
+            line = self._framer.read_line()
+            if line is None:
+                break
+            lines.append(line)
+        return lines
+
+
+def generate_stream(count, seed):
+    """
+    Generate a stream of newline-terminated event lines.
+
+    :param count: the number of lines
+    :param seed: the random seed
+    :return: the bytes
+    """
+    rand = random.Random(seed)
+    lines = []
+    for tick in range(count):
+        ea = rand.randint(0x400000, 0x800000)
+        dct = {
+            'type': 'event',
+            'event_type': 'renamed',
+            'ea': ea,
+            'new_name': 'sub_%X' % ea,
+            'local_name': False,
+            'tick': tick,
+        }
+        lines.append(json.dumps(dct).encode('utf-8') + b'\n')
+    return b''.join(lines)
+
+
+def generate_chunks(stream, max_size, seed):
+    """
+    Split the stream into chunks of random sizes.
+
+    :param stream: the bytes
+    :param max_size: the maximum size of a chunk
+    :param seed: the random seed
+    :return: the chunks
+    """
+    rand = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(stream):
+        size = rand.randint(1, max_size)
+        chunks.append(stream[i:i + size])
+        i += size
+    return chunks
+
+
+def run(framer, chunks):
+    """
+    Feed all the chunks to the framer.
+
+    :param framer: the framer
+    :param chunks: the chunks
+    :return: the number of lines and the elapsed time
+    """
+    count = 0
+    start = time.time()
+    for chunk in chunks:
+        count += len(framer.feed(chunk))
+    return count, time.time() - start
+
+
+def main(args):
+    stream = generate_stream(args.lines, args.seed)
+    chunks = generate_chunks(stream, args.chunk_size, args.seed)
+    print("%d lines, %d bytes, %d chunks of at most %d bytes"
+          % (args.lines, len(stream), len(chunks), args.chunk_size))
+
+    for name, cls in (('before', LegacyFramer),
+                      ('after', IncrementalFramer)):
+        count, elapsed = run(cls(), chunks)
+        assert count == args.lines, "%s: got %d lines" % (name, count)
+        print("%-6s : %8.3fs, %12.0f lines/s"
+              % (name, elapsed, count / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
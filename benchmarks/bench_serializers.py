@@ -0,0 +1,158 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_codec import find_events, generate_value  # noqa: E402
+from idaconnect.shared.packets import (DefaultEvent, Packet,  # noqa: E402
+                                       generate_function)
+
+
+class LegacyEvent(object):
+    """
+    The serialization previously used by the events, going through their
+    attributes dictionary and the factories recursively.
+    """
+    __type__ = 'event'
+    __event__ = None
+    _PACKETS = {}
+    _EVENTS = {}
+
+    @staticmethod
+    def attrs(dct):
+        return {key: val for key, val in dct.items()
+                if not key.startswith('_')}
+
+    @classmethod
+    def get_class(cls, dct):
+        cls = LegacyEvent._PACKETS[dct['type']]
+        if cls is LegacyEvent:
+            cls = LegacyEvent._EVENTS[dct['event_type']]
+        return cls
+
+    @staticmethod
+    def parse_packet(dct):
+        cls = LegacyEvent.get_class(dct)
+        obj = cls.__new__(cls)
+        object.__init__(obj)
+        obj.parse(dct)
+        return obj
+
+    def build_packet(self):
+        dct = collections.defaultdict(collections.defaultdict)
+        self.build(dct)
+        return dct
+
+    def build(self, dct):
+        dct['type'] = self.__type__
+        dct['event_type'] = self.__event__
+        dct['tick'] = self._tick
+        self.build_event(dct)
+        return dct
+
+    def parse(self, dct):
+        self._tick = dct['tick']
+        self.parse_event(dct)
+        return self
+
+    def build_event(self, dct):
+        dct.update(LegacyEvent.attrs(self.__dict__))
+
+    def parse_event(self, dct):
+        self.__dict__.update(LegacyEvent.attrs(dct))
+
+
+LegacyEvent._PACKETS['event'] = LegacyEvent
+
+
+def create_classes(eventType, params):
+    """
+    Create the legacy and the current class of an event.
+
+    :param eventType: the event type
+    :param params: the parameters of the constructor
+    :return: the two classes
+    """
+    init = generate_function('__init__', [
+        'def __init__(self, %s):' % ', '.join(params),
+        '    self._tick = 0',
+    ] + ['    self.%s = %s' % (param, param) for param in params])
+    legacy = type('Legacy_' + eventType, (LegacyEvent,),
+                  {'__event__': eventType, '__init__': init})
+    LegacyEvent._EVENTS[eventType] = legacy
+
+    init = generate_function('__init__', [
+        'def __init__(self, %s):' % ', '.join(params),
+        '    DefaultEvent.__init__(self)',
+    ] + ['    self.%s = %s' % (param, param) for param in params],
+        {'DefaultEvent': DefaultEvent})
+    current = type(DefaultEvent)('Current_' + eventType, (DefaultEvent,),
+                                 {'__event__': eventType, '__init__': init})
+    return legacy, current
+
+
+def run(events, parse):
+    """
+    Build then parse all the events.
+
+    :param events: the events
+    :param parse: the parsing function
+    :return: the build time and the parse time
+    """
+    start = time.time()
+    dcts = [event.build_packet() for event in events]
+    buildTime = time.time() - start
+    start = time.time()
+    for dct in dcts:
+        parse(dct)
+    return buildTime, time.time() - start
+
+
+def main(args):
+    rand = random.Random(args.seed)
+    legacyEvents, currentEvents = [], []
+    for eventType, params in find_events():
+        legacy, current = create_classes(eventType, params)
+        for _ in range(args.count):
+            values = [generate_value(rand, param) for param in params]
+            legacyEvents.append(legacy(*values))
+            currentEvents.append(current(*values))
+    assert [dict(e.build_packet()) for e in legacyEvents] \
+        == [e.build_packet() for e in currentEvents]
+    print("%d events" % len(currentEvents))
+
+    results = {}
+    for name, events, parse in (
+            ('before', legacyEvents, LegacyEvent.parse_packet),
+            ('after', currentEvents, Packet.parse_packet)):
+        buildTime, parseTime = run(events, parse)
+        results[name] = buildTime, parseTime
+        print("%-6s : build %10.0f/s, parse %10.0f/s"
+              % (name, len(events) / max(buildTime, 1e-9),
+                 len(events) / max(parseTime, 1e-9)))
+    print("speedup: build %.1fx, parse %.1fx"
+          % tuple(b / max(a, 1e-9) for a, b
+                  in zip(results['after'], results['before'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
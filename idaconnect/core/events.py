@@ -27,6 +27,7 @@ logger = logging.getLogger('IDAConnect.Core')
 
 
 class Event(DefaultEvent):
+    __slots__ = ()
 
     def __call__(self):
         """
@@ -37,6 +38,7 @@ class Event(DefaultEvent):
 
 class MakeCodeEvent(Event):
     __event__ = 'make_code'
+    __slots__ = ('ea',)
 
     def __init__(self, ea):
         super(MakeCodeEvent, self).__init__()
@@ -48,6 +50,7 @@ class MakeCodeEvent(Event):
 
 class MakeDataEvent(Event):
     __event__ = 'make_data'
+    __slots__ = ('ea', 'flags', 'size', 'tid')
 
     def __init__(self, ea, flags, size, tid):
         super(MakeDataEvent, self).__init__()
@@ -62,6 +65,7 @@ class MakeDataEvent(Event):
 
 class RenamedEvent(Event):
     __event__ = 'renamed'
+    __slots__ = ('ea', 'new_name', 'local_name')
 
     def __init__(self, ea, new_name, local_name):
         super(RenamedEvent, self).__init__()
@@ -77,6 +81,7 @@ class RenamedEvent(Event):
 
 class FuncAddedEvent(Event):
     __event__ = 'func_added'
+    __slots__ = ('start_ea', 'end_ea')
 
     def __init__(self, start_ea, end_ea):
         super(FuncAddedEvent, self).__init__()
@@ -89,6 +94,7 @@ class FuncAddedEvent(Event):
 
 class DeletingFuncEvent(Event):
     __event__ = 'deleting_func'
+    __slots__ = ('start_ea',)
 
     def __init__(self, start_ea):
         super(DeletingFuncEvent, self).__init__()
@@ -100,6 +106,7 @@ class DeletingFuncEvent(Event):
 
 class SetFuncStartEvent(Event):
     __event__ = 'set_func_start'
+    __slots__ = ('start_ea', 'new_start')
 
     def __init__(self, start_ea, new_start):
         super(SetFuncStartEvent, self).__init__()
@@ -112,6 +119,7 @@ class SetFuncStartEvent(Event):
 
 class SetFuncEndEvent(Event):
     __event__ = 'set_func_end'
+    __slots__ = ('start_ea', 'new_end')
 
     def __init__(self, start_ea, new_end):
         super(SetFuncEndEvent, self).__init__()
@@ -124,6 +132,7 @@ class SetFuncEndEvent(Event):
 
 class FuncTailAppendedEvent(Event):
     __event__ = 'func_tail_appended'
+    __slots__ = ('start_ea_func', 'start_ea_tail', 'end_ea_tail')
 
     def __init__(self, start_ea_func, start_ea_tail, end_ea_tail):
         super(FuncTailAppendedEvent, self).__init__()
@@ -139,6 +148,7 @@ class FuncTailAppendedEvent(Event):
 
 class FuncTailDeletedEvent(Event):
     __event__ = 'func_tail_deleted'
+    __slots__ = ('start_ea_func', 'tail_ea')
 
     def __init__(self, start_ea_func, tail_ea):
         super(FuncTailDeletedEvent, self).__init__()
@@ -152,6 +162,7 @@ class FuncTailDeletedEvent(Event):
 
 class TailOwnerChangedEvent(Event):
     __event__ = 'tail_owner_changed'
+    __slots__ = ('tail_ea', 'owner_func')
 
     def __init__(self, tail_ea, owner_func):
         super(TailOwnerChangedEvent, self).__init__()
@@ -165,6 +176,7 @@ class TailOwnerChangedEvent(Event):
 
 class CmtChangedEvent(Event):
     __event__ = 'cmt_changed'
+    __slots__ = ('ea', 'comment', 'rptble')
 
     def __init__(self, ea, comment, rptble):
         super(CmtChangedEvent, self).__init__()
@@ -178,6 +190,7 @@ class CmtChangedEvent(Event):
 
 class ExtraCmtChangedEvent(Event):
     __event__ = 'extra_cmt_changed'
+    __slots__ = ('ea', 'line_idx', 'cmt')
 
     def __init__(self, ea, line_idx, cmt):
         super(ExtraCmtChangedEvent, self).__init__()
@@ -195,6 +208,7 @@ class ExtraCmtChangedEvent(Event):
 
 class TiChangedEvent(Event):
     __event__ = 'ti_changed'
+    __slots__ = ('ea', 'py_type')
 
     def __init__(self, ea, py_type):
         super(TiChangedEvent, self).__init__()
@@ -207,6 +221,7 @@ class TiChangedEvent(Event):
 
 class OpTypeChangedEvent(Event):
     __event__ = 'op_type_changed'
+    __slots__ = ('ea', 'n', 'op', 'extra')
 
     def __init__(self, ea, n, op, extra):
         super(OpTypeChangedEvent, self).__init__()
@@ -233,6 +248,7 @@ class OpTypeChangedEvent(Event):
 
 class EnumCreatedEvent(Event):
     __event__ = 'enum_created'
+    __slots__ = ('enum', 'name')
 
     def __init__(self, enum, name):
         super(EnumCreatedEvent, self).__init__()
@@ -245,6 +261,7 @@ class EnumCreatedEvent(Event):
 
 class EnumDeletedEvent(Event):
     __event__ = 'enum_deleted'
+    __slots__ = ('ename',)
 
     def __init__(self, ename):
         super(EnumDeletedEvent, self).__init__()
@@ -256,6 +273,7 @@ class EnumDeletedEvent(Event):
 
 class EnumRenamedEvent(Event):
     __event__ = 'enum_renamed'
+    __slots__ = ('oldname', 'newname', 'is_enum')
 
     def __init__(self, oldname, newname, is_enum):
         super(EnumRenamedEvent, self).__init__()
@@ -275,6 +293,7 @@ class EnumRenamedEvent(Event):
 
 class EnumBfChangedEvent(Event):
     __event__ = 'enum_bf_changed'
+    __slots__ = ('ename', 'bf_flag')
 
     def __init__(self, ename, bf_flag):
         super(EnumBfChangedEvent, self).__init__()
@@ -288,6 +307,7 @@ class EnumBfChangedEvent(Event):
 
 class EnumCmtChangedEvent(Event):
     __event__ = 'enum_cmt_changed'
+    __slots__ = ('emname', 'cmt', 'repeatable_cmt')
 
     def __init__(self, emname, cmt, repeatable_cmt):
         super(EnumCmtChangedEvent, self).__init__()
@@ -304,6 +324,7 @@ class EnumCmtChangedEvent(Event):
 
 class EnumMemberCreatedEvent(Event):
     __event__ = 'enum_member_created'
+    __slots__ = ('ename', 'name', 'value', 'bmask')
 
     def __init__(self, ename, name, value, bmask):
         super(EnumMemberCreatedEvent, self).__init__()
@@ -320,6 +341,7 @@ class EnumMemberCreatedEvent(Event):
 
 class EnumMemberDeletedEvent(Event):
     __event__ = 'enum_member_deleted'
+    __slots__ = ('ename', 'value', 'serial', 'bmask')
 
     def __init__(self, ename, value, serial, bmask):
         super(EnumMemberDeletedEvent, self).__init__()
@@ -335,6 +357,7 @@ class EnumMemberDeletedEvent(Event):
 
 class StrucCreatedEvent(Event):
     __event__ = 'struc_created'
+    __slots__ = ('struc', 'name', 'is_union')
 
     def __init__(self, struc, name, is_union):
         super(StrucCreatedEvent, self).__init__()
@@ -348,6 +371,7 @@ class StrucCreatedEvent(Event):
 
 class StrucDeletedEvent(Event):
     __event__ = 'struc_deleted'
+    __slots__ = ('sname',)
 
     def __init__(self, sname):
         super(StrucDeletedEvent, self).__init__()
@@ -359,6 +383,7 @@ class StrucDeletedEvent(Event):
 
 class StrucRenamedEvent(Event):
     __event__ = 'struc_renamed'
+    __slots__ = ('oldname', 'newname')
 
     def __init__(self, oldname, newname):
         super(StrucRenamedEvent, self).__init__()
@@ -372,6 +397,7 @@ class StrucRenamedEvent(Event):
 
 class StrucCmtChangedEvent(Event):
     __event__ = 'struc_cmt_changed'
+    __slots__ = ('sname', 'smname', 'cmt', 'repeatable_cmt')
 
     def __init__(self, sname, smname, cmt, repeatable_cmt):
         super(StrucCmtChangedEvent, self).__init__()
@@ -395,6 +421,7 @@ class StrucCmtChangedEvent(Event):
 
 class StrucMemberCreatedEvent(Event):
     __event__ = 'struc_member_created'
+    __slots__ = ('sname', 'fieldname', 'offset', 'flag', 'nbytes', 'extra')
 
     def __init__(self, sname, fieldname, offset, flag, nbytes, extra):
         super(StrucMemberCreatedEvent, self).__init__()
@@ -422,6 +449,7 @@ class StrucMemberCreatedEvent(Event):
 
 class StrucMemberChangedEvent(Event):
     __event__ = 'struc_member_changed'
+    __slots__ = ('sname', 'soff', 'eoff', 'flag', 'extra')
 
     def __init__(self, sname, soff, eoff, flag, extra):
         super(StrucMemberChangedEvent, self).__init__()
@@ -448,6 +476,7 @@ class StrucMemberChangedEvent(Event):
 
 class StrucMemberDeletedEvent(Event):
     __event__ = 'struc_member_deleted'
+    __slots__ = ('sname', 'offset')
 
     def __init__(self, sname, offset):
         super(StrucMemberDeletedEvent, self).__init__()
@@ -461,6 +490,7 @@ class StrucMemberDeletedEvent(Event):
 
 class StrucMemberRenamedEvent(Event):
     __event__ = 'struc_member_renamed'
+    __slots__ = ('sname', 'offset', 'newname')
 
     def __init__(self, sname, offset, newname):
         super(StrucMemberRenamedEvent, self).__init__()
@@ -475,6 +505,7 @@ class StrucMemberRenamedEvent(Event):
 
 class ExpandingStrucEvent(Event):
     __event__ = 'expanding_struc'
+    __slots__ = ('sname', 'offset', 'delta')
 
     def __init__(self, sname, offset, delta):
         super(ExpandingStrucEvent, self).__init__()
@@ -489,6 +520,8 @@ class ExpandingStrucEvent(Event):
 
 class SegmAddedEvent(Event):
     __event__ = 'segm_added_event'
+    __slots__ = ('name', 'class_', 'start_ea', 'end_ea', 'orgbase', 'align',
+                  'comb', 'perm', 'bitness', 'flags')
 
     def __init__(self, name, class_, start_ea, end_ea, orgbase, align,
                  comb, perm, bitness, flags):
@@ -520,6 +553,7 @@ class SegmAddedEvent(Event):
 
 class SegmDeletedEvent(Event):
     __event__ = 'segm_deleted_event'
+    __slots__ = ('ea',)
 
     def __init__(self, ea):
         super(SegmDeletedEvent, self).__init__()
@@ -531,6 +565,7 @@ class SegmDeletedEvent(Event):
 
 class SegmStartChangedEvent(Event):
     __event__ = 'segm_start_changed_event'
+    __slots__ = ('newstart', 'ea')
 
     def __init__(self, newstart, ea):
         super(SegmStartChangedEvent, self).__init__()
@@ -543,6 +578,7 @@ class SegmStartChangedEvent(Event):
 
 class SegmEndChangedEvent(Event):
     __event__ = 'segm_end_changed_event'
+    __slots__ = ('newend', 'ea')
 
     def __init__(self, newend, ea):
         super(SegmEndChangedEvent, self).__init__()
@@ -555,6 +591,7 @@ class SegmEndChangedEvent(Event):
 
 class SegmNameChangedEvent(Event):
     __event__ = 'segm_name_changed_event'
+    __slots__ = ('ea', 'name')
 
     def __init__(self, ea, name):
         super(SegmNameChangedEvent, self).__init__()
@@ -568,6 +605,7 @@ class SegmNameChangedEvent(Event):
 
 class SegmClassChangedEvent(Event):
     __event__ = 'segm_class_changed_event'
+    __slots__ = ('ea', 'sclass')
 
     def __init__(self, ea, sclass):
         super(SegmClassChangedEvent, self).__init__()
@@ -581,6 +619,7 @@ class SegmClassChangedEvent(Event):
 
 class UndefinedEvent(Event):
     __event__ = 'undefined'
+    __slots__ = ('ea',)
 
     def __init__(self, ea):
         super(UndefinedEvent, self).__init__()
@@ -592,6 +631,7 @@ class UndefinedEvent(Event):
 
 class BytePatchedEvent(Event):
     __event__ = 'byte_patched'
+    __slots__ = ('ea', 'value')
 
     def __init__(self, ea, value):
         super(BytePatchedEvent, self).__init__()
@@ -604,6 +644,7 @@ class BytePatchedEvent(Event):
 
 class UserLabelsEvent(Event):
     __event__ = 'user_labels'
+    __slots__ = ('ea', 'labels')
 
     def __init__(self, ea, labels):
         super(UserLabelsEvent, self).__init__()
@@ -620,6 +661,7 @@ class UserLabelsEvent(Event):
 
 class UserCmtsEvent(Event):
     __event__ = 'user_cmts'
+    __slots__ = ('ea', 'cmts')
 
     def __init__(self, ea, cmts):
         super(UserCmtsEvent, self).__init__()
@@ -639,6 +681,7 @@ class UserCmtsEvent(Event):
 
 class UserIflagsEvent(Event):
     __event__ = 'user_iflags'
+    __slots__ = ('ea', 'iflags')
 
     def __init__(self, ea, iflags):
         super(UserIflagsEvent, self).__init__()
@@ -666,6 +709,7 @@ class UserIflagsEvent(Event):
 
 class UserLvarSettingsEvent(Event):
     __event__ = 'user_lvar_settings'
+    __slots__ = ('ea', 'lvar_settings')
 
     def __init__(self, ea, lvar_settings):
         super(UserLvarSettingsEvent, self).__init__()
@@ -42,6 +42,10 @@ class Hooks(object):
         """
         self._plugin.network.send_packet(event)
 
+        # Don't delay the interactive edits by the whole batching window
+        if idaapi.auto_is_ok():
+            self._plugin.network.flush(later=True)
+
 
 class IDBHooks(Hooks, ida_idp.IDB_Hooks):
     """
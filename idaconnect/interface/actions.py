@@ -12,6 +12,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import datetime
 import logging
+import os
 import uuid
 from functools import partial
 
@@ -25,12 +26,19 @@ from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import qApp, QProgressDialog, QMessageBox
 
 from ..shared.commands import (GetRepositories, GetBranches,
-                               NewRepository, NewBranch,
-                               DownloadDatabase, UploadDatabase,
+                               ListRepositories, NewRepository, NewBranch,
+                               DownloadDatabase, ResumeUpload, UploadDatabase,
+                               DownloadSegments, FindSegments, UploadSegments,
                                Subscribe)
+from ..shared.dedup import (FileSegmentSink, SegmentSource,
+                            missing_segments, split_file, split_files)
 from ..shared.models import Repository, Branch
+from ..shared.qtsockets import PoolTask
+from ..shared.streams import (FileSink, FileSource, file_digest,
+                               find_partial, partial_offset, partial_path)
 from ..utilities.misc import local_resource
-from .dialogs import OpenDialog, SaveDialog
+from .dialogs import Listing, OpenDialog, SaveDialog
+from .transfers import Transfer
 
 logger = logging.getLogger('IDAConnect.Interface')
 
@@ -112,6 +120,18 @@ class Action(object):
         logger.debug("Uninstalled the action")
         return True
 
+    def interrupt(self):
+        """
+        Interrupt the transfer in progress, if any, as disconnected.
+        """
+        self._handler.interrupt()
+
+    def resume(self):
+        """
+        Resume the transfer interrupted by a disconnection, if any.
+        """
+        self._handler.resume()
+
     def update(self):
         """
         Force to update the action's state (enabled/disabled).
@@ -133,6 +153,59 @@ class ActionHandler(idaapi.action_handler_t):
         """
         super(ActionHandler, self).__init__()
         self._plugin = plugin
+        self._transfer = None
+
+    def interrupt(self):
+        """
+        Called when disconnected from the server. The transfer is resumed
+        once reconnected, or ended if the user disconnected on purpose.
+        """
+        if not self._transfer:
+            return
+        if self._plugin.network.reconnects:
+            self._transfer.interrupt()
+        else:
+            self._transfer.abort(None)
+
+    def resume(self):
+        """
+        Restart the last transfer if it hasn't completed yet. The transfer
+        continues from where it was interrupted.
+        """
+        if self._transfer:
+            self._transfer.resume()
+
+    def _start_transfer(self, progress, restart):
+        """
+        Start a transfer whose progress is shown by a dialog.
+
+        :param progress: the progress dialog
+        :param restart: called to start or continue the transfer
+        """
+        self._transfer = Transfer(self._plugin.network, progress, restart,
+                                  partial(self._transfer_failed, progress))
+        restart()
+
+    def _transfer_failed(self, progress, error):
+        """
+        Called when the transfer has failed or was cancelled, after its
+        dialog was closed.
+
+        :param progress: the progress dialog
+        :param error: the exception, or None if cancelled
+        """
+        self._transfer = None
+        if error is None:
+            return
+
+        # Show a failure dialog
+        failure = QMessageBox()
+        failure.setIcon(QMessageBox.Critical)
+        failure.setStandardButtons(QMessageBox.Ok)
+        failure.setText("The transfer failed: %s" % error)
+        failure.setWindowTitle(progress.windowTitle())
+        failure.setWindowIcon(progress.windowIcon())
+        failure.exec_()
 
     def update(self, ctx):
         """
@@ -167,13 +240,14 @@ class OpenActionHandler(ActionHandler):
     """
 
     @staticmethod
-    def _progress_callback(progress, count, total):
+    def _progress_callback(progress, count, total, wire=None):
         """
         Called when some data from the file has been received.
 
         :param progress: the progress dialog
         :param count: the number of bytes received
         :param total: the total number of bytes to receive
+        :param wire: the number of bytes received over the network
         """
         progress.setRange(0, total)
         progress.setValue(count)
@@ -185,12 +259,30 @@ class OpenActionHandler(ActionHandler):
         :param ctx: the context
         :return: refresh or not the IDA windows
         """
+        # Ask the server for the first repositories, in a single query
+        if self._plugin.network.features.get('listing'):
+            hash = idautils.GetInputFileMD5() if idc.GetIdbPath() else None
+            query = ListRepositories.Query(hash, None, 0, Listing.PAGE_SIZE)
+            d = self._plugin.network.send_packet(query)
+            d.add_callback(self._on_list_repositories_reply)
+            d.add_errback(logger.exception)
+            return 1
+
         # Ask the server for the list of repositories
         d = self._plugin.network.send_packet(GetRepositories.Query())
         d.add_callback(self._on_get_repository_reply)
         d.add_errback(logger.exception)
         return 1
 
+    def _on_list_repositories_reply(self, reply):
+        """
+        Called when the first repositories are received.
+
+        :param reply: the reply from the server
+        """
+        self._show_dialog(Listing(self._plugin, reply.repos, reply.branches,
+                                  reply.counts, reply.total))
+
     def _on_get_repository_reply(self, reply):
         """
         Called when the list of repositories is received.
@@ -209,7 +301,15 @@ class OpenActionHandler(ActionHandler):
         :param repos: the list of repositories
         :param reply: the reply from the server
         """
-        dialog = OpenDialog(self._plugin, repos, reply.branches)
+        self._show_dialog(Listing(self._plugin, repos, reply.branches))
+
+    def _show_dialog(self, listing):
+        """
+        Show the dialog listing the repositories and branches.
+
+        :param listing: the listing
+        """
+        dialog = OpenDialog(self._plugin, listing)
         dialog.accepted.connect(partial(self._dialog_accepted, dialog))
         dialog.exec_()
 
@@ -232,18 +332,102 @@ class OpenActionHandler(ActionHandler):
         iconPath = self._plugin.resource('download.png')
         progress.setWindowIcon(QIcon(iconPath))
 
-        # Send a packet to download the database
-        packet = DownloadDatabase.Query(repo.hash, branch.uuid)
-        callback = partial(self._progress_callback, progress)
+        self._start_transfer(progress, partial(self._download_database,
+                                               repo, branch, progress))
+        progress.show()
+
+    def _download_database(self, repo, branch, progress):
+        """
+        Download the database, resuming from a previous partial download.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        """
+        # Get the absolute path of the file
+        fileName = branch.uuid + ('.i64' if branch.bits == 64 else '.idb')
+        filePath = local_resource('files', fileName)
+
+        if self._plugin.network.features.get('dedup'):
+            self._download_segments(repo, branch, progress, filePath)
+            return
+
+        # Send a packet to download the rest of the database
+        digest = find_partial(filePath)
+        offset = partial_offset(filePath, digest) if digest else 0
+        packet = DownloadDatabase.Query(repo.hash, branch.uuid, digest, offset)
 
         def setDownloadCallback(reply):
+            def callback(count, total, wire):
+                self._progress_callback(progress, reply.offset + count,
+                                        reply.offset + total, wire)
             reply.downback = callback
+            # Stream the file to disk, keeping it if interrupted
+            reply.sink = FileSink(filePath, digest=reply.digest,
+                                  offset=reply.offset)
 
         d = self._plugin.network.send_packet(packet)
         d.add_initback(setDownloadCallback)
         d.add_callback(partial(self._database_downloaded, branch, progress))
-        d.add_errback(logger.exception)
-        progress.show()
+        d.add_errback(self._transfer.failed)
+
+    def _download_segments(self, repo, branch, progress, filePath):
+        """
+        Download only the segments of the database missing from the copy
+        that was downloaded previously, and from the partial file left by an
+        interrupted download. The files are split on the pool.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param filePath: the path of the file
+        """
+        paths = [filePath]
+        digest = find_partial(filePath)
+        if digest:
+            paths.append(partial_path(filePath, digest))
+        PoolTask(split_files, (paths,),
+                 partial(self._on_files_split, repo, branch, progress,
+                         filePath)).start()
+
+    def _on_files_split(self, repo, branch, progress, filePath, cached,
+                        error):
+        """
+        Called when the files on disk have been split into segments.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param filePath: the path of the file
+        :param cached: the path and segments of each file
+        :param error: the error, or None
+        """
+        if self._transfer is None:
+            return  # the transfer was abandoned meanwhile
+        if error is not None:
+            self._transfer.failed(error)
+            return
+        if not self._plugin.network.connected:
+            return  # the download will be resumed
+
+        known = sorted(set(segment for _, segments in cached
+                           for segment, _ in segments))
+        packet = DownloadSegments.Query(repo.hash, branch.uuid, known)
+
+        def setDownloadCallback(reply):
+            reply.downback = partial(self._progress_callback, progress)
+            # Assemble the file from the cached and the received segments
+            if reply.segments is None:
+                reply.sink = FileSink(filePath)
+            else:
+                reply.sink = FileSegmentSink(filePath, reply.digest,
+                                             reply.segments, reply.missing,
+                                             cached)
+
+        d = self._plugin.network.send_packet(packet)
+        d.add_initback(setDownloadCallback)
+        d.add_callback(partial(self._database_downloaded, branch, progress))
+        d.add_errback(self._transfer.failed)
 
     def _database_downloaded(self, branch, progress, reply):
         """
@@ -255,15 +439,12 @@ class OpenActionHandler(ActionHandler):
         """
         # Close the progress dialog
         self._progress_callback(progress, 1, 1)
+        self._transfer.succeeded()
+        self._transfer = None
 
-        # Get the absolute path of the file
-        fileName = branch.uuid + ('.i64' if branch.bits == 64 else '.idb')
-        filePath = local_resource('files', fileName)
-
-        # Write the packet content to disk
-        with open(filePath, 'wb') as outputFile:
-            outputFile.write(reply.content)
-        logger.info("Saved file %s" % fileName)
+        # The packet content has already been written to disk
+        filePath = reply.sink.path
+        logger.info("Saved file %s" % os.path.basename(filePath))
 
         # Show a success dialog
         # success = QMessageBox()
@@ -307,13 +488,14 @@ class SaveActionHandler(ActionHandler):
     """
 
     @staticmethod
-    def _progress_callback(progress, count, total):
+    def _progress_callback(progress, count, total, wire=None):
         """
         Called when some data from the file has been sent.
 
         :param progress: the progress dialog
         :param count: the number of bytes sent
         :param total: the total number of bytes to send
+        :param wire: the number of bytes sent over the network
         """
         progress.setRange(0, total)
         progress.setValue(count)
@@ -330,12 +512,30 @@ class SaveActionHandler(ActionHandler):
         :param ctx: the context
         :return: refresh or not the IDA windows
         """
+        # Ask the server for the first repositories, in a single query
+        if self._plugin.network.features.get('listing'):
+            hash = idautils.GetInputFileMD5() if idc.GetIdbPath() else None
+            query = ListRepositories.Query(hash, None, 0, Listing.PAGE_SIZE)
+            d = self._plugin.network.send_packet(query)
+            d.add_callback(self._on_list_repositories_reply)
+            d.add_errback(logger.exception)
+            return 1
+
         # Ask the server for the list of repositories
         d = self._plugin.network.send_packet(GetRepositories.Query())
         d.add_callback(self._on_get_repository_reply)
         d.add_errback(logger.exception)
         return 1
 
+    def _on_list_repositories_reply(self, reply):
+        """
+        Called when the first repositories are received.
+
+        :param reply: the reply from the server
+        """
+        self._show_dialog(Listing(self._plugin, reply.repos, reply.branches,
+                                  reply.counts, reply.total))
+
     def _on_get_repository_reply(self, reply):
         """
         Called when the list of repositories is received.
@@ -354,7 +554,15 @@ class SaveActionHandler(ActionHandler):
         :param repos: the list of repositories
         :param reply: the reply from the server
         """
-        dialog = SaveDialog(self._plugin, repos, reply.branches)
+        self._show_dialog(Listing(self._plugin, repos, reply.branches))
+
+    def _show_dialog(self, listing):
+        """
+        Show the dialog listing the repositories and branches.
+
+        :param listing: the listing
+        """
+        dialog = SaveDialog(self._plugin, listing)
         dialog.accepted.connect(partial(self._dialog_accepted, dialog))
         dialog.exec_()
 
@@ -403,15 +611,9 @@ class SaveActionHandler(ActionHandler):
         self._plugin.core.save_netnode()
         idc.save_database(idc.GetIdbPath(), 0)
 
-        # Create the packet that will hold the database
-        packet = UploadDatabase.Query(repo.hash, branch.uuid)
-        inputPath = idc.GetIdbPath()
-        with open(inputPath, 'rb') as inputFile:
-            packet.content = inputFile.read()
-
         # Create the progress dialog
         text = "Uploading database to server, please wait..."
-        progress = QProgressDialog(text, "Cancel", 0, len(packet.content))
+        progress = QProgressDialog(text, "Cancel", 0, 1)
         progress.setCancelButton(None)  # Remove cancel button
         progress.setModal(True)  # Set as a modal dialog
         windowFlags = progress.windowFlags()  # Disable close button
@@ -420,14 +622,160 @@ class SaveActionHandler(ActionHandler):
         iconPath = self._plugin.resource('upload.png')
         progress.setWindowIcon(QIcon(iconPath))
         progress.show()
+        self._start_transfer(progress, partial(self._upload_database,
+                                               repo, branch, progress))
+
+    def _upload_database(self, repo, branch, progress):
+        """
+        Upload the database, resuming from a previous partial upload.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        """
+        if self._plugin.network.features.get('dedup'):
+            self._upload_segments(repo, branch, progress)
+            return
+
+        # Hash the database on the pool, not to block the UI
+        PoolTask(file_digest, (idc.GetIdbPath(),),
+                 partial(self._on_database_hashed, repo, branch,
+                         progress)).start()
+
+    def _on_database_hashed(self, repo, branch, progress, digest, error):
+        """
+        Called when the digest of the database has been computed.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param digest: the digest of the database
+        :param error: the error, or None
+        """
+        if self._transfer is None:
+            return  # the transfer was abandoned meanwhile
+        if error is not None:
+            self._transfer.failed(error)
+            return
+        if not self._plugin.network.connected:
+            return  # the upload will be resumed
+
+        # Ask the server how much of the file it already has
+        if self._plugin.network.features.get('resume'):
+            query = ResumeUpload.Query(repo.hash, branch.uuid, digest)
+            d = self._plugin.network.send_packet(query)
+            d.add_callback(partial(self._on_resume_upload_reply,
+                                   repo, branch, progress, digest))
+            d.add_errback(self._transfer.failed)
+        else:
+            self._send_database(repo, branch, progress, digest, 0)
+
+    def _on_resume_upload_reply(self, repo, branch, progress, digest, reply):
+        """
+        Called when the server replied with how much of the file it has.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param digest: the digest of the database
+        :param reply: the reply from the server
+        """
+        self._send_database(repo, branch, progress, digest, reply.offset)
+
+    def _send_database(self, repo, branch, progress, digest, offset):
+        """
+        Send the rest of the database, from the specified offset.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param digest: the digest of the database
+        :param offset: the offset
+        """
+        # Create the packet that will hold the database
+        packet = UploadDatabase.Query(repo.hash, branch.uuid, digest, offset)
+        packet.source = FileSource(idc.GetIdbPath(), offset)
+
+        def callback(count, total, wire):
+            self._progress_callback(progress, offset + count, offset + total,
+                                    wire)
 
         # Send the packet to upload the file
+        packet.upback = callback
+        d = self._plugin.network.send_packet(packet)
+        d.add_callback(partial(self._database_uploaded, repo, branch))
+        d.add_errback(self._transfer.failed)
+
+    def _upload_segments(self, repo, branch, progress):
+        """
+        Upload only the segments of the database the server doesn't have.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        """
+        # Split the database on the pool, not to block the UI
+        PoolTask(split_file, (idc.GetIdbPath(),),
+                 partial(self._on_database_split, repo, branch,
+                         progress)).start()
+
+    def _on_database_split(self, repo, branch, progress, manifest, error):
+        """
+        Called when the database has been split into segments. As the server
+        stores the segments as they are received, an interrupted upload only
+        sends the segments it is still missing when resumed.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param manifest: the digest and segments of the database
+        :param error: the error, or None
+        """
+        if self._transfer is None:
+            return  # the transfer was abandoned meanwhile
+        if error is not None:
+            self._transfer.failed(error)
+            return
+        if not self._plugin.network.connected:
+            return  # the upload will be resumed
+        digest, segments = manifest
+
+        # Ask the server which segments of the file it is missing
+        unique = sorted(set(segment for segment, _ in segments))
+        query = FindSegments.Query(repo.hash, unique)
+        d = self._plugin.network.send_packet(query)
+        d.add_callback(partial(self._on_find_segments_reply, repo, branch,
+                               progress, digest, segments))
+        d.add_errback(self._transfer.failed)
+
+    def _on_find_segments_reply(self, repo, branch, progress, digest,
+                                segments, reply):
+        """
+        Send the segments missing on the server.
+
+        :param repo: the repository
+        :param branch: the branch
+        :param progress: the progress dialog
+        :param digest: the digest of the database
+        :param segments: the segments of the database
+        :param reply: the reply from the server
+        """
+        known = set(segment for segment, _ in segments) - set(reply.missing)
+        missing, ranges = missing_segments(segments, known)
+        packet = UploadSegments.Query(repo.hash, branch.uuid, digest,
+                                      segments, missing)
+        packet.source = SegmentSource(idc.GetIdbPath(), ranges)
+
+        # Send the packet to upload the segments
         packet.upback = partial(self._progress_callback, progress)
         d = self._plugin.network.send_packet(packet)
         d.add_callback(partial(self._database_uploaded, repo, branch))
-        d.add_errback(logger.exception)
+        d.add_errback(self._transfer.failed)
 
     def _database_uploaded(self, repo, branch, _):
+        self._transfer.succeeded()
+        self._transfer = None
+
         # Show a success dialog
         success = QMessageBox()
         success.setIcon(QMessageBox.Information)
@@ -11,7 +11,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import logging
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from functools import partial
 
 from PyQt5.QtCore import Qt
@@ -21,28 +21,148 @@ from PyQt5.QtWidgets import (QDialog, QHBoxLayout, QVBoxLayout,
                              QTableWidgetItem, QGroupBox, QLabel, QPushButton,
                              QLineEdit)
 
+from ..shared.commands import GetBranches, ListRepositories
 from ..shared.models import Repository
 
 logger = logging.getLogger('IDAConnect.Interface')
 
 
+class Listing(object):
+    """
+    The repositories and branches listed by the server. When the server
+    lists them page by page, the next pages are fetched as the dialogs
+    display them.
+    """
+    # Number of repositories or branches fetched at once
+    PAGE_SIZE = 100
+
+    def __init__(self, plugin, repos, branches, counts=None, total=None):
+        """
+        Initialize the listing.
+
+        :param plugin: the plugin instance
+        :param repos: the first repositories
+        :param branches: the first branches
+        :param counts: the number of branches of each repository, or None if
+            they were all listed
+        :param total: the number of repositories, or None if they were all
+            listed
+        """
+        super(Listing, self).__init__()
+        self._plugin = plugin
+        self._repos = list(repos)
+        self._total = len(self._repos) if total is None else total
+        self._counts = None
+        if counts is not None:
+            self._counts = {repo.hash: count
+                            for repo, count in zip(repos, counts)}
+        self._branches = defaultdict(list)
+        for branch in branches:
+            self._branches[branch.hash].append(branch)
+        self._fetching = set()
+
+    @property
+    def repos(self):
+        """
+        Get the repositories listed so far.
+
+        :return: the repositories
+        """
+        return self._repos
+
+    def branches(self, hash):
+        """
+        Get the branches of a repository listed so far.
+
+        :param hash: the repository hash
+        :return: the branches
+        """
+        return self._branches[hash]
+
+    def fetch_repos(self, callback):
+        """
+        Fetch the next page of repositories, if any.
+
+        :param callback: called with the repositories fetched
+        """
+        if len(self._repos) >= self._total:
+            return
+
+        def reposListed(reply):
+            self._repos += reply.repos
+            self._counts.update(zip([repo.hash for repo in reply.repos],
+                                    reply.counts))
+            self._total = reply.total
+            callback(reply.repos)
+
+        query = ListRepositories.Query(None, None, len(self._repos),
+                                       Listing.PAGE_SIZE)
+        self._fetch(None, query, reposListed)
+
+    def fetch_branches(self, hash, callback):
+        """
+        Fetch the next page of branches of a repository, if any.
+
+        :param hash: the repository hash
+        :param callback: called with the branches fetched
+        """
+        if self._counts is None \
+                or len(self._branches[hash]) >= self._counts.get(hash, 0):
+            return
+
+        def branchesListed(reply):
+            self._branches[hash] += reply.branches
+            callback(reply.branches)
+
+        query = GetBranches.Query(hash, None, len(self._branches[hash]),
+                                  Listing.PAGE_SIZE)
+        self._fetch(hash, query, branchesListed)
+
+    def _fetch(self, key, query, callback):
+        """
+        Send a query fetching a page, unless the same page is being fetched.
+
+        :param key: the repository hash, or None for the repositories
+        :param query: the query
+        :param callback: called with the reply
+        """
+        if key in self._fetching:
+            return
+        self._fetching.add(key)
+
+        def pageFetched(reply):
+            self._fetching.discard(key)
+            callback(reply)
+
+        def pageFailed(error):
+            self._fetching.discard(key)
+            logger.exception(error)
+
+        d = self._plugin.network.send_packet(query)
+        if d:
+            d.add_callback(pageFetched)
+            d.add_errback(pageFailed)
+        else:
+            self._fetching.discard(key)
+
+
 class OpenDialog(QDialog):
     """
     The open dialog allowing an user to select a remote database to download.
     """
 
-    def __init__(self, plugin, repos, branches):
+    def __init__(self, plugin, listing):
         """
         Initialize the open dialog.
 
         :param plugin: the plugin instance
-        :param repos: the list of repositories
-        :param branches: the list of branches
+        :param listing: the listing of the repositories and branches
         """
         super(OpenDialog, self).__init__()
         self._plugin = plugin
-        self._repos = repos
-        self._branches = branches
+        self._listing = listing
+        self._repo = None
+        repos = listing.repos
 
         # General setup of the dialog
         logger.debug("Showing open database dialog")
@@ -67,6 +187,8 @@ class OpenDialog(QDialog):
         self._reposTable.setSelectionBehavior(QTableWidget.SelectRows)
         self._reposTable.setSelectionMode(QTableWidget.SingleSelection)
         self._reposTable.itemClicked.connect(self._repo_clicked)
+        self._reposTable.verticalScrollBar().valueChanged.connect(
+            self._repos_scrolled)
         minSZ = self._reposTable.minimumSize()
         self._reposTable.setMinimumSize(300, minSZ.height())
         maxSZ = self._reposTable.maximumSize()
@@ -100,6 +222,8 @@ class OpenDialog(QDialog):
         self._branchesTable.setSelectionBehavior(QTableWidget.SelectRows)
         self._branchesTable.setSelectionMode(QTableWidget.SingleSelection)
         self._branchesTable.itemClicked.connect(self._branch_clicked)
+        self._branchesTable.verticalScrollBar().valueChanged.connect(
+            self._branches_scrolled)
         branchesLayout.addWidget(self._branchesTable, 0, 0)
         rightLayout.addWidget(branchesGroup)
 
@@ -123,13 +247,75 @@ class OpenDialog(QDialog):
         :param item: the item clicked
         """
         repo = item.data(Qt.UserRole)
+        self._repo = repo
         self._fileLabel.setText('<b>File:</b> %s' % str(repo.file))
         self._hashLabel.setText('<b>Hash:</b> %s' % str(repo.hash))
         self._typeLabel.setText('<b>Type:</b> %s' % str(repo.type))
         self._dateLabel.setText('<b>Date:</b> %s' % str(repo.date))
+        self._openButton.setEnabled(False)
+        self._branchesTable.setRowCount(0)
+        self._show_branches()
+        if not self._listing.branches(repo.hash):
+            self._fetch_branches()
+
+    def _repos_scrolled(self, value):
+        """
+        Called when the repositories table is scrolled, will fetch the next
+        repositories once the end is reached.
+
+        :param value: the position of the scroll bar
+        """
+        if value == self._reposTable.verticalScrollBar().maximum():
+            self._listing.fetch_repos(self._repos_fetched)
 
-        # Display the list of branches for the selected repository
-        branches = [br for br in self._branches if br.hash == repo.hash]
+    def _repos_fetched(self, repos):
+        """
+        Called when the next repositories have been fetched.
+
+        :param repos: the repositories
+        """
+        count = self._reposTable.rowCount()
+        self._reposTable.setRowCount(count + len(repos))
+        for i, repo in enumerate(repos):
+            item = QTableWidgetItem("%s (%s)" % (str(repo.file),
+                                                 str(repo.hash)))
+            item.setData(Qt.UserRole, repo)
+            item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+            self._reposTable.setItem(count + i, 0, item)
+
+    def _branches_scrolled(self, value):
+        """
+        Called when the branches table is scrolled, will fetch the next
+        branches once the end is reached.
+
+        :param value: the position of the scroll bar
+        """
+        if value == self._branchesTable.verticalScrollBar().maximum():
+            self._fetch_branches()
+
+    def _fetch_branches(self):
+        """
+        Fetch the next branches of the selected repository.
+        """
+        if self._repo:
+            self._listing.fetch_branches(
+                self._repo.hash, partial(self._branches_fetched, self._repo))
+
+    def _branches_fetched(self, repo, _):
+        """
+        Called when the next branches of a repository have been fetched.
+
+        :param repo: the repository
+        """
+        if self._repo and repo.hash == self._repo.hash:
+            self._show_branches()
+
+    def _show_branches(self):
+        """
+        Display the list of branches for the selected repository.
+        """
+        row = self._branchesTable.currentRow()
+        branches = self._listing.branches(self._repo.hash)
         self._branchesTable.setRowCount(len(branches))
         for i, branch in enumerate(branches):
             item = QTableWidgetItem(str(branch.uuid))
@@ -140,6 +326,8 @@ class OpenDialog(QDialog):
             item.setData(Qt.UserRole, branch)
             item.setFlags(item.flags() & ~Qt.ItemIsEditable)
             self._branchesTable.setItem(i, 1, item)
+        if row >= 0:
+            self._branchesTable.setCurrentCell(row, 0)
 
     def _branch_clicked(self, _):
         """
@@ -162,18 +350,18 @@ class SaveDialog(QDialog):
     The save dialog allowing an user to select a remote database to upload to.
     """
 
-    def __init__(self, plugin, repos, branches):
+    def __init__(self, plugin, listing):
         """
         Initialize the save dialog.
 
         :param plugin: the plugin instance
-        :param repos: the list of repositories
-        :param branches: the list of branches
+        :param listing: the listing of the repositories and branches
         """
         super(SaveDialog, self).__init__()
         self._plugin = plugin
-        self._repos = repos
-        self._branches = branches
+        self._listing = listing
+        self._repo = None
+        repos = listing.repos
 
         # General setup of the dialog
         logger.debug("Showing save database dialog")
@@ -202,6 +390,8 @@ class SaveDialog(QDialog):
         self._reposTable.setSelectionBehavior(QTableWidget.SelectRows)
         self._reposTable.setSelectionMode(QTableWidget.SingleSelection)
         self._reposTable.itemClicked.connect(self._repo_clicked)
+        self._reposTable.verticalScrollBar().valueChanged.connect(
+            self._repos_scrolled)
         minSZ = self._reposTable.minimumSize()
         self._reposTable.setMinimumSize(300, minSZ.height())
         maxSZ = self._reposTable.maximumSize()
@@ -234,6 +424,8 @@ class SaveDialog(QDialog):
         self._branchesTable.verticalHeader().setVisible(False)
         self._branchesTable.setSelectionBehavior(QTableWidget.SelectRows)
         self._branchesTable.setSelectionMode(QTableWidget.SingleSelection)
+        self._branchesTable.verticalScrollBar().valueChanged.connect(
+            self._branches_scrolled)
         branchesLayout.addWidget(self._branchesTable, 0, 0)
         rightLayout.addWidget(branchesGroup)
 
@@ -258,14 +450,78 @@ class SaveDialog(QDialog):
         """
         repo = item.data(Qt.UserRole)
         repo = repo if repo else Repository('', '', '', '')
+        self._repo = repo
         self._saveButton.setEnabled(True)
         self._fileLabel.setText('<b>File:</b> %s' % str(repo.file))
         self._hashLabel.setText('<b>Hash:</b> %s' % str(repo.hash))
         self._typeLabel.setText('<b>Type:</b> %s' % str(repo.type))
         self._dateLabel.setText('<b>Date:</b> %s' % str(repo.date))
+        self._branchesTable.setRowCount(0)
+        self._show_branches()
+        if repo.hash and not self._listing.branches(repo.hash):
+            self._fetch_branches()
+
+    def _repos_scrolled(self, value):
+        """
+        Called when the repositories table is scrolled, will fetch the next
+        repositories once the end is reached.
+
+        :param value: the position of the scroll bar
+        """
+        if value == self._reposTable.verticalScrollBar().maximum():
+            self._listing.fetch_repos(self._repos_fetched)
+
+    def _repos_fetched(self, repos):
+        """
+        Called when the next repositories have been fetched, which are
+        inserted before the new repository item.
 
-        # Display the list of branches for the selected repository
-        branches = [br for br in self._branches if br.hash == repo.hash]
+        :param repos: the repositories
+        """
+        count = self._reposTable.rowCount() - 1
+        for i, repo in enumerate(repos):
+            self._reposTable.insertRow(count + i)
+            item = QTableWidgetItem("%s (%s)" % (str(repo.file),
+                                                 str(repo.hash)))
+            item.setData(Qt.UserRole, repo)
+            item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+            self._reposTable.setItem(count + i, 0, item)
+
+    def _branches_scrolled(self, value):
+        """
+        Called when the branches table is scrolled, will fetch the next
+        branches once the end is reached.
+
+        :param value: the position of the scroll bar
+        """
+        if value == self._branchesTable.verticalScrollBar().maximum():
+            self._fetch_branches()
+
+    def _fetch_branches(self):
+        """
+        Fetch the next branches of the selected repository.
+        """
+        if self._repo and self._repo.hash:
+            self._listing.fetch_branches(
+                self._repo.hash, partial(self._branches_fetched, self._repo))
+
+    def _branches_fetched(self, repo, _):
+        """
+        Called when the next branches of a repository have been fetched.
+
+        :param repo: the repository
+        """
+        if self._repo and repo.hash == self._repo.hash:
+            self._show_branches()
+
+    def _show_branches(self):
+        """
+        Display the list of branches for the selected repository, followed
+        by the new branch item.
+        """
+        row = self._branchesTable.currentRow()
+        newRow = self._branchesTable.rowCount() - 1
+        branches = self._listing.branches(self._repo.hash)
         self._branchesTable.setRowCount(len(branches) + 1)
         for i, br in enumerate(branches):
             item = QTableWidgetItem(str(br.uuid))
@@ -277,13 +533,17 @@ class SaveDialog(QDialog):
             item.setFlags(item.flags() & ~Qt.ItemIsEditable)
             self._branchesTable.setItem(i, 1, item)
         newItem = QTableWidgetItem("<new branch>")
-        item.setData(Qt.UserRole, None)
+        newItem.setData(Qt.UserRole, None)
         newItem.setFlags(newItem.flags() & ~Qt.ItemIsEditable)
         self._branchesTable.setItem(len(branches), 0, newItem)
         newItem = QTableWidgetItem()
-        item.setData(Qt.UserRole, None)
+        newItem.setData(Qt.UserRole, None)
         newItem.setFlags(newItem.flags() & ~Qt.ItemIsEditable)
         self._branchesTable.setItem(len(branches), 1, newItem)
+        if row >= 0:
+            # Keep the new branch item selected, as it moves down
+            self._branchesTable.setCurrentCell(
+                len(branches) if row == newRow else row, 0)
 
     def _branch_clicked(self, _):
         """
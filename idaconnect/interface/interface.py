@@ -100,10 +100,34 @@ class Interface(Module):
         self._openAction.update()
         self._saveAction.update()
 
+    def interrupt_transfers(self):
+        """
+        Interrupt the transfers in progress, as disconnected.
+        """
+        self._openAction.interrupt()
+        self._saveAction.interrupt()
+
+    def resume_transfers(self):
+        """
+        Resume the transfers that were interrupted by a disconnection.
+        """
+        self._openAction.resume()
+        self._saveAction.resume()
+
+    def update_rtt(self, rtt):
+        """
+        Display the round-trip time measured with the server.
+
+        :param rtt: the time in seconds
+        """
+        self._statusWidget.set_rtt(rtt)
+
     def notify_disconnected(self):
         self._statusWidget.set_state(StatusWidget.STATE_DISCONNECTED)
         self._statusWidget.set_server(StatusWidget.SERVER_DISCONNECTED)
+        self._statusWidget.set_rtt(None)
         self._update_actions()
+        self.interrupt_transfers()
 
     def notify_connecting(self):
         self._statusWidget.set_state(StatusWidget.STATE_CONNECTING)
@@ -0,0 +1,118 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+logger = logging.getLogger('IDAConnect.Interface')
+
+
+class Transfer(object):
+    """
+    A download or an upload of a database, whose progress is shown by a
+    modal dialog the user cannot dismiss. It is restarted once reconnected
+    if the connection is lost, and can only be cancelled meanwhile. It
+    always ends by closing the dialog, reporting the error if it failed.
+    """
+
+    def __init__(self, network, progress, restart, report):
+        """
+        Initialize the transfer.
+
+        :param network: the network module
+        :param progress: the progress dialog
+        :param restart: called to continue the transfer from where it was
+            interrupted
+        :param report: called with the error if the transfer failed, or
+            None if it was cancelled
+        """
+        super(Transfer, self).__init__()
+        self._network = network
+        self._progress = progress
+        self._restart = restart
+        self._report = report
+        self._ended = False
+        self._interrupted = False
+        self._text = None
+        progress.canceled.connect(self.cancel)
+
+    @property
+    def ended(self):
+        """
+        Return if the transfer has either succeeded or failed.
+
+        :return: has ended?
+        """
+        return self._ended
+
+    def interrupt(self):
+        """
+        Called when the connection was lost. The user can cancel the
+        transfer until it is resumed.
+        """
+        if self._ended or self._interrupted:
+            return
+        self._interrupted = True
+        self._text = self._progress.labelText()
+        self._progress.setLabelText("Connection lost, waiting to resume...")
+        self._progress.setCancelButtonText("Cancel")
+
+    def resume(self):
+        """
+        Continue the transfer, interrupted by a disconnection.
+        """
+        if self._ended:
+            return
+        if self._interrupted:
+            self._interrupted = False
+            self._progress.setLabelText(self._text)
+            self._progress.setCancelButton(None)
+        logger.info("Resuming interrupted transfer")
+        self._restart()
+
+    def cancel(self):
+        """
+        Called when the user cancelled the transfer, only possible while it
+        is interrupted.
+        """
+        if self._interrupted:
+            logger.info("Interrupted transfer cancelled")
+            self.abort(None)
+
+    def succeeded(self):
+        """
+        Called when the transfer has completed.
+        """
+        self._ended = True
+        self._progress.close()
+
+    def failed(self, error):
+        """
+        Called when a step of the transfer failed. The transfer is resumed
+        once reconnected if the connection was lost, and ended otherwise.
+
+        :param error: the exception
+        """
+        logger.exception(error)
+        if self._network.connected:
+            self.abort(error)
+
+    def abort(self, error):
+        """
+        End the transfer, closing its dialog and reporting the error.
+
+        :param error: the exception, or None if cancelled
+        """
+        if self._ended:
+            return
+        self._ended = True
+        self._progress.close()
+        self._report(error)
@@ -43,6 +43,7 @@ class StatusWidget(QWidget):
 
         self._state = self.STATE_DISCONNECTED
         self._server = self.SERVER_DISCONNECTED
+        self._rtt = None
 
         # Set a custom context menu policy
         self.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -63,6 +64,8 @@ class StatusWidget(QWidget):
             self.STATE_CONNECTED: ('green', 'Connected', 'connected.png')
         }
         color, text, icon = byState[self._state]
+        if self._state == self.STATE_CONNECTED and self._rtt is not None:
+            text += ' (%d ms)' % self._rtt
 
         # Update the text of the widget
         textFmt = '%s -- <span style="color: %s;">%s</span>'
@@ -98,6 +101,13 @@ class StatusWidget(QWidget):
         logger.debug("Opening widget context menu")
         menu = QMenu(self)
 
+        # Add the cancellation of the connection in progress
+        if self._plugin.network.connecting:
+            cancel = QAction('Cancel Connection', menu)
+            cancel.triggered.connect(self._plugin.network.disconnect)
+            menu.addAction(cancel)
+            menu.addSeparator()
+
         # Add the network settings
         settings = QAction('Network Settings', menu)
         iconPath = self._plugin.resource('settings.png')
@@ -118,6 +128,7 @@ class StatusWidget(QWidget):
 
             def serverActionTriggered(serverAction):
                 if not self._plugin.network.connected and \
+                       not self._plugin.network.connecting and \
                        serverAction.isChecked():
                     self._plugin.network.connect(serverAction._server.host,
                                                  serverAction._server.port)
@@ -170,3 +181,14 @@ class StatusWidget(QWidget):
         if server != self._server:
             self._server = server
             self._update()
+
+    def set_rtt(self, rtt):
+        """
+        Set the round-trip time measured with the server.
+
+        :param rtt: the time in seconds, or None
+        """
+        rtt = int(round(rtt * 1000)) if rtt is not None else None
+        if rtt != self._rtt:
+            self._rtt = rtt
+            self._update()
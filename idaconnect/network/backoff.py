@@ -0,0 +1,31 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import random
+
+
+def backoff_delay(attempts, minimum, maximum):
+    """
+    Get the delay before the next attempt to reconnect, doubling with each
+    failed attempt up to a maximum. Only half of it is fixed, the other half
+    is random, so that the clients of a server that went down don't all come
+    back at the same time.
+
+    :param attempts: the number of failed attempts
+    :param minimum: the delay after the first failure (seconds)
+    :param maximum: the maximum delay (seconds)
+    :return: the delay (seconds)
+    """
+    delay = float(maximum)
+    if attempts < 32:
+        delay = min(minimum * 2 ** attempts, delay)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -12,16 +12,23 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import logging
 
-from ..shared.packets import Event
+from PyQt5.QtCore import QTimer
+
+from ..shared.commands import Resubscribe, Subscribe
+from ..shared.packets import Batch, Event
+from ..shared.qtsockets import QtClientSocket
 from ..shared.sockets import ClientSocket
 
 logger = logging.getLogger('IDAConnect.Network')
 
 
-class Client(ClientSocket):
+class Client(QtClientSocket):
     """
     The client (client-side) implementation.
     """
+    # Bounds of the window during which the events are batched (ms)
+    BATCH_WINDOW_MIN = 5
+    BATCH_WINDOW_MAX = 100
 
     def __init__(self, plugin, parent=None):
         """
@@ -30,33 +37,111 @@ class Client(ClientSocket):
         :param plugin: the plugin instance
         :param parent: the parent object
         """
-        ClientSocket.__init__(self, logger, parent)
+        QtClientSocket.__init__(self, logger, parent)
         self._plugin = plugin
 
+        self._batch = []
+        self._batch_timer = QTimer()
+        self._batch_timer.setSingleShot(True)
+        self._batch_timer.timeout.connect(self.flush)
+
+    def connect(self, sock):
+        ClientSocket.connect(self, sock)
+
+        # Negotiate the connection features
+        self.handshake()
+
+    def set_features(self, features):
+        ClientSocket.set_features(self, features)
+
+        # Resume the transfers interrupted by a disconnection
+        self._plugin.interface.resume_transfers()
+
+    def rtt_updated(self):
+        self._plugin.interface.update_rtt(self.rtt)
+
     def disconnect(self, err=None):
         ClientSocket.disconnect(self, err)
+        self._batch_timer.stop()
+        events, self._batch = self._batch, []
         logger.info("Connection lost")
 
+        # Send the events that were batched once reconnected
+        self._plugin.network.keep_events(events)
+
         # Notify the plugin
         self._plugin.notify_disconnected()
 
     def recv_packet(self, packet):
+        if isinstance(packet, Resubscribe):
+            # Catch up on the events the server stopped sending us
+            core = self._plugin.core
+            if core.repo and core.branch:
+                self.send_packet(Subscribe(core.repo, core.branch, core.tick))
+            return True
+
         if isinstance(packet, Event):
-            # Call the event
-            self._plugin.core.unhook_all()
+            events = [packet]
+        elif isinstance(packet, Batch):
+            events = packet.events
+        else:
+            return False
+
+        # Call the events
+        self._plugin.core.unhook_all()
+        for event in events:
             try:
-                packet()
+                event()
             except Exception as e:
                 self._logger.warning('Error while calling event')
                 self._logger.exception(e)
-            self._plugin.core.tick = max(self._plugin.core.tick, packet.tick)
-            self._plugin.core.hook_all()
-        else:
-            return False
+            self._plugin.core.tick = max(self._plugin.core.tick, event.tick)
+        self._plugin.core.hook_all()
         return True
 
-    def send_packet(self, packet):
+    def send_packet(self, packet, timeout=None):
         if isinstance(packet, Event):
             self._plugin.core.tick += 1
             packet.tick = self._plugin.core.tick
-        return ClientSocket.send_packet(self, packet)
+
+            # Accumulate the events if the server accepts batches
+            if self.batching:
+                self._batch.append(packet)
+                if len(self._batch) >= self.BATCH_SIZE:
+                    self.flush()
+                elif not self._batch_timer.isActive():
+                    self._batch_timer.start(self._batch_window())
+                return None
+        else:
+            # Keep the packets ordered with the pending events
+            self.flush()
+        return ClientSocket.send_packet(self, packet, timeout)
+
+    def flush(self, later=False):
+        """
+        Send the pending events to the server.
+
+        :param later: wait for the control to return to the event loop
+        """
+        if later:
+            if self._batch:
+                self._batch_timer.start(0)
+            return
+
+        self._batch_timer.stop()
+        if not self._batch:
+            return
+        events, self._batch = self._batch, []
+        packet = events[0] if len(events) == 1 else Batch(events)
+        ClientSocket.send_packet(self, packet)
+
+    def _batch_window(self):
+        """
+        Compute how long the events should be accumulated for. It grows with
+        the round-trip time, as the latency is already dominated by it.
+
+        :return: the window in milliseconds
+        """
+        window = self.rtt * 1000 / 2 if self.rtt else 0
+        return int(min(max(window, Client.BATCH_WINDOW_MIN),
+                       Client.BATCH_WINDOW_MAX))
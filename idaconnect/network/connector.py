@@ -0,0 +1,268 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import errno
+import logging
+import os
+import socket
+
+from PyQt5.QtCore import (QCoreApplication, QEvent, QObject, QSocketNotifier,
+                          QTimer)
+
+from ..shared.streams import get_pool
+
+logger = logging.getLogger('IDAConnect.Network')
+
+# Errors of a non-blocking connect still in progress
+IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK,
+               getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+
+
+def connect_error(err):
+    """
+    Create the exception of a connect that failed.
+
+    :param err: the error number
+    :return: the exception
+    """
+    return socket.error(err, os.strerror(err))
+
+
+class ResolvedEvent(QEvent):
+    """
+    A Qt-event fired when the addresses of the host have been resolved.
+    """
+    TYPE = QEvent.Type(QEvent.registerEventType())
+
+    def __init__(self, result):
+        """
+        Initializes the new resolved event.
+
+        :param result: the addresses, or the error
+        """
+        super(ResolvedEvent, self).__init__(ResolvedEvent.TYPE)
+        self.result = result
+
+
+def interleave(addresses):
+    """
+    Order the addresses by alternating their families, starting with the
+    family preferred by the resolver (RFC 8305).
+
+    :param addresses: the results of getaddrinfo
+    :return: the ordered results
+    """
+    families = []
+    byFamily = {}
+    for address in addresses:
+        if address[0] not in byFamily:
+            families.append(address[0])
+            byFamily[address[0]] = []
+        byFamily[address[0]].append(address)
+    ordered = []
+    while any(byFamily.values()):
+        for family in families:
+            if byFamily[family]:
+                ordered.append(byFamily[family].pop(0))
+    return ordered
+
+
+class Connector(QObject):
+    """
+    Connects to a server without blocking the UI. The host is resolved on
+    the pool, then its addresses are connected to in parallel, each attempt
+    starting a little after the previous one. The first one to succeed wins.
+    """
+    # Seconds before starting the next attempt, unless the last one failed
+    ATTEMPT_DELAY = 0.25
+
+    def __init__(self, host, port, timeout, callback, parent=None):
+        """
+        Initialize the connector.
+
+        :param host: the host
+        :param port: the port
+        :param timeout: the seconds before giving up
+        :param callback: called with the socket, or None and the error
+        :param parent: the parent object
+        """
+        super(Connector, self).__init__(parent)
+        self._host = host
+        self._port = port
+        self._callback = callback
+        self._finished = False
+        self._addresses = []
+        self._attempts = {}
+
+        self._timeoutTimer = QTimer(self)
+        self._timeoutTimer.setSingleShot(True)
+        self._timeoutTimer.setInterval(int(timeout * 1000))
+        self._timeoutTimer.timeout.connect(self._timed_out)
+        self._attemptTimer = QTimer(self)
+        self._attemptTimer.setInterval(int(Connector.ATTEMPT_DELAY * 1000))
+        self._attemptTimer.timeout.connect(self._attempt)
+
+    def start(self):
+        """
+        Start resolving the host, then connecting to it.
+        """
+        self._timeoutTimer.start()
+
+        def resolve(host, port):
+            try:
+                return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            except socket.error as e:
+                return e
+
+        def resolved(result):
+            QCoreApplication.postEvent(self, ResolvedEvent(result))
+
+        get_pool().apply_async(resolve, (self._host, self._port),
+                               callback=resolved)
+
+    def cancel(self):
+        """
+        Stop connecting. The callback will not be called.
+        """
+        self._finish()
+
+    def event(self, event):
+        """
+        Callback called when a Qt event is fired.
+
+        :param event: the event
+        :return: was the event handled?
+        """
+        if isinstance(event, ResolvedEvent):
+            if not self._finished:
+                self._resolved(event.result)
+            event.accept()
+            return True
+        return super(Connector, self).event(event)
+
+    def _resolved(self, result):
+        """
+        Called when the host has been resolved.
+
+        :param result: the addresses, or the error
+        """
+        if isinstance(result, Exception) or not result:
+            self._fail(result or socket.error("No address found"))
+            return
+        self._addresses = interleave(result)
+        logger.debug("Resolved %s to %d addresses"
+                     % (self._host, len(self._addresses)))
+        self._attempt()
+
+    def _attempt(self):
+        """
+        Start connecting to the next address, if any.
+        """
+        while self._addresses:
+            family, type, proto, _, address = self._addresses.pop(0)
+            sock = socket.socket(family, type, proto)
+            sock.setblocking(False)
+            err = sock.connect_ex(address)
+            if err and err not in IN_PROGRESS:
+                self._attempt_failed(sock, connect_error(err))
+                if self._finished:
+                    return
+                continue  # try the next address right away
+
+            # Windows reports a failed connect as an exception instead
+            writeNotifier = QSocketNotifier(sock.fileno(),
+                                            QSocketNotifier.Write, self)
+            writeNotifier.activated.connect(
+                lambda _, s=sock: self._writable(s))
+            exceptNotifier = QSocketNotifier(sock.fileno(),
+                                             QSocketNotifier.Exception, self)
+            exceptNotifier.activated.connect(
+                lambda _, s=sock: self._writable(s, True))
+            for notifier in (writeNotifier, exceptNotifier):
+                notifier.setEnabled(True)
+            self._attempts[sock] = (writeNotifier, exceptNotifier)
+            self._attemptTimer.start()  # give it some time
+            return
+        self._attemptTimer.stop()
+
+    def _writable(self, sock, failed=False):
+        """
+        Called when an attempt has either succeeded or failed.
+
+        :param sock: the socket of the attempt
+        :param failed: was it reported as an exception?
+        """
+        if sock not in self._attempts:
+            return
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if failed and not err:
+            err = errno.ECONNREFUSED
+        if err:
+            self._attempt_failed(sock, connect_error(err))
+            self._attempt()
+            return
+
+        # Keep the socket, and abandon the other attempts
+        self._release(sock)
+        self._finish()
+        logger.debug("Connected to %s:%d" % sock.getpeername()[:2])
+        self._callback(sock, None)
+
+    def _attempt_failed(self, sock, error):
+        """
+        Called when an attempt failed, to give up if it was the last one.
+
+        :param sock: the socket of the attempt
+        :param error: the error
+        """
+        logger.debug("Connection attempt failed: %s" % error)
+        self._release(sock)
+        sock.close()
+        if not self._attempts and not self._addresses:
+            self._fail(error)
+
+    def _timed_out(self):
+        """
+        Called when the connection took too long.
+        """
+        self._fail(socket.timeout("Connection timed out"))
+
+    def _fail(self, error):
+        """
+        Give up connecting.
+
+        :param error: the error
+        """
+        self._finish()
+        self._callback(None, error)
+
+    def _release(self, sock):
+        """
+        Stop watching the socket of an attempt.
+
+        :param sock: the socket
+        """
+        for notifier in self._attempts.pop(sock, ()):
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+
+    def _finish(self):
+        """
+        Stop the timers, and close the sockets of the remaining attempts.
+        """
+        self._finished = True
+        self._timeoutTimer.stop()
+        self._attemptTimer.stop()
+        self._addresses = []
+        for sock in list(self._attempts):
+            self._release(sock)
+            sock.close()
@@ -11,10 +11,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import logging
-import socket
+
+from PyQt5.QtCore import QTimer
 
 from ..module import Module
+from ..shared.packets import Event
+from .backoff import backoff_delay
 from .client import Client
+from .connector import Connector
 
 logger = logging.getLogger('IDAConnect.Network')
 
@@ -23,12 +27,27 @@ class Network(Module):
     """
     The network module, responsible for all interactions with the server.
     """
+    # Seconds before giving up connecting to a server
+    CONNECT_TIMEOUT = 10
+    # Bounds of the delay before reconnecting to a lost server (seconds)
+    RECONNECT_DELAY_MIN = 1
+    RECONNECT_DELAY_MAX = 60
+    # Maximum number of local events kept while reconnecting
+    PENDING_EVENTS_MAX = 10000
 
     def __init__(self, plugin):
         super(Network, self).__init__(plugin)
         self._host = ''
         self._port = 0
         self._client = None
+        self._connector = None
+
+        self._reconnect = False
+        self._attempts = 0
+        self._pending = []
+        self._reconnectTimer = QTimer()
+        self._reconnectTimer.setSingleShot(True)
+        self._reconnectTimer.timeout.connect(self._reconnect_now)
 
     @property
     def host(self):
@@ -57,6 +76,44 @@ class Network(Module):
         """
         return self._client.connected if self._client else False
 
+    @property
+    def connecting(self):
+        """
+        Return if we are connecting to a server.
+
+        :return: if connecting
+        """
+        return self._connector is not None \
+            or self._reconnectTimer.isActive()
+
+    @property
+    def reconnects(self):
+        """
+        Return if we will reconnect to the server when disconnected, as the
+        user didn't disconnect on purpose.
+
+        :return: if reconnecting
+        """
+        return self._reconnect
+
+    @property
+    def features(self):
+        """
+        Get the features negotiated with the server.
+
+        :return: the features
+        """
+        return self._client.features if self._client else {}
+
+    @property
+    def rtt(self):
+        """
+        Get the smoothed round-trip time measured with the server.
+
+        :return: the time in seconds, or None if not measured yet
+        """
+        return self._client.rtt if self._client else None
+
     def _install(self):
         return True
 
@@ -64,15 +121,17 @@ class Network(Module):
         self.disconnect()
         return True
 
-    def connect(self, host, port):
+    def connect(self, host, port, timeout=None):
         """
-        Connect to the specified host and port.
+        Connect to the specified host and port. The connection is made in
+        the background, and the plugin is notified once it is established.
 
         :param host: the host
         :param port: the port
+        :param timeout: the seconds before giving up, None for the default
         """
         # Make sure we're not already connected
-        if self.connected:
+        if self.connected or self.connecting:
             return
 
         # Create a client
@@ -85,12 +144,21 @@ class Network(Module):
         # Notify the plugin of the connection
         self._plugin.notify_connecting()
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-        try:
-            sock.connect((host, port))
-        except socket.error as e:
-            logger.warning("Connection failed")
-            logger.exception(e)
+        if timeout is None:
+            timeout = Network.CONNECT_TIMEOUT
+        self._connector = Connector(host, port, timeout, self._connect_done)
+        self._connector.start()
+
+    def _connect_done(self, sock, err):
+        """
+        Called when the connection has been established, or has failed.
+
+        :param sock: the socket, or None
+        :param err: the error, or None
+        """
+        self._connector = None
+        if sock is None:
+            logger.warning("Connection failed: %s" % err)
             self._client = None
 
             # Notify the plugin
@@ -98,15 +166,76 @@ class Network(Module):
             return
         self._client.connect(sock)
 
-        # We're connected now
+        # We're connected now, and will stay so
         logger.info("Connected")
+        self._reconnect = True
+        self._attempts = 0
         # Notify the plugin
         self._plugin.notify_connected()
 
+        # Send the events made while we were reconnecting
+        events, self._pending = self._pending, []
+        for event in events:
+            self._client.send_packet(event)
+
+    def notify_disconnected(self):
+        # Reconnect if the connection was lost, or the reconnection failed
+        if self._reconnect and not self.connecting:
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        """
+        Reconnect to the server after a delay, doubling with each failed
+        attempt, with some jitter.
+        """
+        delay = backoff_delay(self._attempts, Network.RECONNECT_DELAY_MIN,
+                              Network.RECONNECT_DELAY_MAX)
+        self._attempts += 1
+        logger.info("Reconnecting in %.1fs..." % delay)
+        self._reconnectTimer.start(int(delay * 1000))
+
+        # Notify the plugin that we're still trying
+        self._plugin.notify_connecting()
+
+    def _reconnect_now(self):
+        """
+        Called when it is time to reconnect to the server.
+        """
+        self.connect(self._host, self._port)
+
+    def keep_events(self, events):
+        """
+        Keep some events to send them once reconnected to the server.
+
+        :param events: the events
+        """
+        if not self._reconnect:
+            return
+        space = Network.PENDING_EVENTS_MAX - len(self._pending)
+        if len(events) > space:
+            logger.warning("Dropping %d events made while disconnected"
+                           % (len(events) - max(space, 0)))
+        self._pending.extend(events[:max(space, 0)])
+
     def disconnect(self):
         """
-        Disconnect from the current server.
+        Disconnect from the current server, or stop connecting to it.
         """
+        # The user wants us to stay disconnected
+        self._reconnect = False
+        self._attempts = 0
+        self._pending = []
+
+        if self.connecting:
+            logger.info("Connection cancelled")
+            self._reconnectTimer.stop()
+            if self._connector:
+                self._connector.cancel()
+            self._connector = None
+            self._client = None
+            self._plugin.notify_disconnected()
+            return
+
         # Make sure we're actually connected
         if not self.connected:
             return
@@ -120,13 +249,25 @@ class Network(Module):
         # Notify the plugin of the disconnection
         self._plugin.notify_disconnected()
 
-    def send_packet(self, packet):
+    def send_packet(self, packet, timeout=None):
         """
         Send a packet to the server.
 
         :param packet: the packet to send
+        :param timeout: the seconds to wait for a reply, None for the default
         :return: a deferred of the reply
         """
         if self.connected:
-            return self._client.send_packet(packet)
+            return self._client.send_packet(packet, timeout)
+        if isinstance(packet, Event):
+            self.keep_events([packet])
         return None
+
+    def flush(self, later=False):
+        """
+        Send the events waiting to be batched to the server.
+
+        :param later: wait for the control to return to the event loop
+        """
+        if self.connected:
+            self._client.flush(later)
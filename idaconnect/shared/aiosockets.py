@@ -0,0 +1,130 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+
+
+class AsyncioSocket(object):
+    """
+    A mix-in class integrating a client socket into an asyncio event loop.
+    The socket is watched by the selector of the loop (epoll on Linux), so
+    the protocol keeps doing its own reads and writes.
+    """
+    _loop = None
+    _fd = None
+    _reading = False
+    _writing = False
+
+    def _watch(self, sock):
+        """
+        Start watching the socket in the current event loop, for reading
+        only.
+
+        :param sock: the socket
+        """
+        self._loop = asyncio.get_event_loop()
+        self._fd = sock.fileno()
+        self._set_reading(True)
+
+    def _unwatch(self):
+        """
+        Remove the socket from the selector, before it is closed.
+        """
+        self._set_reading(False)
+        self._set_writing(False)
+
+    def _set_reading(self, enabled):
+        """
+        Add or remove the reader calling _notify_read.
+
+        :param enabled: is it enabled?
+        """
+        if enabled and not self._reading:
+            self._loop.add_reader(self._fd, self._notify_read)
+        elif not enabled and self._reading:
+            self._loop.remove_reader(self._fd)
+        self._reading = enabled
+
+    def _set_writing(self, enabled):
+        """
+        Add or remove the writer calling _notify_write.
+
+        :param enabled: is it enabled?
+        """
+        if enabled and not self._writing:
+            self._loop.add_writer(self._fd, self._notify_write)
+        elif not enabled and self._writing:
+            self._loop.remove_writer(self._fd)
+        self._writing = enabled
+
+    def _is_writing(self):
+        """
+        Returns if the writer is added, the loop doesn't tell.
+
+        :return: is it enabled?
+        """
+        return self._writing
+
+    def _post_dispatch(self):
+        """
+        Schedule a call to _dispatch at the next iteration of the loop.
+        """
+        self._loop.call_soon(self._dispatch)
+
+    def _call_later(self, delay, callback):
+        """
+        Schedule a call to a function, after some time.
+
+        :param delay: the delay in seconds
+        :param callback: the function
+        """
+        self._loop.call_later(delay, callback)
+
+    def _call_from_thread(self, callback):
+        """
+        Schedule a call to a function in the loop, waking it up from the
+        other thread.
+
+        :param callback: the function
+        """
+        self._loop.call_soon_threadsafe(callback)
+
+    def _notify_chunk(self):
+        """
+        Schedule a call to _chunk_ready, from a thread of the pool.
+        """
+        self._loop.call_soon_threadsafe(self._chunk_ready)
+
+
+class AsyncioServerSocket(object):
+    """
+    A mix-in class integrating a server socket into an asyncio event loop.
+    """
+    _loop = None
+    _fd = None
+
+    def _watch(self, sock):
+        """
+        Start calling _notify_accept when the socket is readable, in the
+        current event loop.
+
+        :param sock: the socket
+        """
+        self._loop = asyncio.get_event_loop()
+        self._fd = sock.fileno()
+        self._loop.add_reader(self._fd, self._notify_accept)
+
+    def _unwatch(self):
+        """
+        Remove the socket from the selector, before it is closed.
+        """
+        self._loop.remove_reader(self._fd)
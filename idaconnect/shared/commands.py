@@ -15,6 +15,48 @@ from .packets import (Command, DefaultCommand, ParentCommand,
                       Query as IQuery, Reply as IReply, Container)
 
 
+class Handshake(ParentCommand):
+    __command__ = 'handshake'
+
+    class Query(IQuery, DefaultCommand):
+
+        def __init__(self, features, names=None):
+            super(Handshake.Query, self).__init__()
+            self.features = features
+            self.names = names
+
+    class Reply(IReply, DefaultCommand):
+
+        def __init__(self, query, features, names=None):
+            super(Handshake.Reply, self).__init__(query)
+            self.features = features
+            self.names = names
+
+
+class Ping(DefaultCommand):
+    __command__ = 'ping'
+
+    def __init__(self, time):
+        super(Ping, self).__init__()
+        self.time = time
+
+
+class Pong(DefaultCommand):
+    __command__ = 'pong'
+
+    def __init__(self, time):
+        super(Pong, self).__init__()
+        self.time = time
+
+
+class Error(IReply, DefaultCommand):
+    __command__ = 'error'
+
+    def __init__(self, query, message):
+        super(Error, self).__init__(query)
+        self.message = message
+
+
 class GetRepositories(ParentCommand):
     __command__ = 'get_repos'
 
@@ -42,10 +84,12 @@ class GetBranches(ParentCommand):
 
     class Query(IQuery, DefaultCommand):
 
-        def __init__(self, hash=None, uuid=None):
+        def __init__(self, hash=None, uuid=None, offset=0, limit=None):
             super(GetBranches.Query, self).__init__()
             self.hash = hash
             self.uuid = uuid
+            self.offset = offset
+            self.limit = limit
 
     class Reply(IReply, Command):
 
@@ -60,6 +104,40 @@ class GetBranches(ParentCommand):
             self.branches = [Branch.new(br) for br in dct['branches']]
 
 
+class ListRepositories(ParentCommand):
+    __command__ = 'list_repos'
+
+    class Query(IQuery, DefaultCommand):
+
+        def __init__(self, hash=None, filter=None, offset=0, limit=None):
+            super(ListRepositories.Query, self).__init__()
+            self.hash = hash
+            self.filter = filter
+            self.offset = offset
+            self.limit = limit
+
+    class Reply(IReply, Command):
+
+        def __init__(self, query, repos, counts, total, branches):
+            super(ListRepositories.Reply, self).__init__(query)
+            self.repos = repos
+            self.counts = counts
+            self.total = total
+            self.branches = branches
+
+        def build_command(self, dct):
+            dct['repos'] = [repo.build(dict()) for repo in self.repos]
+            dct['counts'] = self.counts
+            dct['total'] = self.total
+            dct['branches'] = [br.build(dict()) for br in self.branches]
+
+        def parse_command(self, dct):
+            self.repos = [Repository.new(repo) for repo in dct['repos']]
+            self.counts = dct['counts']
+            self.total = dct['total']
+            self.branches = [Branch.new(br) for br in dct['branches']]
+
+
 class NewRepository(ParentCommand):
     __command__ = 'new_repo'
 
@@ -70,7 +148,7 @@ class NewRepository(ParentCommand):
             self.repo = repo
 
         def build_command(self, dct):
-            self.repo.build(dct['repo'])
+            dct['repo'] = self.repo.build({})
 
         def parse_command(self, dct):
             self.repo = Repository.new(dct['repo'])
@@ -89,7 +167,7 @@ class NewBranch(ParentCommand):
             self.branch = branch
 
         def build_command(self, dct):
-            self.branch.build(dct['branch'])
+            dct['branch'] = self.branch.build({})
 
         def parse_command(self, dct):
             self.branch = Branch.new(dct['branch'])
@@ -98,15 +176,37 @@ class NewBranch(ParentCommand):
         pass
 
 
+class ResumeUpload(ParentCommand):
+    __command__ = 'resume_upload'
+
+    class Query(IQuery, DefaultCommand):
+
+        def __init__(self, hash, uuid, digest):
+            super(ResumeUpload.Query, self).__init__()
+            self.hash = hash
+            self.uuid = uuid
+            self.digest = digest
+
+    class Reply(IReply, DefaultCommand):
+
+        def __init__(self, query, offset):
+            super(ResumeUpload.Reply, self).__init__(query)
+            self.offset = offset
+
+
 class UploadDatabase(ParentCommand):
     __command__ = 'upload_db'
 
     class Query(IQuery, Container, DefaultCommand):
+        digest = None
+        offset = 0
 
-        def __init__(self, hash, uuid):
+        def __init__(self, hash, uuid, digest=None, offset=0):
             super(UploadDatabase.Query, self).__init__()
             self.hash = hash
             self.uuid = uuid
+            self.digest = digest
+            self.offset = offset
 
     class Reply(IReply, Command):
         pass
@@ -116,16 +216,80 @@ class DownloadDatabase(ParentCommand):
     __command__ = 'download_db'
 
     class Query(IQuery, DefaultCommand):
+        digest = None
+        offset = 0
 
-        def __init__(self, hash, uuid):
+        def __init__(self, hash, uuid, digest=None, offset=0):
             super(DownloadDatabase.Query, self).__init__()
             self.hash = hash
             self.uuid = uuid
+            self.digest = digest
+            self.offset = offset
+
+    class Reply(IReply, Container, DefaultCommand):
+        digest = None
+        offset = 0
+
+        def __init__(self, query, digest=None, offset=0):
+            super(DownloadDatabase.Reply, self).__init__(query)
+            self.digest = digest
+            self.offset = offset
+
+
+class FindSegments(ParentCommand):
+    __command__ = 'find_segments'
+
+    class Query(IQuery, DefaultCommand):
+
+        def __init__(self, hash, segments):
+            super(FindSegments.Query, self).__init__()
+            self.hash = hash
+            self.segments = segments
+
+    class Reply(IReply, DefaultCommand):
+
+        def __init__(self, query, missing):
+            super(FindSegments.Reply, self).__init__(query)
+            self.missing = missing
+
+
+class UploadSegments(ParentCommand):
+    __command__ = 'upload_segments'
+
+    class Query(IQuery, Container, DefaultCommand):
+
+        def __init__(self, hash, uuid, digest, segments, missing):
+            super(UploadSegments.Query, self).__init__()
+            self.hash = hash
+            self.uuid = uuid
+            self.digest = digest
+            self.segments = segments
+            self.missing = missing
 
-    class Reply(IReply, Container, Command):
+    class Reply(IReply, Command):
         pass
 
 
+class DownloadSegments(ParentCommand):
+    __command__ = 'download_segments'
+
+    class Query(IQuery, DefaultCommand):
+
+        def __init__(self, hash, uuid, known):
+            super(DownloadSegments.Query, self).__init__()
+            self.hash = hash
+            self.uuid = uuid
+            self.known = known
+
+    class Reply(IReply, Container, DefaultCommand):
+
+        def __init__(self, query, digest, segments, missing):
+            super(DownloadSegments.Reply, self).__init__(query)
+            self.digest = digest
+            self.segments = segments
+            self.missing = missing
+
+
 class Subscribe(DefaultCommand):
     __command__ = 'subscribe'
 
@@ -138,3 +302,7 @@ class Subscribe(DefaultCommand):
 
 class Unsubscribe(DefaultCommand):
     __command__ = 'unsubscribe'
+
+
+class Resubscribe(DefaultCommand):
+    __command__ = 'resubscribe'
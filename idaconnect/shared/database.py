@@ -14,7 +14,7 @@ import json
 import sqlite3
 
 from .models import Repository, Branch
-from .packets import Default, DefaultEvent
+from .packets import Batch, BinaryCodec, GenericEvent
 
 
 class Database(object):
@@ -22,16 +22,25 @@ class Database(object):
     An utility object used by the server, that be used to query
     asynchronously the underling SQL database.
     """
+    # Maximum number of names identified by integers, as the clients can
+    # offer any names during the handshake
+    NAMES_MAX = 4096
 
-    def __init__(self, dbpath):
+    def __init__(self, dbpath, interning=True):
         """
         Initialize the database wrapper.
 
         :param dbpath: the database path
+        :param interning: are the names of the events stored added to the
+            table, rather than only the names agreed with the clients?
         """
+        self._interning = interning
         self._conn = sqlite3.connect(dbpath, check_same_thread=False)
         self._conn.isolation_level = None
         self._conn.row_factory = sqlite3.Row
+        self._names = []
+        self._known = set(BinaryCodec.STRINGS)
+        self._codecs = {}
 
     def initialize(self):
         """
@@ -58,6 +67,11 @@ class Database(object):
             'foreign key(hash) references repos(hash)',
             'foreign key(uuid) references branches(uuid)'
         ])
+        self._create('names', [
+            'id integer primary key',
+            'name text unique'
+        ])
+        self._load_names()
 
     def insert_repo(self, repo):
         """
@@ -65,7 +79,7 @@ class Database(object):
 
         :param repo: the repository
         """
-        self._insert('repos', Default.attrs(repo.__dict__))
+        self._insert('repos', repo.build({}))
 
     def select_repo(self, hash):
         """
@@ -88,13 +102,65 @@ class Database(object):
         results = self._select('repos', {'hash': hash}, limit)
         return [Repository(*result) for result in results]
 
+    def list_repos(self, filter=None, limit=None):
+        """
+        Selects the repositories whose file name or hash contains the given
+        filter, with their number of branches, by order of file name.
+
+        :param filter: the filter, or None if no filtering
+        :param limit: the number of results to return, or None
+        :return: the repositories and their number of branches
+        """
+        c = self._conn.cursor()
+        sql = 'select repos.*, count(branches.uuid) from repos ' \
+              'left join branches on branches.hash = repos.hash'
+        sql, args = self._filter(sql, filter)
+        sql += ' group by repos.hash order by repos.file, repos.hash'
+        if limit:
+            sql += ' limit ?'
+            args.append(limit)
+        c.execute(sql + ';', args)
+        return [(Repository(*result[:4]), result[4])
+                for result in c.fetchall()]
+
+    def count_repos(self, filter=None):
+        """
+        Counts the repositories whose file name or hash contains the given
+        filter.
+
+        :param filter: the filter, or None if no filtering
+        :return: the number of repositories
+        """
+        c = self._conn.cursor()
+        sql, args = self._filter('select count(*) from repos', filter)
+        c.execute(sql + ';', args)
+        return c.fetchone()[0]
+
+    @staticmethod
+    def _filter(sql, filter):
+        """
+        Restricts a selection of repositories to those whose file name or
+        hash contains the given filter.
+
+        :param sql: the selection
+        :param filter: the filter, or None if no filtering
+        :return: the selection and its arguments
+        """
+        if not filter:
+            return sql, []
+        pattern = '%{}%'.format(filter.replace('\\', '\\\\')
+                                .replace('%', '\\%').replace('_', '\\_'))
+        sql += " where repos.file like ? escape '\\'" \
+               " or repos.hash like ? escape '\\'"
+        return sql, [pattern, pattern]
+
     def insert_branch(self, branch):
         """
         Inserts a new branch into the database.
 
         :param branch: the branch
         """
-        self._insert('branches', Default.attrs(branch.__dict__))
+        self._insert('branches', branch.build({}))
 
     def select_branch(self, uuid, hash):
         """
@@ -107,16 +173,18 @@ class Database(object):
         objects = self.select_branches(uuid, hash, 1)
         return objects[0] if objects else None
 
-    def select_branches(self, uuid, hash, limit=None):
+    def select_branches(self, uuid, hash, limit=None, offset=0):
         """
         Selects the branches with the given uuid and hash.
 
         :param uuid: the uuid, or None if no filtering
         :param hash: the hash, or None if no filtering
         :param limit: the number of results to return, or None
+        :param offset: the number of results to skip
         :return: the branches
         """
-        results = self._select('branches', {'uuid': uuid, 'hash': hash}, limit)
+        results = self._select('branches', {'uuid': uuid, 'hash': hash},
+                               limit, offset)
         return [Branch(*result) for result in results]
 
     def insert_event(self, client, event):
@@ -126,14 +194,159 @@ class Database(object):
         :param client: the client
         :param event: the event
         """
-        dct = DefaultEvent.attrs(event.__dict__)
+        dct = event.build({})
+        tick = dct.pop('tick')
+        self._insert('events', {
+            'hash': client.repo,
+            'uuid': client.branch,
+            'tick': tick,
+            'dict': sqlite3.Binary(self._encode_event(dct))
+        })
+
+    def _encode_event(self, dct):
+        """
+        Encode the dictionary of an event, its type and field names being
+        identified by integers. The names are added to the table as they
+        are first seen, if interning, and the encoding starts with the size
+        of the table, so that the names interned afterwards are told apart.
+
+        :param dct: the dictionary
+        :return: the bytes
+        """
+        if self._interning:
+            self._add_names([dct.get('event_type')])
+            self._add_names(dct.keys())
+        return self._encode_row(dct, len(self._names))
+
+    def _encode_row(self, dct, count):
+        """
+        Encode a dictionary using the first names of the table, prefixed by
+        their number.
+
+        :param dct: the dictionary
+        :param count: the number of names
+        :return: the bytes
+        """
+        out = bytearray()
+        BinaryCodec._write_varint(out, count)
+        return bytes(out) + self._codec(count).encode(dct)
+
+    def add_names(self, names):
+        """
+        Add to the table the names that are not already identified by
+        integers, either in it or by the binary codec itself.
+
+        :param names: the names
+        :return: all the names of the table
+        """
+        self._add_names(names)
+        return list(self._names)
+
+    def _add_names(self, names):
+        """
+        Add to the table the names that are not already known, until it is
+        full.
+
+        :param names: the names
+        """
+        known = self._known
+        for name in names:
+            if name in known or not isinstance(name, type(u'')):
+                continue
+            if len(self._names) >= Database.NAMES_MAX:
+                return
+            self._insert('names', {'name': name})
+            self._names.append(name)
+            known.add(name)
+
+    def is_vocabulary(self, names):
+        """
+        Check if some names are the first names of the table, so that the
+        binary packets using them can be stored as they are.
+
+        :param names: the names, or None
+        :return: are they?
+        """
+        return names is not None \
+            and list(names) == self._names[:len(names)]
+
+    def _decode_event(self, data):
+        """
+        Decode the dictionary of an event. Older rows are JSON objects,
+        stored as text rather than as a blob (whose first byte, the number
+        of names, could be an opening brace).
+
+        :param data: the text or blob
+        :return: the dictionary
+        """
+        if isinstance(data, type(u'')):
+            return json.loads(data)
+        count, offset = BinaryCodec._read_varint(bytearray(data[:10]), 0)
+        return self._codec(count).decode(data[offset:])
+
+    def _load_names(self):
+        """
+        Load the names identified by integers in the stored events.
+        """
+        c = self._conn.cursor()
+        c.execute('select name from names order by id asc;')
+        self._names = [row['name'] for row in c.fetchall()]
+        self._known = set(self._names) | set(BinaryCodec.STRINGS)
+        self._codecs = {}
+
+    def _codec(self, count):
+        """
+        Get the codec identifying the first names of the table.
+
+        :param count: the number of names
+        :return: the codec
+        """
+        if count not in self._codecs:
+            self._codecs[count] = BinaryCodec(self._names[:count])
+        return self._codecs[count]
+
+    def insert_encoded(self, client, tick, data, names=None):
+        """
+        Inserts an event, or a batch of events, as it was encoded by the
+        client. It is either a JSON object, or a binary packet using the
+        first names of the table.
+
+        :param client: the client
+        :param tick: the tick of the event, or of the last one
+        :param data: the encoded packet
+        :param names: the names the packet was encoded with
+        """
+        if data[:1] == b'{':
+            row = bytes(data).decode('utf-8')
+        else:
+            out = bytearray()
+            BinaryCodec._write_varint(out, len(names))
+            row = sqlite3.Binary(bytes(out) + bytes(data))
         self._insert('events', {
             'hash': client.repo,
             'uuid': client.branch,
-            'tick': dct.pop('tick'),
-            'dict': json.dumps(dct)
+            'tick': tick,
+            'dict': row
         })
 
+    def insert_events(self, client, events):
+        """
+        Inserts several events into the database, in a single transaction.
+
+        :param client: the client
+        :param events: the events
+        """
+        c = self._conn.cursor()
+        c.execute('begin;')
+        try:
+            for event in events:
+                self.insert_event(client, event)
+        except Exception:
+            c.execute('rollback;')
+            self._load_names()  # forget the names added
+            raise
+        c.execute('commit;')
+
     def select_events(self, hash, uuid, tick):
         """
         Get all events sent after the given ticks count.
@@ -149,9 +362,15 @@ class Database(object):
         c.execute(sql, [hash, uuid, tick])
         events = []
         for result in c.fetchall():
-            dct = json.loads(result['dict'])
-            dct['tick'] = result['tick']
-            events.append(DefaultEvent.new(dct))
+            dct = self._decode_event(result['dict'])
+            if dct.get('type') != Batch.__type__:
+                dct['tick'] = result['tick']
+                events.append(GenericEvent.new(dct))
+                continue
+
+            # A batch stored as it was received, sent from its last tick
+            events += [GenericEvent.new(event) for event in dct['events']
+                       if event['tick'] > tick]
         return events
 
     def _create(self, table, cols):
@@ -165,13 +384,15 @@ class Database(object):
         sql = 'create table if not exists {} ({});'
         c.execute(sql.format(table, ', '.join(cols)))
 
-    def _select(self, table, fields, limit=None):
+    def _select(self, table, fields, limit=None, offset=0):
         """
-        Selects the rows of a table matching the given values.
+        Selects the rows of a table matching the given values. The rows of
+        a page are in the order they were inserted.
 
         :param table: the table name
         :param fields: the fields and values to match
         :param limit: the number of results to return
+        :param offset: the number of results to skip
         :return: the selected rows
         """
         c = self._conn.cursor()
@@ -180,8 +401,11 @@ class Database(object):
         if len(fields):
             cols = ['{} = ?'.format(col) for col in fields.keys()]
             sql = (sql + ' where {}').format(' and '.join(cols))
-        sql += ' limit {};'.format(limit) if limit else ';'
-        c.execute(sql, list(fields.values()))
+        args = list(fields.values())
+        if limit or offset:
+            sql += ' order by rowid limit ? offset ?'
+            args += [limit or -1, offset]
+        c.execute(sql + ';', args)
         return c.fetchall()
 
     def _insert(self, table, fields):
@@ -0,0 +1,563 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import bisect
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from .streams import (CHUNK_SIZE, FileSource, decompress_chunk,
+                      discard_partials, partial_path, replace_file)
+
+# Bounds of the size of a segment
+SEGMENT_MIN = 16 * 1024
+SEGMENT_MAX = 256 * 1024
+
+# Size of the blocks read when splitting a file
+SPLIT_READ_SIZE = 8 << 20
+
+# Format of the digests of the segments and of the files
+_DIGEST = re.compile(r'[0-9a-f]{40}\Z')
+
+
+def check_digest(digest):
+    """
+    Check that a digest received from the other party is well-formed, before
+    it is used to build a path.
+
+    :param digest: the digest
+    :return: the digest
+    """
+    try:
+        valid = _DIGEST.match(digest) is not None
+    except TypeError:
+        valid = False
+    if not valid:
+        raise ValueError("Invalid digest %r" % (digest,))
+    return digest
+
+
+def _boundary_table():
+    """
+    Build the table mapping every byte value to a pseudo-random bit. It is
+    derived from a fixed string, so that every party splits the same way.
+
+    :return: the translation table
+    """
+    bits = bytearray()
+    for value in range(256):
+        seed = ('idaconnect-segment-%d' % value).encode('ascii')
+        bits.append(bytearray(hashlib.sha1(seed).digest())[0] & 1)
+    return bytes(bits)
+
+# The rolling hash of a window is the concatenation of the bits of its bytes:
+# a boundary is found where the hash of the last 16 bytes matches a pattern,
+# that is about every 64 KiB. The pattern isn't periodic, so a run of a same
+# byte cannot match it. When no boundary is found before the maximum size,
+# which happens on data having little entropy, the last match of a shorter
+# pattern is used instead, before falling back to the maximum size.
+_TABLE = _boundary_table()
+_PATTERN = b'\x01\x00\x01\x01\x00\x00\x01\x00\x01\x01\x01\x00\x00\x01\x00\x00'
+_BACKUP_PATTERN = _PATTERN[-10:]
+
+
+def _boundary(hashes, start, eof):
+    """
+    Find the end of the segment starting at the specified position.
+
+    :param hashes: the translated bytes
+    :param start: the start of the segment
+    :param eof: is the end of the file reached?
+    :return: the end of the segment, or None if more data is needed
+    """
+    size = len(hashes)
+    if start == size:
+        return None
+    lo = start + SEGMENT_MIN - len(_PATTERN)
+    hi = start + SEGMENT_MAX
+    pos = hashes.find(_PATTERN, lo, min(hi, size))
+    if pos >= 0:
+        return pos + len(_PATTERN)
+    if hi > size:
+        return size if eof else None
+    lo += len(_PATTERN) - len(_BACKUP_PATTERN)
+    pos = hashes.rfind(_BACKUP_PATTERN, lo, hi)
+    if pos >= 0:
+        return pos + len(_BACKUP_PATTERN)
+    return hi
+
+
+def split_file(path):
+    """
+    Split a file into content-defined segments. As the boundaries only depend
+    on the bytes around them, an insertion or a deletion only changes the
+    segments it touches, and not all the ones following it.
+
+    :param path: the path
+    :return: the digest of the file, and the digest and size of each segment
+    """
+    digest = hashlib.sha1()
+    segments = []
+    with open(path, 'rb') as f:
+        data = b''
+        while True:
+            block = f.read(SPLIT_READ_SIZE)
+            digest.update(block)
+            data += block
+            eof = not block
+
+            hashes = data.translate(_TABLE)
+            start = 0
+            while True:
+                end = _boundary(hashes, start, eof)
+                if end is None:
+                    break
+                segment = hashlib.sha1(data[start:end]).hexdigest()
+                segments.append([segment, end - start])
+                start = end
+            data = data[start:]
+            if eof:
+                break
+    return digest.hexdigest(), segments
+
+
+def split_files(paths):
+    """
+    Split the files that exist into content-defined segments.
+
+    :param paths: the paths
+    :return: the path and the digest and size of each segment of each file
+    """
+    return [(path, split_file(path)[1]) for path in paths
+            if os.path.exists(path)]
+
+
+def segment_offsets(segments):
+    """
+    Map the digest of every segment to its first offset in the file.
+
+    :param segments: the digest and size of each segment
+    :return: the dictionary
+    """
+    offsets, offset = {}, 0
+    for segment, size in segments:
+        offsets.setdefault(segment, offset)
+        offset += size
+    return offsets
+
+
+def missing_segments(segments, known):
+    """
+    Get the ranges of the file containing the segments that are not known,
+    in order and without duplicates.
+
+    :param segments: the digest and size of each segment
+    :param known: the set of known digests
+    :return: the digests and the ranges of the missing segments
+    """
+    missing, ranges, seen, offset = [], [], set(known), 0
+    for segment, size in segments:
+        if segment not in seen:
+            seen.add(segment)
+            missing.append(segment)
+            ranges.append((offset, size))
+        offset += size
+    return missing, ranges
+
+
+def manifest_path(path):
+    """
+    Get the path of the manifest describing the segments of a file.
+
+    :param path: the path of the file
+    :return: the path of the manifest
+    """
+    return path + '.manifest'
+
+
+def load_manifest(path):
+    """
+    Load the manifest describing the segments of a file.
+
+    :param path: the path of the file
+    :return: the digest of the file and its segments, or None
+    """
+    try:
+        with open(manifest_path(path), 'r') as f:
+            dct = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    return dct['digest'], dct['segments']
+
+
+def save_manifest(path, digest, segments):
+    """
+    Save the manifest describing the segments of a file.
+
+    :param path: the path of the file
+    :param digest: the digest of the file
+    :param segments: the digest and size of each segment
+    """
+    with open(manifest_path(path), 'w') as f:
+        json.dump({'digest': digest, 'segments': segments}, f)
+
+
+def remove_manifest(path):
+    """
+    Remove the manifest of a file, when the file is replaced.
+
+    :param path: the path of the file
+    """
+    if os.path.exists(manifest_path(path)):
+        os.remove(manifest_path(path))
+
+
+class SegmentSource(FileSource):
+    """
+    A file source sending only some ranges of a file, one after the other.
+    It is used to send the segments of a file that are missing on the other
+    side.
+    """
+
+    def __init__(self, path, ranges):
+        """
+        Initialize the segment source.
+
+        :param path: the origin path
+        :param ranges: the offset and size of each range
+        """
+        super(SegmentSource, self).__init__(path)
+        self._ranges = list(ranges)
+        self._starts, start = [], 0
+        for _, size in self._ranges:
+            self._starts.append(start)
+            start += size
+        self._size = start
+
+    def send(self, sock, offset, count):
+        index = bisect.bisect_right(self._starts, offset) - 1
+        rangeOffset, rangeSize = self._ranges[index]
+        skip = offset - self._starts[index]
+        count = min(count, rangeSize - skip)
+        return super(SegmentSource, self).send(sock, rangeOffset + skip, count)
+
+    def blocks(self):
+        block = b''
+        for offset, size in self._ranges:
+            self._file.seek(offset)
+            while size:
+                data = self._file.read(min(size, CHUNK_SIZE - len(block)))
+                if not data:
+                    raise IOError("Unexpected end of file")
+                size -= len(data)
+                block += data
+                if len(block) == CHUNK_SIZE:
+                    yield block
+                    block = b''
+        if block:
+            yield block
+
+
+class SegmentStore(object):
+    """
+    A store of segments on disk, keyed by their digest.
+    """
+
+    def __init__(self, root):
+        """
+        Initialize the segment store.
+
+        :param root: the directory of the store
+        """
+        super(SegmentStore, self).__init__()
+        self._root = root
+
+    def path(self, segment):
+        """
+        Get the path of a segment.
+
+        :param segment: the digest
+        :return: the path
+        """
+        check_digest(segment)
+        return os.path.join(self._root, segment[:2], segment)
+
+    def has(self, segment):
+        """
+        Returns if a segment is in the store.
+
+        :param segment: the digest
+        :return: is it stored?
+        """
+        return os.path.exists(self.path(segment))
+
+    def get(self, segment):
+        """
+        Read a segment from the store.
+
+        :param segment: the digest
+        :return: the segment
+        """
+        with open(self.path(segment), 'rb') as f:
+            return f.read()
+
+    def put(self, segment, data):
+        """
+        Write a segment into the store.
+
+        :param segment: the digest
+        :param data: the segment
+        """
+        if hashlib.sha1(data).hexdigest() != segment:
+            raise ValueError("Segment %s is corrupted" % segment)
+        dirName = os.path.dirname(self.path(segment))
+        if not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        fd, tmpPath = tempfile.mkstemp(suffix='.part', dir=dirName)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        replace_file(tmpPath, self.path(segment))
+
+
+class SegmentSink(object):
+    """
+    A file-like destination for the content of a container made of segments.
+    The content is the concatenation of the missing segments, in order. Each
+    segment is taken from either the content, or from the known segments.
+    The file is assembled next to the destination and renamed once complete.
+
+    If the transfer is interrupted, the partial file is kept. The next
+    transfer of the same file keeps the segments it starts with, and skips
+    them in the content if they are sent again.
+    """
+
+    def __init__(self, path, digest, segments, missing, known):
+        """
+        Initialize the segment sink.
+
+        :param path: the destination path
+        :param digest: the digest of the file
+        :param segments: the digest and size of each segment
+        :param missing: the digests of the segments sent, in order
+        :param known: a function reading a known segment, or returning None
+        """
+        super(SegmentSink, self).__init__()
+        self._path = path
+        self._digest = digest
+        self._segments = list(segments)
+        self._missing = set(missing)
+        self._known = known
+        self._written = {}
+        self._index = 0
+        self._buffer = b''
+        self._skip = 0
+        self._sha1 = hashlib.sha1()
+
+        self._tmpPath = partial_path(path, check_digest(digest))
+        if os.path.exists(self._tmpPath):
+            self._file = open(self._tmpPath, 'r+b')
+            self._resume()
+        else:
+            self._file = open(self._tmpPath, 'w+b')
+
+    @property
+    def path(self):
+        """
+        Get the destination path.
+
+        :return: the path
+        """
+        return self._path
+
+    def write(self, data):
+        """
+        Write the content of some missing segments.
+
+        :param data: the raw bytes
+        """
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            data, self._skip = data[skipped:], self._skip - skipped
+        self._buffer += data
+        self._assemble()
+
+    def write_chunk(self, chunk):
+        """
+        Write a compressed chunk of the content of some missing segments.
+
+        :param chunk: the compressed chunk
+        :return: the uncompressed size of the chunk
+        """
+        data = decompress_chunk(chunk)
+        self.write(data)
+        return len(data)
+
+    def segment_received(self, segment, data):
+        """
+        Called when a missing segment has been completely received.
+
+        :param segment: the digest
+        :param data: the segment
+        """
+        pass
+
+    def commit(self):
+        """
+        Check the assembled file, then move it to the destination path.
+        """
+        self._assemble()
+        if self._index != len(self._segments) or self._buffer:
+            raise ValueError("Content doesn't match the segments")
+        if self._sha1.hexdigest() != self._digest:
+            raise ValueError("Assembled file is corrupted")
+        self._file.close()
+        replace_file(self._tmpPath, self._path)
+        discard_partials(self._path)
+
+    def abort(self):
+        """
+        Keep the assembled file, so that the transfer can be resumed.
+        """
+        self._file.close()
+
+    def _resume(self):
+        """
+        Keep the segments the partial file starts with, and drop the rest.
+        """
+        position, seen = 0, set()
+        while self._index < len(self._segments):
+            segment, size = self._segments[self._index]
+            data = self._file.read(size)
+            if len(data) != size or hashlib.sha1(data).hexdigest() != segment:
+                break
+
+            # The missing segments are sent in the order they first appear
+            if segment in self._missing and segment not in seen:
+                self._skip += size
+            seen.add(segment)
+            self._written.setdefault(segment, position)
+            self._sha1.update(data)
+            position += size
+            self._index += 1
+        self._file.seek(position)
+        self._file.truncate()
+
+    def _assemble(self):
+        """
+        Append the segments whose content is available to the file.
+        """
+        while self._index < len(self._segments):
+            segment, size = self._segments[self._index]
+            if segment in self._written:
+                # Segment already present earlier in the file
+                self._file.seek(self._written[segment])
+                data = self._file.read(size)
+                self._file.seek(0, os.SEEK_END)
+            elif segment in self._missing:
+                if len(self._buffer) < size:
+                    break
+                data, self._buffer = self._buffer[:size], self._buffer[size:]
+                if hashlib.sha1(data).hexdigest() != segment:
+                    raise ValueError("Segment %s is corrupted" % segment)
+                self.segment_received(segment, data)
+            else:
+                data = self._known(segment)
+                if data is None:
+                    raise ValueError("Segment %s is unknown" % segment)
+
+            self._written[segment] = self._file.tell()
+            self._file.write(data)
+            self._sha1.update(data)
+            self._index += 1
+
+
+class StoreSegmentSink(SegmentSink):
+    """
+    A segment sink that takes the known segments from a segment store, and
+    adds the received ones to it.
+    """
+
+    def __init__(self, path, digest, segments, missing, store):
+        """
+        Initialize the segment sink.
+
+        :param path: the destination path
+        :param digest: the digest of the file
+        :param segments: the digest and size of each segment
+        :param missing: the digests of the segments sent, in order
+        :param store: the segment store
+        """
+        super(StoreSegmentSink, self).__init__(path, digest, segments,
+                                               missing, self._read)
+        self._store = store
+
+    def segment_received(self, segment, data):
+        self._store.put(segment, data)
+
+    def commit(self):
+        super(StoreSegmentSink, self).commit()
+        save_manifest(self._path, self._digest, self._segments)
+
+    def _read(self, segment):
+        return self._store.get(segment) if self._store.has(segment) else None
+
+
+class FileSegmentSink(SegmentSink):
+    """
+    A segment sink that takes the known segments from other files, like a
+    previous version of the file or the partial file of another version.
+    """
+
+    def __init__(self, path, digest, segments, missing, cached=()):
+        """
+        Initialize the segment sink.
+
+        :param path: the destination path
+        :param digest: the digest of the file
+        :param segments: the digest and size of each segment
+        :param missing: the digests of the segments sent, in order
+        :param cached: the path and the segments of each other file
+        """
+        super(FileSegmentSink, self).__init__(path, digest, segments,
+                                              missing, self._read)
+        # Our own partial file is resumed rather than read from
+        self._cached = [(open(cachedPath, 'rb'),
+                         segment_offsets(cachedSegments),
+                         dict(cachedSegments))
+                        for cachedPath, cachedSegments in cached
+                        if cachedSegments and cachedPath != self._tmpPath]
+
+    def commit(self):
+        # The previous version might be replaced by the new one
+        self._assemble()
+        self._close_cached()
+        super(FileSegmentSink, self).commit()
+
+    def abort(self):
+        self._close_cached()
+        super(FileSegmentSink, self).abort()
+
+    def _read(self, segment):
+        for cached, offsets, sizes in self._cached:
+            if segment in offsets:
+                cached.seek(offsets[segment])
+                data = cached.read(sizes[segment])
+                if len(data) == sizes[segment]:
+                    return data
+        return None
+
+    def _close_cached(self):
+        for cached, _, _ in self._cached:
+            cached.close()
+        self._cached = []
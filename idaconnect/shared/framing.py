@@ -0,0 +1,192 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import struct
+
+
+class Framer(object):
+    """
+    An incremental framer splitting the raw bytes received from a socket.
+    The bytes are received into a single preallocated bytearray, which only
+    grows when needed. Only the newly received bytes are scanned for a
+    delimiter, and the consumed bytes are skipped using an offset. The
+    remaining bytes are only moved to the front when space is needed.
+
+    Two kinds of messages are supported: newline-terminated lines, and binary
+    frames made of a fixed header (type, flags, length) followed by a payload.
+    """
+    INITIAL_SIZE = 65536
+
+    # Binary frames header
+    HEADER = struct.Struct('!BBI')
+
+    # Frame types enumeration
+    FRAME_PACKET = 0x01
+    FRAME_DATA = 0x02
+
+    # Frame flags enumeration
+    FLAG_COMPRESSED = 0x01
+    FLAG_CHUNK = 0x02
+
+    def __init__(self):
+        """
+        Initialize the framer.
+        """
+        super(Framer, self).__init__()
+        self._buffer = bytearray(Framer.INITIAL_SIZE)
+        self._offset = 0
+        self._scanned = 0
+        self._end = 0
+
+    def __len__(self):
+        """
+        Return the number of bytes that haven't been consumed yet.
+
+        :return: the size
+        """
+        return self._end - self._offset
+
+    def reserve(self, size):
+        """
+        Make room for receiving at least the specified number of bytes.
+
+        :param size: the number of bytes
+        :return: a writable view on the free space
+        """
+        if len(self._buffer) - self._end < size:
+            # Move the remaining bytes to the front
+            if self._offset:
+                count = self._end - self._offset
+                self._buffer[:count] = self._buffer[self._offset:self._end]
+                self._scanned -= self._offset
+                self._offset, self._end = 0, count
+
+            # Grow the buffer if it is still too small
+            capacity = len(self._buffer)
+            while capacity - self._end < size:
+                capacity *= 2
+            if capacity > len(self._buffer):
+                self._buffer.extend(bytearray(capacity - len(self._buffer)))
+        return memoryview(self._buffer)[self._end:]
+
+    def commit(self, count):
+        """
+        Mark some bytes of the free space as received.
+
+        :param count: the number of bytes
+        """
+        self._end += count
+
+    def feed(self, data):
+        """
+        Append some raw bytes to the buffer.
+
+        :param data: the raw bytes
+        """
+        self.reserve(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self.commit(len(data))
+
+    @staticmethod
+    def header(type, size, flags=0):
+        """
+        Build the header of a binary frame.
+
+        :param type: the frame type
+        :param size: the size of the payload
+        :param flags: the frame flags
+        :return: the header bytes
+        """
+        return Framer.HEADER.pack(type, flags, size)
+
+    def peek(self):
+        """
+        Get the first byte of the buffer without consuming it.
+
+        :return: the byte value, or None if the buffer is empty
+        """
+        if self._offset == self._end:
+            return None
+        return self._buffer[self._offset]
+
+    def is_frame(self):
+        """
+        Check if the buffer starts with a binary frame rather than a line.
+
+        :return: is it a frame?
+        """
+        return self.peek() in (Framer.FRAME_PACKET, Framer.FRAME_DATA)
+
+    def read_frame(self):
+        """
+        Read a binary frame from the buffer.
+
+        :return: the type, flags and payload, or None if none is available
+        """
+        if len(self) < Framer.HEADER.size:
+            return None
+        type, flags, size = Framer.HEADER.unpack_from(self._buffer,
+                                                      self._offset)
+        start = self._offset + Framer.HEADER.size
+        if start + size > self._end:
+            return None
+        payload = bytes(self._buffer[start:start + size])
+        self._consume(start + size)
+        return type, flags, payload
+
+    def read_line(self):
+        """
+        Read a line, without its terminating newline, from the buffer.
+
+        :return: the line, or None if no complete line is available
+        """
+        pos = self._buffer.find(b'\n', self._scanned, self._end)
+        if pos < 0:
+            self._scanned = self._end
+            return None
+        line = bytes(self._buffer[self._offset:pos])
+        self._consume(pos + 1)
+        return line
+
+    def read(self, size):
+        """
+        Read at most the specified number of bytes from the buffer.
+
+        :param size: the number of bytes
+        :return: the bytes
+        """
+        end = min(self._offset + size, self._end)
+        data = bytes(self._buffer[self._offset:end])
+        self._consume(end)
+        return data
+
+    def clear(self):
+        """
+        Discard all the bytes contained in the buffer.
+        """
+        self._buffer = bytearray(Framer.INITIAL_SIZE)
+        self._offset = 0
+        self._scanned = 0
+        self._end = 0
+
+    def _consume(self, end):
+        """
+        Mark the bytes up to the specified position as consumed.
+
+        :param end: the position
+        """
+        self._offset = end
+        self._scanned = max(self._scanned, end)
+
+        # Rewind for free when everything has been consumed
+        if self._offset == self._end:
+            self._offset = self._scanned = self._end = 0
@@ -18,6 +18,7 @@ class Model(Default):
     An object that can be serialized before being sent over the network,
     but that can also be saved into the server SQL database.
     """
+    __slots__ = ()
 
     def build(self, dct):
         self.build_default(dct)
@@ -35,7 +36,7 @@ class Model(Default):
         :return: the representation
         """
         attrs = ', '.join(['{}={}'.format(key, val) for key, val in
-                           Default.attrs(self.__dict__).items()])
+                           Default.attrs_of(self).items()])
         return '{}({})'.format(self.__class__.__name__, attrs)
 
 
@@ -43,6 +44,7 @@ class Repository(Model):
     """
     The class representing a repository.
     """
+    __slots__ = ('hash', 'file', 'type', 'date')
 
     def __init__(self, hash, file, type, date):
         """
@@ -64,6 +66,7 @@ class Branch(Model):
     """
     The class representing a branch.
     """
+    __slots__ = ('uuid', 'hash', 'date', 'bits')
 
     def __init__(self, uuid, hash, date, bits):
         """
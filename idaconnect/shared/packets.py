@@ -11,7 +11,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import collections
-import itertools
+import json
+import struct
 
 
 def with_metaclass(meta, *bases):
@@ -32,11 +33,64 @@ def with_metaclass(meta, *bases):
     return type.__new__(metaclass, 'temporary_class', (), {})
 
 
+def defining_class(cls, name):
+    """
+    Get the class defining an attribute, among a class and its bases.
+
+    :param cls: the class
+    :param name: the attribute name
+    :return: the defining class, or None
+    """
+    for base in cls.__mro__:
+        if name in base.__dict__:
+            return base
+    return None
+
+
+def slot_names(cls):
+    """
+    Get the names of the slots declared by a class and its bases.
+
+    :param cls: the class
+    :return: the slot names
+    """
+    names = _SLOT_NAMES.get(cls)
+    if names is None:
+        names = []
+        for base in reversed(cls.__mro__):
+            slots = base.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names += [name for name in slots
+                      if name not in ('__dict__', '__weakref__')]
+        _SLOT_NAMES[cls] = names
+    return names
+
+
+_SLOT_NAMES = {}
+
+
+def generate_function(name, lines, namespace=None):
+    """
+    Compile a function from its source code, used to generate specialized
+    methods when a class is created.
+
+    :param name: the name of the function
+    :param lines: the lines of the source code
+    :param namespace: the globals of the function
+    :return: the function
+    """
+    namespace = dict(namespace or {})
+    exec('\n'.join(lines), namespace)
+    return namespace[name]
+
+
 class Serializable(object):
     """
     A base class for an object than can be serialized. More specifically,
     such objects can be read from and written into a Python dictionary.
     """
+    __slots__ = ()
 
     @classmethod
     def new(cls, dct):
@@ -73,7 +127,35 @@ class Serializable(object):
 class Default(Serializable):
     """
     An object that is automatically serialized using its attributes dictionary.
+
+    The attributes can also be declared as slots, so that the objects don't
+    need a dictionary. The packet factories replace these methods with
+    faster ones for classes whose fields are known: either declared in
+    __fields__, the public slots, or the parameters of their constructor.
     """
+    __slots__ = ()
+    __fields__ = None
+
+    @classmethod
+    def fields(cls):
+        """
+        Get the fields serialized by a class, if they are known.
+
+        :return: the field names, or None
+        """
+        if '__fields__' in cls.__dict__:
+            return list(cls.__fields__)
+        slots = [name for name in slot_names(cls)
+                 if not name.startswith('_')]
+        if slots and '__slots__' in cls.__dict__:
+            return slots
+        if '__init__' not in cls.__dict__:
+            return None  # they may be any attribute
+        code = cls.__init__.__code__
+        params = list(code.co_varnames[1:code.co_argcount])
+        if issubclass(cls, Reply):
+            params = params[1:]  # the query isn't stored
+        return params
 
     @staticmethod
     def attrs(dct):
@@ -87,21 +169,42 @@ class Default(Serializable):
         return {key: val for key, val in dct.items()
                 if not key.startswith('_')}
 
+    @staticmethod
+    def attrs_of(obj):
+        """
+        Get the public attributes of an object, whether they are stored in
+        its attributes dictionary or in its slots.
+
+        :param obj: the object
+        :return: the attributes
+        """
+        dct = Default.attrs(getattr(obj, '__dict__', {}))
+        for name in slot_names(type(obj)):
+            if not name.startswith('_') and hasattr(obj, name):
+                dct[name] = getattr(obj, name)
+        return dct
+
     def build_default(self, dct):
         """
         Write the object to the dictionary using its attributes dictionary.
 
         :param dct: the dictionary
         """
-        dct.update(Default.attrs(self.__dict__))
+        dct.update(Default.attrs_of(self))
 
     def parse_default(self, dct):
         """
         Read the object from the dictionary using its attributes dictionary.
+        The values without a slot are ignored if there is no dictionary.
 
         :param dct: the dictionary
         """
-        self.__dict__.update(Default.attrs(dct))
+        attrs = Default.attrs(dct)
+        for name in slot_names(type(self)):
+            if name in attrs:
+                setattr(self, name, attrs.pop(name))
+        if attrs and hasattr(self, '__dict__'):
+            self.__dict__.update(attrs)
 
 
 class PacketFactory(type):
@@ -110,6 +213,12 @@ class PacketFactory(type):
     """
     _PACKETS = {}
 
+    # The key holding the subtype of the packets of the factory
+    __key__ = None
+
+    # The packet classes by type, or by type then subtype
+    _DISPATCH = {}
+
     @staticmethod
     def __new__(mcs, name, bases, attrs):
         """
@@ -124,8 +233,51 @@ class PacketFactory(type):
         if cls.__type__ is not None \
                 and cls.__type__ not in PacketFactory._PACKETS:
             PacketFactory._PACKETS[cls.__type__] = cls
+            factory = type(cls)
+            if factory.__key__ is None:
+                PacketFactory._DISPATCH[cls.__type__] = (None, cls)
+            else:
+                PacketFactory._DISPATCH[cls.__type__] = (factory.__key__,
+                                                         factory.classes())
+        if issubclass(cls, Default):
+            mcs.generate_serializers(cls)
         return cls
 
+    @classmethod
+    def classes(mcs):
+        """
+        Get the classes registered by the factory, by subtype.
+
+        :return: the classes
+        """
+        return None
+
+    @classmethod
+    def generate_serializers(mcs, cls):
+        """
+        Generate the methods building and parsing the fields of a class,
+        instead of going through its attributes dictionary.
+
+        :param cls: the class
+        """
+        fields = cls.fields()
+        if fields is None:
+            return
+        cls.build_default = generate_function('build_default', [
+            'def build_default(self, dct):',
+            '    pass',
+        ] + ['    dct[%r] = self.%s' % (f, f) for f in fields])
+
+        # Fall back to the attributes dictionary if a field is missing
+        cls.parse_default = generate_function('parse_default', [
+            'def parse_default(self, dct):',
+            '    try:',
+            '        pass',
+        ] + ['        self.%s = dct[%r]' % (f, f) for f in fields] + [
+            '    except KeyError:',
+            '        Default.parse_default(self, dct)',
+        ], {'Default': Default})
+
     @classmethod
     def get_class(mcs, dct):
         """
@@ -134,10 +286,10 @@ class PacketFactory(type):
         :param dct: the dictionary
         :return: the packet class
         """
-        cls = PacketFactory._PACKETS[dct['type']]
-        if type(cls) != mcs:
-            cls = type(cls).get_class(dct)
-        return cls
+        key, classes = PacketFactory._DISPATCH[dct['type']]
+        if key is None:
+            return classes
+        return classes[dct[key]]
 
 
 class Packet(with_metaclass(PacketFactory, Serializable)):
@@ -145,6 +297,7 @@ class Packet(with_metaclass(PacketFactory, Serializable)):
     The base class for every packet received. Currently, the packet can
     only be of two kinds: either it is an event or a command.
     """
+    __slots__ = ()
     __type__ = None
 
     def __init__(self):
@@ -163,10 +316,7 @@ class Packet(with_metaclass(PacketFactory, Serializable)):
         :return: the packet
         """
         cls = PacketFactory.get_class(dct)
-        packet = cls.new(dct)
-        if isinstance(packet, Reply):
-            packet.trigger_initback()
-        return packet
+        return cls.new(dct)
 
     def build_packet(self):
         """
@@ -174,9 +324,7 @@ class Packet(with_metaclass(PacketFactory, Serializable)):
 
         :return: the dictionary
         """
-        dct = collections.defaultdict(collections.defaultdict)
-        self.build(dct)
-        return dct
+        return self.build({})
 
     def __repr__(self):
         """
@@ -186,10 +334,11 @@ class Packet(with_metaclass(PacketFactory, Serializable)):
         :return: the representation
         """
         name = self.__class__.__name__
-        if isinstance(self, Query) or isinstance(self, Reply):
+        if (isinstance(self, Query) or isinstance(self, Reply)) \
+                and self.__parent__ is not None:
             name = self.__parent__.__name__ + '.' + name
         attrs = ['{}={}'.format(k, v) for k, v
-                 in Default.attrs(self.__dict__).items()]
+                 in Default.attrs_of(self).items()]
         return '{}({})'.format(name, ', '.join(attrs))
 
 
@@ -199,12 +348,17 @@ class PacketDeferred(object):
     as a new callback triggered when the expected packet is being instantiated.
     """
 
-    def __init__(self):
+    def __init__(self, canceller=None):
         """
         Initialize the packet deferred.
+
+        :param canceller: the function called when it is cancelled
         """
         super(PacketDeferred, self).__init__()
+        self._canceller = canceller
         self._errback = None
+        self._failed = False
+        self._error = None
 
         self._callback = None
         self._callresult = None
@@ -234,8 +388,19 @@ class PacketDeferred(object):
         :return: the self instance
         """
         self._errback = errback
+        if self._error is not None:
+            self._run_errback(self._error)
         return self
 
+    @property
+    def called(self):
+        """
+        Returns if the deferred has already been triggered.
+
+        :return: is called?
+        """
+        return self._called or self._failed
+
     def add_initback(self, initback):
         """
         Register an initback for this deferred.
@@ -272,6 +437,29 @@ class PacketDeferred(object):
         self._initresult = result
         self._run_initback()
 
+    def errback(self, error):
+        """
+        Trigger the errback function, instead of the callback.
+
+        :param error: the exception
+        """
+        if self.called:
+            raise RuntimeError("Callback already triggered")
+        self._failed = True
+        self._error = error
+        self._run_errback(error)
+
+    def cancel(self):
+        """
+        Stop waiting for the result. Neither the callback nor the errback
+        will be called afterwards.
+        """
+        if self.called:
+            return
+        self._failed = True
+        if self._canceller:
+            self._canceller(self)
+
     def _run_callback(self):
         """
         Internal method that calls the callback/errback function.
@@ -280,7 +468,7 @@ class PacketDeferred(object):
             try:
                 self._callback(self._callresult)
             except Exception as e:
-                self._errback(e)
+                self._run_errback(e)
 
     def _run_initback(self):
         """
@@ -290,7 +478,16 @@ class PacketDeferred(object):
             try:
                 self._initback(self._initresult)
             except Exception as e:
-                self._errback(e)
+                self._run_errback(e)
+
+    def _run_errback(self, error):
+        """
+        Internal method that calls the errback function.
+
+        :param error: the exception
+        """
+        if self._errback:
+            self._errback(error)
 
 
 class EventFactory(PacketFactory):
@@ -299,6 +496,8 @@ class EventFactory(PacketFactory):
     """
     _EVENTS = {}
 
+    __key__ = 'event_type'
+
     @staticmethod
     def __new__(mcs, name, bases, attrs):
         cls = super(EventFactory, mcs).__new__(mcs, name, bases, attrs)
@@ -308,17 +507,63 @@ class EventFactory(PacketFactory):
         return cls
 
     @classmethod
-    def get_class(mcs, dct):
-        cls = EventFactory._EVENTS[dct['event_type']]
-        if type(cls) != mcs:
-            cls = type(cls).get_class(dct)
-        return cls
+    def classes(mcs):
+        return EventFactory._EVENTS
+
+    @classmethod
+    def set_default_class(mcs, default):
+        """
+        Forget about the registered events, and instantiate every event as
+        the default class instead. This is used by the server, which only
+        stores and forwards the events.
+
+        :param default: the default class
+        """
+        EventFactory._EVENTS = collections.defaultdict(lambda: default)
+        PacketFactory._DISPATCH[Event.__type__] = (EventFactory.__key__,
+                                                   EventFactory._EVENTS)
+
+    @classmethod
+    def generate_serializers(mcs, cls):
+        super(EventFactory, mcs).generate_serializers(cls)
+        fields = cls.fields()
+        if fields is None or defining_class(cls, 'build') is not Event \
+                or defining_class(cls, 'parse') is not Event \
+                or defining_class(cls, 'build_event') is not DefaultEvent \
+                or defining_class(cls, 'parse_event') is not DefaultEvent:
+            return  # the event is serialized its own way
+
+        # Build and parse the whole event at once
+        cls.build = generate_function('build', [
+            'def build(self, dct):',
+            '    dct["type"] = %r' % cls.__type__,
+            '    dct["event_type"] = self.__event__',
+            '    dct["tick"] = self._tick',
+        ] + ['    dct[%r] = self.%s' % (f, f) for f in fields] + [
+            '    return dct',
+        ])
+        parseLines = [
+            '    try:',
+            '        self._tick = dct["tick"]',
+        ] + ['        self.%s = dct[%r]' % (f, f) for f in fields] + [
+            '    except KeyError:',
+            '        Event.parse(self, dct)',
+            '    return self',
+        ]
+        cls.parse = generate_function('parse', [
+            'def parse(self, dct):',
+        ] + parseLines, {'Event': Event})
+        cls.new = classmethod(generate_function('new', [
+            'def new(cls, dct):',
+            '    self = cls.__new__(cls)',
+        ] + parseLines, {'Event': Event}))
 
 
 class Event(with_metaclass(EventFactory, Packet)):
     """
     The base class of every packet of type event received.
     """
+    __slots__ = ('_tick',)
     __type__ = 'event'
     __event__ = None
 
@@ -378,6 +623,7 @@ class DefaultEvent(Default, Event):
     """
     A mix-in class for events that can be serialized from their attributes.
     """
+    __slots__ = ()
 
     def build_event(self, dct):
         self.build_default(dct)
@@ -386,12 +632,75 @@ class DefaultEvent(Default, Event):
         self.parse_default(dct)
 
 
+class GenericEvent(DefaultEvent):
+    """
+    An event of any type, keeping all its attributes in a dictionary. It is
+    used by the server, which stores and forwards the events without
+    knowing their classes.
+    """
+    __slots__ = ('__dict__',)
+
+
+class Batch(Packet):
+    """
+    A packet carrying several events at once, sent as a single message. The
+    events are kept in order and each of them retains its own tick.
+    """
+    __type__ = 'batch'
+
+    def __init__(self, events=None):
+        """
+        Initialize a batch.
+
+        :param events: the events
+        """
+        super(Batch, self).__init__()
+        self._events = list(events or [])
+
+    def __len__(self):
+        """
+        Return the number of events in the batch.
+
+        :return: the count
+        """
+        return len(self._events)
+
+    def build(self, dct):
+        dct['type'] = self.__type__
+        dct['tick'] = self._events[-1].tick if self._events else 0
+        dct['events'] = [event.build_packet() for event in self._events]
+        return dct
+
+    def parse(self, dct):
+        self._events = [Packet.parse_packet(event) for event in dct['events']]
+        return self
+
+    @property
+    def events(self):
+        """
+        Get the events of the batch.
+
+        :return: the events
+        """
+        return self._events
+
+    def append(self, event):
+        """
+        Add an event at the end of the batch.
+
+        :param event: the event
+        """
+        self._events.append(event)
+
+
 class CommandFactory(PacketFactory):
     """
     A factory class used to instantiate the packets of type command.
     """
     _COMMANDS = {}
 
+    __key__ = 'command_type'
+
     @staticmethod
     def __new__(mcs, name, bases, attrs):
         cls = super(CommandFactory, mcs).__new__(mcs, name, bases, attrs)
@@ -410,11 +719,8 @@ class CommandFactory(PacketFactory):
         return cls
 
     @classmethod
-    def get_class(mcs, dct):
-        cls = CommandFactory._COMMANDS[dct['command_type']]
-        if type(cls) != mcs:
-            cls = type(cls).get_class(dct)
-        return cls
+    def classes(mcs):
+        return CommandFactory._COMMANDS
 
 
 class Command(with_metaclass(CommandFactory, Packet)):
@@ -471,7 +777,6 @@ class ParentCommand(Command):
     """
     An inner class that must used in order to link queries with replies.
     """
-    __callbacks__ = {}
     Query, Reply = None, None
 
 
@@ -481,14 +786,13 @@ class Query(Packet):
     """
     __parent__ = None
 
-    _NEXT_ID = itertools.count()
-
     def __init__(self):
         """
-        Initialize a query command.
+        Initialize a query command. Its identifier is assigned by the
+        connection it is sent on.
         """
         super(Query, self).__init__()
-        self._id = Query._NEXT_ID.next()
+        self._id = None
 
     def build(self, dct):
         super(Query, self).build(dct)
@@ -509,13 +813,14 @@ class Query(Packet):
         """
         return self._id
 
-    def register_callback(self, d):
+    @id.setter
+    def id(self, id):
         """
-        Register a callback for when the corresponding reply will be received.
+        Set the identifier of the query packet.
 
-        :param: the deferred to use
+        :param id: the id
         """
-        self.__parent__.__callbacks__[self._id] = d
+        self._id = id
 
 
 class Reply(Packet):
@@ -552,21 +857,6 @@ class Reply(Packet):
         """
         return self._id
 
-    def trigger_callback(self):
-        """
-        Trigger the finalization callback of the corresponding query.
-        """
-        d = self.__parent__.__callbacks__[self._id]
-        d.callback(self)
-        del self.__parent__.__callbacks__[self._id]
-
-    def trigger_initback(self):
-        """
-        Trigger the initialization callback of the corresponding query.
-        """
-        d = self.__parent__.__callbacks__[self._id]
-        d.initback(self)
-
 
 class Container(Command):
     """
@@ -582,8 +872,11 @@ class Container(Command):
         :return: the instance
         """
         self = super(Container, cls).__new__(cls)
+        self._content = None
         self._upback = None
         self._downback = None
+        self._sink = None
+        self._source = None
         return self
 
     def __init__(self):
@@ -595,6 +888,8 @@ class Container(Command):
         self._content = None
         self._upback = None
         self._downback = None
+        self._sink = None
+        self._source = None
 
     def __len__(self):
         """
@@ -606,7 +901,8 @@ class Container(Command):
 
     def build(self, dct):
         super(Container, self).build(dct)
-        dct['__size__'] = len(self._content)
+        content = self._content if self._source is None else self._source
+        dct['__size__'] = len(self) if content is None else len(content)
         return dct
 
     def parse(self, dct):
@@ -645,6 +941,8 @@ class Container(Command):
     def upback(self, upback):
         """
         Set the callback that will be called every time some data is sent.
+        It receives the number of bytes sent, the total number of bytes, and
+        the number of bytes that actually went over the network.
 
         :param upback: the callback
         """
@@ -663,7 +961,381 @@ class Container(Command):
     def downback(self, downback):
         """
         Set the callback that will be called every time some data is received.
+        It receives the number of bytes received, the total number of bytes,
+        and the number of bytes that actually went over the network.
 
         :param downback: the callback
         """
         self._downback = downback
+
+    @property
+    def sink(self):
+        """
+        Get the file-like object the received content will be written to.
+
+        :return: the sink
+        """
+        return self._sink
+
+    @sink.setter
+    def sink(self, sink):
+        """
+        Set the file-like object the received content will be written to,
+        instead of being kept in memory as the content of the packet.
+
+        :param sink: the sink
+        """
+        self._sink = sink
+
+    @property
+    def source(self):
+        """
+        Get the file-like object the sent content will be read from.
+
+        :return: the source
+        """
+        return self._source
+
+    @source.setter
+    def source(self, source):
+        """
+        Set the file-like object the sent content will be read from, instead
+        of being taken from the content of the packet.
+
+        :param source: the source
+        """
+        self._source = source
+
+
+class Codec(object):
+    """
+    The base class of the codecs converting the dictionary of a packet to
+    and from the bytes sent over the network.
+    """
+    __codec__ = None
+
+    def encode(self, dct):
+        """
+        Encode the dictionary of a packet.
+
+        :param dct: the dictionary
+        :return: the bytes
+        """
+        raise NotImplementedError("encode() not implemented")
+
+    def decode(self, data):
+        """
+        Decode the dictionary of a packet.
+
+        :param data: the bytes
+        :return: the dictionary
+        """
+        raise NotImplementedError("decode() not implemented")
+
+    def decode_header(self, data, keys):
+        """
+        Decode at least some entries of the dictionary of a packet, those
+        needed to route it. By default, the whole packet is decoded.
+
+        :param data: the bytes
+        :param keys: the keys of the entries
+        :return: the dictionary
+        """
+        return self.decode(data)
+
+    @staticmethod
+    def detect(data, codecs=None):
+        """
+        Get the codec an incoming packet was encoded with. A JSON packet is
+        an object, so it always starts with an opening brace.
+
+        :param data: the bytes
+        :param codecs: the codecs to choose from, by name
+        :return: the codec
+        """
+        codecs = CODECS if codecs is None else codecs
+        if data[:1] == b'{':
+            return codecs[JsonCodec.__codec__]
+        return codecs[BinaryCodec.__codec__]
+
+
+class JsonCodec(Codec):
+    """
+    The compatible codec, encoding the packets as JSON objects.
+    """
+    __codec__ = 'json'
+
+    def encode(self, dct):
+        return json.dumps(dct).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+class BinaryCodec(Codec):
+    """
+    A compact codec, encoding each value as a tag followed by its payload.
+    The integers (like the addresses and the ticks) are variable-length,
+    and the strings are raw UTF-8 bytes prefixed by their length.
+
+    The field names and the short strings are interned: the first time one
+    appears in a packet, it is added to a table and then only referenced by
+    its index. The table starts with the most common names, so these are
+    never sent in full. The table must only be appended to, to stay
+    compatible with older peers.
+    """
+    __codec__ = 'binary'
+
+    # Value tags enumeration (never an opening brace)
+    TAG_NONE = 0x00
+    TAG_FALSE = 0x01
+    TAG_TRUE = 0x02
+    TAG_INT = 0x03
+    TAG_NEG_INT = 0x04
+    TAG_FLOAT = 0x05
+    TAG_STR = 0x06
+    TAG_REF = 0x07
+    TAG_LIST = 0x08
+    TAG_DICT = 0x09
+
+    FLOAT = struct.Struct('!d')
+
+    # Maximum size of the strings that are interned
+    INTERN_SIZE = 32
+
+    # Codecs shared by the connections, by agreed names
+    _SHARED = {}
+
+    # Strings interned from the start
+    STRINGS = [
+        'type', 'event_type', 'command_type', 'tick', '__id__', '__size__',
+        'event', 'command', 'batch', 'events', 'hash', 'uuid', 'features',
+        'ea', 'name', 'new_name', 'local_name', 'start_ea', 'end_ea',
+        'comment', 'cmt', 'rptble', 'repeatable_cmt', 'flags', 'flag',
+        'size', 'tid', 'offset', 'value', 'bmask', 'sname', 'ename',
+        'extra', 'newname', 'oldname',
+    ]
+
+    def __init__(self, names=None):
+        """
+        Initialize the codec.
+
+        :param names: the names agreed with the other party, interned after
+            the common ones
+        """
+        super(BinaryCodec, self).__init__()
+        self._names = list(BinaryCodec.STRINGS)
+        self._names += [name for name in names or []
+                        if name not in BinaryCodec.STRINGS]
+        self._strings = {string: index for index, string
+                         in enumerate(self._names)}
+        try:
+            self._text = (bytes, unicode)  # noqa: F821
+            self._integer = (int, long)  # noqa: F821
+        except NameError:
+            self._text = (bytes, str)
+            self._integer = (int,)
+
+    def encode(self, dct):
+        out = bytearray()
+        self._encode(out, dict(self._strings), dct)
+        return bytes(out)
+
+    def _encode(self, out, strings, value):
+        """
+        Encode a value. The most common types are checked first.
+
+        :param out: the output bytearray
+        :param strings: the interned strings, and their index
+        :param value: the value
+        """
+        cls = type(value)
+        if cls is bool or value is None:
+            out.append(BinaryCodec.TAG_NONE if value is None else
+                       BinaryCodec.TAG_TRUE if value else
+                       BinaryCodec.TAG_FALSE)
+        elif cls in self._integer:
+            if value >= 0:
+                out.append(BinaryCodec.TAG_INT)
+            else:
+                out.append(BinaryCodec.TAG_NEG_INT)
+                value = -value - 1
+            while value > 0x7f:
+                out.append((value & 0x7f) | 0x80)
+                value >>= 7
+            out.append(value)
+        elif cls in self._text:
+            index = strings.get(value)
+            if index is not None:
+                out.append(BinaryCodec.TAG_REF)
+                self._write_varint(out, index)
+                return
+            data = value if cls is bytes else value.encode('utf-8')
+            out.append(BinaryCodec.TAG_STR)
+            self._write_varint(out, len(data))
+            out += data
+            if len(data) <= BinaryCodec.INTERN_SIZE:
+                strings[value] = len(strings)
+        elif isinstance(value, dict):
+            out.append(BinaryCodec.TAG_DICT)
+            self._write_varint(out, len(value))
+            for key, item in value.items():
+                self._encode(out, strings, key)
+                self._encode(out, strings, item)
+        elif cls is list or cls is tuple:
+            out.append(BinaryCodec.TAG_LIST)
+            self._write_varint(out, len(value))
+            for item in value:
+                self._encode(out, strings, item)
+        elif cls is float:
+            out.append(BinaryCodec.TAG_FLOAT)
+            out += BinaryCodec.FLOAT.pack(value)
+        else:
+            raise TypeError("%r is not serializable" % (value,))
+
+    @classmethod
+    def shared(cls, names=None):
+        """
+        Get a codec shared by all the connections using the same names, so
+        that they can be told apart by identity.
+
+        :param names: the agreed names
+        :return: the codec
+        """
+        key = tuple(names or ())
+        if key not in BinaryCodec._SHARED:
+            BinaryCodec._SHARED[key] = cls(names)
+        return BinaryCodec._SHARED[key]
+
+    @staticmethod
+    def _write_varint(out, value):
+        """
+        Write an unsigned variable-length integer, 7 bits per byte.
+
+        :param out: the output bytearray
+        :param value: the integer
+        """
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    @staticmethod
+    def _read_varint(data, offset):
+        """
+        Read an unsigned variable-length integer.
+
+        :param data: the input bytes
+        :param offset: the offset of the integer
+        :return: the integer and the offset following it
+        """
+        value, shift = 0, 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+
+    def decode(self, data):
+        data = bytearray(data)
+        value, offset = self._decode(data, 0, list(self._names))
+        if offset != len(data) or not isinstance(value, dict):
+            raise ValueError("Invalid binary packet")
+        return value
+
+    def decode_header(self, data, keys):
+        # The headers are built first, so only the first entries are read
+        data = bytearray(data)
+        if data[0] != BinaryCodec.TAG_DICT:
+            raise ValueError("Invalid binary packet")
+        count, offset = self._read_varint(data, 1)
+        strings = list(self._names)
+        header, missing = {}, set(keys)
+        for _ in range(count):
+            if not missing:
+                break
+            key, offset = self._decode(data, offset, strings)
+            header[key], offset = self._decode(data, offset, strings)
+            missing.discard(key)
+        return header
+
+    def _decode(self, data, offset, strings):
+        """
+        Decode a value. The most common tags are checked first.
+
+        :param data: the input bytes
+        :param offset: the offset of the value
+        :param strings: the interned strings
+        :return: the value and the offset following it
+        """
+        tag = data[offset]
+        offset += 1
+        if tag <= BinaryCodec.TAG_TRUE:
+            return (None, False, True)[tag], offset
+        if tag == BinaryCodec.TAG_FLOAT:
+            value, = BinaryCodec.FLOAT.unpack_from(data, offset)
+            return value, offset + BinaryCodec.FLOAT.size
+
+        # Every other value starts with a variable-length integer
+        value = data[offset]
+        offset += 1
+        if value > 0x7f:
+            value &= 0x7f
+            shift = 7
+            while True:
+                byte = data[offset]
+                offset += 1
+                value |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+
+        if tag == BinaryCodec.TAG_REF:
+            return strings[value], offset
+        if tag == BinaryCodec.TAG_INT:
+            return value, offset
+        if tag == BinaryCodec.TAG_STR:
+            end = offset + value
+            string = data[offset:end].decode('utf-8')
+            if value <= BinaryCodec.INTERN_SIZE:
+                strings.append(string)
+            return string, end
+        if tag == BinaryCodec.TAG_DICT:
+            dct = {}
+            decode = self._decode
+            for _ in range(value):
+                key, offset = decode(data, offset, strings)
+                dct[key], offset = decode(data, offset, strings)
+            return dct, offset
+        if tag == BinaryCodec.TAG_LIST:
+            items = []
+            for _ in range(value):
+                item, offset = self._decode(data, offset, strings)
+                items.append(item)
+            return items, offset
+        if tag == BinaryCodec.TAG_NEG_INT:
+            return -value - 1, offset
+        raise ValueError("Invalid tag %d" % tag)
+
+
+# Available codecs, by name
+CODECS = {codec.__codec__: codec() for codec in (JsonCodec, BinaryCodec)}
+
+
+def registry():
+    """
+    Get the names of the packet types and of their fields known locally, so
+    that the parties of a connection can agree on integers identifying them.
+
+    :return: the names
+    """
+    names = []
+    for types in (EventFactory._EVENTS, CommandFactory._COMMANDS):
+        for name, cls in sorted(types.items()):
+            names.append(name)
+            if issubclass(cls, Default):
+                names += cls.fields() or []
+    seen = set()
+    return [name for name in names if not (name in seen or seen.add(name))]
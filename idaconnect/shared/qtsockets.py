@@ -0,0 +1,265 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+from PyQt5.QtCore import (QCoreApplication, QEvent, QObject, QSocketNotifier,
+                          QTimer)
+
+from .sockets import ClientSocket
+from .streams import get_pool
+
+
+class PacketEvent(QEvent):
+    """
+    A Qt-event fired when a new packet is received by the client.
+    """
+
+    def __init__(self):
+        """
+        Initializes the new packet event.
+        """
+        evtype = QEvent.Type(QEvent.registerEventType())
+        super(PacketEvent, self).__init__(evtype)
+
+
+class ChunkEvent(QEvent):
+    """
+    A Qt-event fired when a chunk of content has been processed by the pool.
+    """
+    TYPE = QEvent.Type(QEvent.registerEventType())
+
+    def __init__(self):
+        """
+        Initializes the new chunk event.
+        """
+        super(ChunkEvent, self).__init__(ChunkEvent.TYPE)
+
+
+class CallEvent(QEvent):
+    """
+    A Qt-event fired to call a function from the thread of its receiver.
+    """
+    TYPE = QEvent.Type(QEvent.registerEventType())
+
+    def __init__(self, callback):
+        """
+        Initializes the new call event.
+
+        :param callback: the function
+        """
+        super(CallEvent, self).__init__(CallEvent.TYPE)
+        self.callback = callback
+
+
+class PoolTask(QObject):
+    """
+    Runs a function on the pool of threads, so that it doesn't block the UI,
+    then calls back with its result from the Qt event loop.
+    """
+    _running = set()  # keep the tasks alive until they call back
+
+    def __init__(self, func, args, callback, parent=None):
+        """
+        Initializes the task.
+
+        :param func: the function
+        :param args: the arguments
+        :param callback: called with the result, or None and the error
+        :param parent: the parent object
+        """
+        super(PoolTask, self).__init__(parent)
+        self._func = func
+        self._args = args
+        self._callback = callback
+
+    def start(self):
+        """
+        Start running the function.
+        """
+        PoolTask._running.add(self)
+        get_pool().apply_async(self._run)
+
+    def _run(self):
+        """
+        Run the function, from one of the threads of the pool.
+        """
+        try:
+            result, error = self._func(*self._args), None
+        except Exception as e:
+            result, error = None, e
+        QCoreApplication.postEvent(
+            self, CallEvent(lambda: self._callback(result, error)))
+
+    def event(self, event):
+        """
+        Callback called when a Qt event is fired.
+
+        :param event: the event
+        :return: was the event handled?
+        """
+        if isinstance(event, CallEvent):
+            PoolTask._running.discard(self)
+            event.callback()
+            event.accept()
+            return True
+        return super(PoolTask, self).event(event)
+
+
+class QtSocket(object):
+    """
+    A mix-in class integrating a client socket into the Qt event loop. It
+    must come before the socket class, and QObject last, in the bases.
+    """
+    _read_notifier = None
+    _write_notifier = None
+
+    def _watch(self, sock):
+        """
+        Create the notifiers of the socket, only enabling the one for
+        reading.
+
+        :param sock: the socket
+        """
+        self._read_notifier = QSocketNotifier(sock.fileno(),
+                                              QSocketNotifier.Read, self)
+        self._read_notifier.activated.connect(self._notify_read)
+        self._read_notifier.setEnabled(True)
+
+        self._write_notifier = QSocketNotifier(sock.fileno(),
+                                               QSocketNotifier.Write, self)
+        self._write_notifier.activated.connect(self._notify_write)
+        self._write_notifier.setEnabled(False)
+
+    def _unwatch(self):
+        """
+        Disable the notifiers, before the socket is closed.
+        """
+        self._read_notifier.setEnabled(False)
+        self._write_notifier.setEnabled(False)
+
+    def _set_reading(self, enabled):
+        """
+        Enable or disable the notifier calling _notify_read.
+
+        :param enabled: is it enabled?
+        """
+        self._read_notifier.setEnabled(enabled)
+
+    def _set_writing(self, enabled):
+        """
+        Enable or disable the notifier calling _notify_write.
+
+        :param enabled: is it enabled?
+        """
+        self._write_notifier.setEnabled(enabled)
+
+    def _is_writing(self):
+        """
+        Returns if the notifier calling _notify_write is enabled.
+
+        :return: is it enabled?
+        """
+        return self._write_notifier.isEnabled()
+
+    def _post_dispatch(self):
+        """
+        Post an event to ourselves, calling _dispatch once received.
+        """
+        QCoreApplication.instance().postEvent(self, PacketEvent())
+
+    def _call_later(self, delay, callback):
+        """
+        Schedule a call to a function using a single-shot timer.
+
+        :param delay: the delay in seconds
+        :param callback: the function
+        """
+        QTimer.singleShot(int(delay * 1000), callback)
+
+    def _call_from_thread(self, callback):
+        """
+        Post an event to ourselves, calling the function once received in
+        the thread of the event loop.
+
+        :param callback: the function
+        """
+        QCoreApplication.postEvent(self, CallEvent(callback))
+
+    def _notify_chunk(self):
+        """
+        Post an event to ourselves from a thread of the pool, calling
+        _chunk_ready once received.
+        """
+        QCoreApplication.postEvent(self, ChunkEvent())
+
+    def event(self, event):
+        """
+        Callback called when a Qt event is fired.
+
+        :param event: the event
+        :return: was the event handled?
+        """
+        if isinstance(event, PacketEvent):
+            self._dispatch()
+            event.accept()
+            return True
+        elif isinstance(event, ChunkEvent):
+            self._chunk_ready()
+            event.accept()
+            return True
+        elif isinstance(event, CallEvent):
+            event.callback()
+            event.accept()
+            return True
+        else:
+            event.ignore()
+            return False
+
+
+class QtServerSocket(object):
+    """
+    A mix-in class integrating a server socket into the Qt event loop.
+    """
+    _accept_notifier = None
+
+    def _watch(self, sock):
+        """
+        Create the notifier calling _notify_accept when a client is
+        connecting.
+
+        :param sock: the socket
+        """
+        self._accept_notifier = QSocketNotifier(sock.fileno(),
+                                                QSocketNotifier.Read, self)
+        self._accept_notifier.activated.connect(self._notify_accept)
+        self._accept_notifier.setEnabled(True)
+
+    def _unwatch(self):
+        """
+        Disable the notifier, before the socket is closed.
+        """
+        self._accept_notifier.setEnabled(False)
+
+
+class QtClientSocket(QtSocket, ClientSocket, QObject):
+    """
+    A client socket integrated into the Qt event loop.
+    """
+
+    def __init__(self, logger, parent=None):
+        """
+        Initializes the client socket.
+
+        :param logger: the logger to use
+        :param parent: the parent object
+        """
+        QObject.__init__(self, parent)
+        ClientSocket.__init__(self, logger, parent)
@@ -10,22 +10,139 @@
 
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
-import collections
 import logging
+import os
+import re
 import socket
+from functools import partial
 
 from .database import Database
-from .commands import (GetRepositories, GetBranches,
-                       NewRepository, NewBranch,
-                       UploadDatabase, DownloadDatabase,
-                       Subscribe, Unsubscribe)
-from .packets import Command, DefaultEvent, Event, EventFactory
+from .commands import (Error, Handshake, GetRepositories, GetBranches,
+                       ListRepositories, NewRepository, NewBranch,
+                       ResumeUpload, UploadDatabase, DownloadDatabase,
+                       FindSegments, UploadSegments, DownloadSegments,
+                       Subscribe, Unsubscribe, Resubscribe)
+from .dedup import (SegmentSource, SegmentStore, StoreSegmentSink,
+                    check_digest, load_manifest, missing_segments,
+                    remove_manifest, save_manifest, split_file)
+from .packets import (CODECS, Batch, Codec, Command, Event, EventFactory,
+                      GenericEvent, Packet, Query, registry)
+from .shards import shard_of
 from .sockets import ClientSocket, ServerSocket
+from .streams import (CHUNK_SIZE, FileSink, SpillQueue, open_source,
+                      partial_offset)
+
+# Formats of the identifiers received from the clients that are used in paths
+HASH_FORMAT = re.compile(r'[0-9A-Fa-f]{32}\Z')
+UUID_FORMAT = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                         r'[0-9a-f]{4}-[0-9a-f]{12}\Z')
+
+
+def check_format(value, format, name):
+    """
+    Check that an identifier received from a client is well-formed, before
+    it is used to build a path.
+
+    :param value: the identifier
+    :param format: the regular expression it must match
+    :param name: the name of the identifier
+    :return: the identifier
+    """
+    try:
+        valid = format.match(value) is not None
+    except TypeError:
+        valid = False
+    if not valid:
+        raise ValueError("Invalid %s %r" % (name, value))
+    return value
+
+
+def check_count(value, name):
+    """
+    Check that a number of results received from a client, a limit or an
+    offset, is a non-negative integer SQLite can bind.
+
+    :param value: the number, or None
+    :param name: the name of the number
+    :return: the integer, or None
+    """
+    if value is None:
+        return None
+    try:
+        count = int(value)
+    except (TypeError, ValueError, OverflowError):
+        count = -1
+    if not 0 <= count < 2 ** 31:
+        raise ValueError("Invalid %s %r" % (name, value))
+    return count
+
+
+class EncodedPacket(object):
+    """
+    An event, or a batch of events, received from a client and forwarded as
+    it was encoded to the clients using the same codec. It is only parsed,
+    once, for the other clients.
+    """
+
+    def __init__(self, data, codec, type):
+        """
+        Initialize the encoded packet.
+
+        :param data: the bytes
+        :param codec: the codec it was encoded with
+        :param type: the type of the packet, an event or a batch
+        """
+        super(EncodedPacket, self).__init__()
+        self._data = data
+        self._codec = codec
+        self._type = type
+        self._events = None
+
+    @property
+    def data(self):
+        """
+        Get the encoded packet.
+
+        :return: the bytes
+        """
+        return self._data
+
+    @property
+    def codec(self):
+        """
+        Get the codec the packet was encoded with.
+
+        :return: the codec
+        """
+        return self._codec
+
+    @property
+    def type(self):
+        """
+        Get the type of the packet.
+
+        :return: the type
+        """
+        return self._type
+
+    @property
+    def events(self):
+        """
+        Get the events of the packet, parsing it the first time.
+
+        :return: the events
+        """
+        if self._events is None:
+            packet = Packet.parse_packet(self._codec.decode(self._data))
+            self._events = packet.events if isinstance(packet, Batch) \
+                else [packet]
+        return self._events
 
 
 class ServerClient(ClientSocket):
     """
-    The client (server-side) implementation.
+    The client (server-side) implementation. It must be integrated into an
+    event loop by a subclass.
     """
 
     def __init__(self, logger, parent=None):
@@ -33,12 +150,20 @@ class ServerClient(ClientSocket):
         self._repo = None
         self._branch = None
         self._handlers = {}
+        self._peer = None
+        self._spill = SpillQueue(parent.shard_file('spill'))
+        self._paused = set()  # producers paused because of us
+        self._blockers = set()  # consumers we are paused because of
+        self._handoff = None
+        self._stores_encoded = False
+        self._dropped = False  # until caught up with the events sent
+        self._resubscribe = None
 
     def connect(self, sock):
         ClientSocket.connect(self, sock)
 
         # Add host and port as a prefix to our logger
-        prefix = '%s:%d' % sock.getpeername()
+        prefix = self._peer = '%s:%d' % sock.getpeername()
 
         class CustomAdapter(logging.LoggerAdapter):
             def process(self, msg, kwargs):
@@ -48,12 +173,18 @@ class ServerClient(ClientSocket):
 
         # Setup command handlers
         self._handlers = {
+            Handshake.Query: self._handle_handshake,
             GetRepositories.Query: self._handle_get_repositories,
             GetBranches.Query: self._handle_get_branches,
+            ListRepositories.Query: self._handle_list_repositories,
             NewRepository.Query: self._handle_new_repository,
             NewBranch.Query: self._handle_new_branch,
+            ResumeUpload.Query: self._handle_resume_upload,
             UploadDatabase.Query: self._handle_upload_database,
             DownloadDatabase.Query: self._handle_download_database,
+            FindSegments.Query: self._handle_find_segments,
+            UploadSegments.Query: self._handle_upload_segments,
+            DownloadSegments.Query: self._handle_download_segments,
             Subscribe: self._handle_subscribe,
             Unsubscribe: self._handle_unsubscribe,
         }
@@ -76,45 +207,430 @@ class ServerClient(ClientSocket):
         """
         return self._branch
 
+    @property
+    def peer(self):
+        """
+        Get the address of the client.
+
+        :return: the host and port
+        """
+        return self._peer
+
+    @property
+    def stats(self):
+        stats = ClientSocket.stats.fget(self)
+        stats['spilled_bytes'] = self._spill.size
+        stats['spilled_packets'] = len(self._spill)
+        stats['paused'] = bool(self._blockers)
+        return stats
+
     def disconnect(self, err=None):
         ClientSocket.disconnect(self, err)
-        self.parent().unregister_client(self)
+        self._leave()
+        self._spill.close()
         self._logger.info("Disconnected")
 
+    def attach(self, sock, state):
+        ClientSocket.attach(self, sock, state)
+
+        # Handle the packet that the connection was handed off for
+        packet = Packet.parse_packet(state['packet'])
+        self._process_packet(packet, state['framing'])
+
+    def _leave(self):
+        """
+        Stop receiving events, and stop pausing or being paused by others.
+        """
+        self.parent().unregister_client(self)
+        self._release_producers()
+        for consumer in self._blockers:
+            consumer._paused.discard(self)
+        self._blockers.clear()
+
+    def _route(self, packet):
+        """
+        Hand off the connection if the packet concerns a repository stored
+        by another process of the server.
+
+        :param packet: the packet
+        :return: is the connection being handed off?
+        """
+        if isinstance(packet, NewRepository.Query):
+            hash = packet.repo.hash
+        elif isinstance(packet, NewBranch.Query):
+            hash = packet.branch.hash
+        elif isinstance(packet, (GetRepositories.Query, GetBranches.Query,
+                                 ListRepositories.Query)):
+            hash = None  # the listings span all the shards
+        elif isinstance(packet, Command):
+            hash = getattr(packet, 'hash', None)
+        else:
+            hash = None  # the events follow the subscription
+        if hash is None or self.parent().owns(hash):
+            return False
+
+        # Stop reading, the other process will carry on from there
+        self._logger.debug("Handing off for repository %s" % hash)
+        self._handoff = {
+            'hash': hash,
+            'packet': packet.build_packet(),
+            'framing': self._container_framing,
+        }
+        if packet is self._container:
+            self._reset_container()
+        self.pause_reading()
+        self._leave()
+        self._hand_off_when_idle()
+        return True
+
+    def _hand_off_when_idle(self):
+        """
+        Hand off the connection once everything queued has been sent.
+        """
+        if self._handoff is None or self._outgoing or len(self._spill):
+            return
+        sock, state = self.detach()
+        state.update(self._handoff)
+        self._spill.close()
+        self._logger.info("Handed off")
+        self.parent().hand_off(sock, state)
+
     def recv_packet(self, packet):
+        if self._route(packet):
+            return True
+
         if isinstance(packet, Command):
-            # Call the corresponding handler
-            self._handlers[packet.__class__](packet)
+            # Call the corresponding handler, failing the invalid queries
+            try:
+                self._handlers[packet.__class__](packet)
+            except ValueError as e:
+                if not isinstance(packet, Query):
+                    raise
+                self._logger.warning("Invalid query: %s" % e)
+                self.send_packet(Error(packet, str(e)))
 
-        elif isinstance(packet, Event):
+        elif isinstance(packet, Event) or isinstance(packet, Batch):
             if not self._repo or not self._branch:
                 self._logger.warning(
                     "Received a packet from an unsubscribed client")
                 return True
 
-            # Save the event into the database
-            self.parent().database.insert_event(self, packet)
-
-            # Forward the event to the other clients
-            def shouldForward(client):
-                return client.repo == self._repo \
-                       and client.branch == self._branch and client != self
+            # Save the events into the database
+            events = packet.events if isinstance(packet, Batch) else [packet]
+            self.parent().database.insert_events(self, events)
 
-            for client in self.parent().find_clients(shouldForward):
-                client.send_packet(packet)
+            # Forward the events to the other clients
+            for client in self._subscribers():
+                client.forward_events(events, self)
         else:
             return False
         return True
 
+    def _read_packet(self, data, framing):
+        # Relay the events of a subscribed client without parsing them
+        if self._repo and self._branch:
+            try:
+                codec = Codec.detect(data, self._codecs)
+                header = codec.decode_header(data, ('type', 'tick'))
+            except Exception:
+                header = {}  # let the parser report the error
+            if header.get('type') in (Event.__type__, Batch.__type__) \
+                    and 'tick' in header:
+                self._relay(EncodedPacket(bytes(data), codec,
+                                          header['type']), header['tick'])
+                return
+        ClientSocket._read_packet(self, data, framing)
+
+    def _relay(self, packet, tick):
+        """
+        Save an encoded packet into the database, as it is if possible, then
+        forward it to the other clients.
+
+        :param packet: the encoded packet
+        :param tick: the tick of the event, or of the last one
+        """
+        database = self.parent().database
+        if packet.codec is self._codecs[ClientSocket.CODEC_JSON] \
+                or self._stores_encoded:
+            database.insert_encoded(self, tick, packet.data, self._names)
+        else:
+            database.insert_events(self, packet.events)
+
+        for client in self._subscribers():
+            client.forward_encoded(packet, self)
+
+    def _subscribers(self):
+        """
+        Get the other clients subscribed to our branch. It is a copy, as
+        forwarding can unsubscribe them.
+
+        :return: the clients
+        """
+        return [client for client in self.parent().find_subscribers(
+            self._repo, self._branch) if client is not self]
+
+    def set_names(self, names):
+        ClientSocket.set_names(self, names)
+
+        # Binary packets using the names of the database are stored as is
+        database = self.parent().database
+        self._stores_encoded = database is not None \
+            and database.is_vocabulary(names)
+
+    def agree_names(self, names):
+        # Use the names of the databases, so that the packets can be stored
+        database = self.parent().vocabulary
+        if names is None or database is None:
+            return ClientSocket.agree_names(self, names)
+        return database.add_names(list(names) + registry())
+
+    def send_events(self, events):
+        """
+        Send some events, in batches if the client accepts them. While the
+        client has a backlog on disk, the events are appended to it.
+
+        :param events: the events
+        """
+        if not self.batching or len(events) == 1:
+            packets = events
+        else:
+            packets = [Batch(events[i:i + self.BATCH_SIZE])
+                       for i in range(0, len(events), self.BATCH_SIZE)]
+
+        for packet in packets:
+            if len(self._spill) or (self.pending > self.parent().queue_high
+                                    and self.parent().queue_policy
+                                    == Server.POLICY_SPILL):
+                self._spill.push(self.encode_packet(packet))
+                self._stats['spilled_total'] += 1
+            else:
+                self.send_packet(packet)
+
+    def forward_events(self, events, producer):
+        """
+        Send some events received from another client, then apply the slow
+        consumer policy if too many bytes are waiting to be sent.
+
+        :param events: the events
+        :param producer: the client that sent the events
+        """
+        self.send_events(events)
+        self._apply_policy(producer)
+
+    def forward_encoded(self, packet, producer):
+        """
+        Send an encoded packet received from another client, as it is if
+        we use the same codec and accept batches if it is one, then apply
+        the slow consumer policy.
+
+        :param packet: the encoded packet
+        :param producer: the client that sent the packet
+        """
+        if packet.codec is not self._codec \
+                or (packet.type == Batch.__type__ and not self.batching):
+            self.forward_events(packet.events, producer)
+            return
+
+        if len(self._spill) or (self.pending > self.parent().queue_high
+                                and self.parent().queue_policy
+                                == Server.POLICY_SPILL):
+            self._spill.push(packet.data)
+            self._stats['spilled_total'] += 1
+        else:
+            self._write_packet(packet.data)
+        self._stats['relayed'] += 1
+        self._apply_policy(producer)
+
+    def _apply_policy(self, producer):
+        """
+        Apply the slow consumer policy if too many bytes are waiting to be
+        sent.
+
+        :param producer: the client that sent the last events
+        """
+        if self.pending <= self.parent().queue_high:
+            return
+
+        policy = self.parent().queue_policy
+        if policy == Server.POLICY_PAUSE and producer not in self._paused:
+            # Stop reading from the producer until we have caught up
+            self._logger.info("Pausing %s, %d bytes pending"
+                              % (producer.peer, self.pending))
+            self._stats['paused_producers'] += 1
+            self._paused.add(producer)
+            producer._blockers.add(self)
+            producer.pause_reading()
+
+        elif policy == Server.POLICY_DROP:
+            # Stop forwarding events, they'll be sent again from the database
+            self._logger.warning("Dropping subscriber, %d bytes pending"
+                                 % self.pending)
+            self._stats['dropped'] += 1
+            self.parent().unregister_client(self)
+            self._dropped = True
+            if self.features.get('resubscribe'):
+                self.send_packet(Resubscribe())
+            else:
+                self.disconnect()
+
+    def outgoing_written(self):
+        if self.pending > self.parent().queue_low:
+            return
+
+        # Refill the queue from the backlog on disk
+        while len(self._spill) and self.pending <= self.parent().queue_high:
+            self._write_packet(self._spill.pop())
+        if self.pending <= self.parent().queue_low:
+            self._release_producers()
+
+            # Subscribe again once the events we were dropped for are sent
+            self._dropped = False
+            if self._resubscribe:
+                packet, self._resubscribe = self._resubscribe, None
+                self._handle_subscribe(packet)
+        self._hand_off_when_idle()
+
+    def _release_producers(self):
+        """
+        Resume reading from the producers that were paused because of us.
+        """
+        for producer in self._paused:
+            producer._blockers.discard(self)
+            if not producer._blockers:
+                self._logger.info("Resuming %s" % producer.peer)
+                producer.resume_reading()
+        self._paused.clear()
+
+    def negotiate(self, features):
+        selected = ClientSocket.negotiate(self, features)
+
+        # Use the codec of the server if the client supports it
+        if self.parent().codec in features.get('codec', []):
+            selected['codec'] = self.parent().codec
+        return selected
+
+    def _handle_handshake(self, query):
+        features = self.negotiate(query.features)
+        names = self.agree_names(getattr(query, 'names', None))
+        self.send_packet(Handshake.Reply(query, features, names))
+        self.set_names(names)
+        self.set_features(features)
+
+    def recv_container(self, container):
+        if self._route(container):
+            return
+
+        if isinstance(container, UploadDatabase.Query):
+            # Stream the file received to disk, compressed if it was sent so
+            try:
+                filePath = self._database_path(container.hash, container.uuid)
+                if container.digest:  # older clients don't send it
+                    check_digest(container.digest)
+                container.sink = FileSink(filePath, True, container.digest,
+                                          container.offset)
+            except (IOError, OSError, ValueError) as e:
+                self.disconnect(e)  # the upload cannot be resumed
+
+        if isinstance(container, UploadSegments.Query):
+            # Assemble the file from the segments received and stored
+            try:
+                filePath = self._database_path(container.hash, container.uuid)
+                store = self._segment_store(container.hash)
+                for segment, _ in container.segments:
+                    check_digest(segment)
+                container.sink = StoreSegmentSink(filePath, container.digest,
+                                                  container.segments,
+                                                  container.missing, store)
+            except (IOError, OSError, ValueError) as e:
+                self.disconnect(e)  # the upload cannot be accepted
+
+    def _database_path(self, hash, uuid):
+        """
+        Get the path of the database file of a branch.
+
+        :param hash: the repository hash
+        :param uuid: the branch UUID
+        :return: the path
+        """
+        branch = self.parent().database.select_branch(uuid, hash)
+        if branch is None:
+            raise ValueError("Unknown branch %r" % (uuid,))
+        check_format(branch.uuid, UUID_FORMAT, 'branch')
+        fileName = branch.uuid + ('.i64' if branch.bits == 64 else '.idb')
+        return self.parent().shard_file(fileName)
+
+    def _segment_store(self, hash):
+        """
+        Get the store of the segments of the databases of a repository.
+
+        :param hash: the repository hash
+        :return: the segment store
+        """
+        check_format(hash, HASH_FORMAT, 'repository')
+        return SegmentStore(self.parent().shard_file(os.path.join('segments',
+                                                                  hash)))
+
+    def _split_database(self, filePath, callback):
+        """
+        Split a database into segments and save its manifest. It is done on
+        the pool, as hashing the whole file would block every client.
+
+        :param filePath: the path of the database
+        :param callback: called with the digest and segments, or None if the
+            file was replaced meanwhile, and the error
+        """
+        def stamp():
+            stat = os.stat(filePath)
+            return stat.st_mtime, stat.st_size, stat.st_ino
+        before = stamp()
+
+        def split_done(manifest, error):
+            if error is None:
+                if stamp() != before:
+                    manifest = None  # it would describe the old file
+                else:
+                    save_manifest(filePath, *manifest)
+            callback(manifest, error)
+        self._run_in_pool(split_file, (filePath,), split_done)
+
     def _handle_get_repositories(self, query):
-        repos = self.parent().database.select_repos(query.hash)
+        repos = []
+        for database in self.parent().databases:
+            repos += database.select_repos(query.hash)
         self.send_packet(GetRepositories.Reply(query, repos))
 
     def _handle_get_branches(self, query):
-        branches = self.parent().database.select_branches(query.uuid,
-                                                          query.hash)
+        # Older clients don't page the branches
+        offset = check_count(getattr(query, 'offset', 0), 'offset') or 0
+        limit = check_count(getattr(query, 'limit', None), 'limit')
+        end = offset + limit if limit else None
+        branches = []
+        for database in self.parent().databases:
+            branches += database.select_branches(query.uuid, query.hash, end)
+        branches = branches[offset:end]
         self.send_packet(GetBranches.Reply(query, branches))
 
+    def _handle_list_repositories(self, query):
+        # Merge the first repositories of every shard, then keep the page
+        offset = check_count(query.offset, 'offset') or 0
+        limit = check_count(query.limit, 'limit')
+        end = offset + limit if limit else None
+        listing, total = [], 0
+        for database in self.parent().databases:
+            listing += database.list_repos(query.filter, end)
+            total += database.count_repos(query.filter)
+        listing.sort(key=lambda item: (item[0].file, item[0].hash))
+        listing = listing[offset:end]
+
+        branches = []
+        if query.hash:
+            for database in self.parent().databases:
+                branches += database.select_branches(None, query.hash, limit)
+            branches = branches[:limit]
+        self.send_packet(ListRepositories.Reply(
+            query, [repo for repo, _ in listing],
+            [count for _, count in listing], total, branches))
+
     def _handle_new_repository(self, query):
         self.parent().database.insert_repo(query.repo)
         self.send_packet(NewRepository.Reply(query))
@@ -123,61 +639,192 @@ class ServerClient(ClientSocket):
         self.parent().database.insert_branch(query.branch)
         self.send_packet(NewBranch.Reply(query))
 
+    def _handle_resume_upload(self, query):
+        # Find how much of the file was received before an interruption
+        filePath = self._database_path(query.hash, query.uuid)
+        offset = partial_offset(filePath, check_digest(query.digest))
+        if offset:
+            self._logger.info("Resuming upload of %s at %d"
+                              % (os.path.basename(filePath), offset))
+        self.send_packet(ResumeUpload.Reply(query, offset))
+
     def _handle_upload_database(self, query):
-        branch = self.parent().database.select_branch(query.uuid, query.hash)
-        fileName = branch.uuid + (
-            '.i64' if branch.bits == 64 else '.idb')
-        filePath = self.parent().local_file(fileName)
-
-        # Write the file received to disk
-        with open(filePath, 'wb') as outputFile:
-            outputFile.write(query.content)
-        self._logger.info("Saved file %s" % fileName)
+        # The file has already been streamed to disk
+        self._logger.info("Saved file %s" % os.path.basename(query.sink.path))
         self.send_packet(UploadDatabase.Reply(query))
 
+        # Find the segments of the file before it is downloaded
+        remove_manifest(query.sink.path)
+        source = open_source(query.sink.path)
+        source.close()
+        if not source.packed:
+            self._split_database(query.sink.path, lambda *_: None)
+
     def _handle_download_database(self, query):
-        branch = self.parent().database.select_branch(query.uuid, query.hash)
-        fileName = branch.uuid + (
-            '.i64' if branch.bits == 64 else '.idb')
-        filePath = self.parent().local_file(fileName)
-
-        # Read file from disk and sent it
-        reply = DownloadDatabase.Reply(query)
-        with open(filePath, 'rb') as inputFile:
-            reply.content = inputFile.read()
+        filePath = self._database_path(query.hash, query.uuid)
+
+        # Send the file straight from disk, as stored if possible
+        source = open_source(filePath)
+        digest, offset = source.digest, query.offset
+        if not digest or digest != query.digest or offset > len(source) \
+                or (offset % CHUNK_SIZE and offset != len(source)):
+            offset = 0  # the range doesn't match the file anymore
+        if offset:
+            source.close()
+            source = open_source(filePath, offset)
+        reply = DownloadDatabase.Reply(query, digest, offset)
+        reply.source = source
+        self.send_packet(reply)
+
+    def _handle_find_segments(self, query):
+        store = self._segment_store(query.hash)
+        missing = [segment for segment in query.segments
+                   if not store.has(segment)]  # checks the digests
+        self.send_packet(FindSegments.Reply(query, missing))
+
+    def _handle_upload_segments(self, query):
+        # The file has already been assembled on disk
+        self._logger.info("Saved file %s (%d new segments out of %d)"
+                          % (os.path.basename(query.sink.path),
+                             len(query.missing), len(query.segments)))
+        self.send_packet(UploadSegments.Reply(query))
+
+    def _handle_download_segments(self, query):
+        filePath = self._database_path(query.hash, query.uuid)
+
+        # A compressed file cannot be sent by ranges, send it whole
+        source = open_source(filePath)
+        if source.packed:
+            reply = DownloadSegments.Reply(query, source.digest, None, None)
+            reply.source = source
+            self.send_packet(reply)
+            return
+        source.close()
+
+        # Split the file into segments, unless it was assembled from them
+        manifest = load_manifest(filePath)
+        if manifest is None:
+            self._split_database(filePath, partial(self._database_split,
+                                                   query, filePath))
+            return
+        self._send_segments(query, filePath, manifest)
+
+    def _database_split(self, query, filePath, manifest, error):
+        """
+        Called when a database to download has been split into segments.
+
+        :param query: the query
+        :param filePath: the path of the database
+        :param manifest: the digest and segments, or None
+        :param error: the error, or None
+        """
+        if not self.connected:
+            return
+        if error is not None:
+            self._logger.warning("Could not split %s: %s"
+                                 % (os.path.basename(filePath), error))
+            self.send_packet(Error(query, str(error)))
+        elif manifest is None:
+            self._handle_download_segments(query)  # the file was replaced
+        else:
+            self._send_segments(query, filePath, manifest)
+
+    def _send_segments(self, query, filePath, manifest):
+        """
+        Send the segments of a database that the client doesn't have.
+
+        :param query: the query
+        :param filePath: the path of the database
+        :param manifest: the digest and segments
+        """
+        digest, segments = manifest
+        missing, ranges = missing_segments(segments, query.known)
+        reply = DownloadSegments.Reply(query, digest, segments, missing)
+        reply.source = SegmentSource(filePath, ranges)
         self.send_packet(reply)
 
     def _handle_subscribe(self, packet):
         self._repo = packet.hash
         self._branch = packet.uuid
+        if self._dropped and self.pending > self.parent().queue_low:
+            # It would be dropped again by the next event
+            self._logger.debug("Resubscribing once caught up")
+            self._resubscribe = packet
+            return
+        self._resubscribe = None
         self.parent().register_client(self)
 
         # Send all missed events
         events = self.parent().database.select_events(self._repo, self._branch,
                                                       packet.tick)
         self._logger.debug('Sending %d missed events' % len(events))
-        for event in events:
-            self.send_packet(event)
+        self.send_events(events)
 
     def _handle_unsubscribe(self, _):
         self.parent().unregister_client(self)
+        self._resubscribe = None
         self._repo = None
         self._branch = None
 
 
 class Server(ServerSocket):
     """
-    The server implementation used by dedicated and integrated.
+    The server implementation used by dedicated and integrated. It must be
+    integrated into an event loop by a subclass.
+
+    The repositories can be split into shards, each stored and served by a
+    worker process. A supervisor process accepts the connections and hands
+    them off to the worker of the repository they concern.
     """
+    # Slow consumers policies enumeration
+    POLICY_PAUSE = 'pause'
+    POLICY_SPILL = 'spill'
+    POLICY_DROP = 'drop'
+    POLICIES = (POLICY_PAUSE, POLICY_SPILL, POLICY_DROP)
 
-    def __init__(self, logger, parent=None):
+    # Default watermarks of the outgoing queue of a client
+    QUEUE_HIGH = 16 << 20
+    QUEUE_LOW = 4 << 20
+
+    def __init__(self, logger, parent=None, shard=None, shards=1):
+        """
+        Initialize the server.
+
+        :param logger: the logger to use
+        :param parent: the parent object
+        :param shard: the shard stored, or None for the supervisor
+        :param shards: the number of shards
+        """
         ServerSocket.__init__(self, logger, parent)
-        self._clients = []
-        self._database = Database(self.local_file('database.db'))
-        self._database.initialize()
+        self._shard = shard
+        self._shards = shards
+        self._channels = {}
+        self._subscribers = {}  # by repository and branch
+        self._subscriptions = {}  # by client
+        self._connections = []
+        self._queue_policy = Server.POLICY_SPILL
+        self._queue_high = Server.QUEUE_HIGH
+        self._queue_low = Server.QUEUE_LOW
+        self._codec = ClientSocket.CODEC_JSON
+        self._database = None
+        self._databases = []
+        if shard is not None or shards == 1:
+            self._database = Database(self.shard_file('database.db'),
+                                      shards == 1)
+            self._database.initialize()
+
+        # The supervisor agrees on the names with the clients, and the
+        # workers add them to their tables as they are handed off, so that
+        # every shard identifies them the same way
+        self._vocabulary = None
+        if shards == 1:
+            self._vocabulary = self._database
+        elif shard is None:
+            self._vocabulary = Database(self.local_file('vocabulary.db'))
+            self._vocabulary.initialize()
 
         # Register default event
-        EventFactory._EVENTS = collections.defaultdict(lambda: DefaultEvent)
+        EventFactory.set_default_class(GenericEvent)
 
     def start(self, host, port):
         """
@@ -201,9 +848,91 @@ class Server(ServerSocket):
         return True
 
     def _accept(self, socket):
-        client = ServerClient(self._logger, self)
+        client = self.create_client()
+        self._connections = [conn for conn in self._connections
+                             if conn.connected] + [client]
         client.connect(socket)
 
+    def owns(self, hash):
+        """
+        Check if a repository is stored by this process.
+
+        :param hash: the repository hash
+        :return: is it stored?
+        """
+        return self._shards == 1 or shard_of(hash, self._shards) == self._shard
+
+    def connect_channel(self, shard, sock):
+        """
+        Connect the channel to another process, over which the connections
+        are handed off: to the workers from the supervisor, and to the
+        supervisor (None) from a worker.
+
+        :param shard: the shard of the other process
+        :param sock: the socket
+        """
+        channel = self.create_channel()
+        channel.connect(sock)
+        self._channels[shard] = channel
+
+    def create_channel(self):
+        """
+        Create the object handling a channel to another process. Subclasses
+        return a shard channel integrated into their event loop.
+
+        :return: the channel
+        """
+        raise NotImplementedError("create_channel() not implemented")
+
+    def hand_off(self, sock, state):
+        """
+        Hand off a connection to the process storing its repository. The
+        workers go through the supervisor.
+
+        :param sock: the socket
+        :param state: the state of the connection
+        """
+        if self._shard is None:
+            channel = self._channels.get(shard_of(state['hash'],
+                                                  self._shards))
+        else:
+            channel = self._channels.get(None)
+        try:
+            if not channel or not channel.connected:
+                raise IOError("No process for repository %s"
+                              % state['hash'])
+            channel.send_connection(sock, state)
+        except (IOError, OSError) as e:
+            self._logger.warning("Could not hand off connection")
+            self._logger.exception(e)
+        sock.close()
+
+    def adopt_client(self, sock, state):
+        """
+        Carry on with a connection handed off by another process.
+
+        :param sock: the socket
+        :param state: the state of the connection
+        """
+        if not self.owns(state['hash']):
+            self.hand_off(sock, state)
+            return
+        if state['names'] is not None:
+            self._database.add_names(state['names'])
+        client = self.create_client()
+        self._connections = [conn for conn in self._connections
+                             if conn.connected] + [client]
+        client.attach(sock, state)
+
+    def create_client(self):
+        """
+        Create the object handling a newly connected client. Subclasses
+        return a client socket integrated into their event loop.
+
+        :return: the client
+        """
+        raise NotImplementedError("create_client() not implemented")
+
     def local_file(self, filename):
         """
         Get the absolute path of a local file.
@@ -213,32 +942,161 @@ class Server(ServerSocket):
         """
         raise NotImplementedError("local_file() not implemented")
 
+    def shard_file(self, filename, shard=None):
+        """
+        Get the absolute path of a file of a shard, by default the one
+        stored by this process.
+
+        :param filename: the file name
+        :param shard: the shard index
+        :return: the path
+        """
+        shard = self._shard if shard is None else shard
+        if shard is None or self._shards == 1:
+            return self.local_file(filename)
+        shardDir = self.local_file('shard-%d' % shard)
+        try:
+            os.makedirs(shardDir)
+        except OSError:
+            if not os.path.isdir(shardDir):
+                raise
+        return os.path.join(shardDir, filename)
+
+    @property
+    def queue_policy(self):
+        """
+        Get the policy applied to the clients too slow to consume events.
+
+        :return: the policy
+        """
+        return self._queue_policy
+
+    @property
+    def queue_high(self):
+        """
+        Get the number of pending bytes above which the policy is applied.
+
+        :return: the size
+        """
+        return self._queue_high
+
+    @property
+    def queue_low(self):
+        """
+        Get the number of pending bytes below which a client has caught up.
+
+        :return: the size
+        """
+        return self._queue_low
+
+    def set_queue_policy(self, policy, high=QUEUE_HIGH, low=QUEUE_LOW):
+        """
+        Configure how the clients too slow to consume events are handled:
+        pause reading from the producers, spill the events to disk, or stop
+        sending events and have the client subscribe again.
+
+        :param policy: the policy
+        :param high: the high watermark, in bytes
+        :param low: the low watermark, in bytes
+        """
+        if policy not in Server.POLICIES or not 0 <= low <= high:
+            raise ValueError("Invalid queue policy")
+        self._queue_policy = policy
+        self._queue_high = high
+        self._queue_low = low
+
+    @property
+    def codec(self):
+        """
+        Get the codec preferred for the clients supporting it.
+
+        :return: the codec name
+        """
+        return self._codec
+
+    def set_codec(self, codec):
+        """
+        Configure the codec preferred for the clients supporting it. The
+        binary codec makes the events about half as large, but encoding and
+        decoding them in pure Python takes about twice as long as with the
+        json module, so it only pays off on slow links.
+
+        :param codec: the codec name
+        """
+        if codec not in CODECS:
+            raise ValueError("Invalid codec")
+        self._codec = codec
+
+    def queue_stats(self):
+        """
+        Get the metrics of the outgoing queue of every connected client.
+
+        :return: the metrics, by client address
+        """
+        stats = {}
+        for client in self._connections:
+            if client.connected:
+                clientStats = client.stats
+                stats[client.peer] = {
+                    key: clientStats.get(key, 0) for key in (
+                        'outgoing_bytes', 'outgoing_peak', 'spilled_bytes',
+                        'spilled_packets', 'spilled_total', 'paused',
+                        'paused_producers', 'dropped')}
+        return stats
+
+    def subscriber_counts(self):
+        """
+        Get the number of clients subscribed to each branch.
+
+        :return: the counts, by repository hash and branch UUID
+        """
+        return {key: len(clients)
+                for key, clients in self._subscribers.items()}
+
     def find_clients(self, func):
         """
-        Find all the clients matching the specified criterion.
+        Find all the subscribed clients matching the specified criterion.
 
         :param func: the filtering function
         :return: the matching clients
         """
-        return filter(func, self._clients)
+        return filter(func, self._subscriptions)
+
+    def find_subscribers(self, repo, branch):
+        """
+        Find the clients subscribed to a branch.
+
+        :param repo: the repository hash
+        :param branch: the branch UUID
+        :return: the clients
+        """
+        return self._subscribers.get((repo, branch), ())
 
     def register_client(self, client):
         """
-        Add a client to the list of connected clients.
+        Subscribe a client to its current branch, and unsubscribe it from
+        the previous one.
 
         :param client: the client
         """
-        if client not in self._clients:
-            self._clients.append(client)
+        self.unregister_client(client)
+        key = (client.repo, client.branch)
+        self._subscribers.setdefault(key, set()).add(client)
+        self._subscriptions[client] = key
 
     def unregister_client(self, client):
         """
-        Remove a client to the list of connected clients.
+        Unsubscribe a client from its branch.
 
         :param client: the client
         """
-        if client in self._clients:
-            self._clients.remove(client)
+        key = self._subscriptions.pop(client, None)
+        if key is None:
+            return
+        clients = self._subscribers[key]
+        clients.discard(client)
+        if not clients:
+            del self._subscribers[key]
 
     @property
     def database(self):
@@ -248,3 +1106,32 @@ class Server(ServerSocket):
         :return: the database
         """
         return self._database
+
+    @property
+    def vocabulary(self):
+        """
+        Get the database whose names are agreed with the clients, or None
+        for the workers, which don't handshake.
+
+        :return: the database
+        """
+        return self._vocabulary
+
+    @property
+    def databases(self):
+        """
+        Get the databases of all the shards, to list their content.
+
+        :return: the databases
+        """
+        if self._shards == 1:
+            return [self._database]
+        if not self._databases:
+            for shard in range(self._shards):
+                if shard == self._shard:
+                    self._databases.append(self._database)
+                    continue
+                database = Database(self.shard_file('database.db', shard))
+                database.initialize()
+                self._databases.append(database)
+        return self._databases
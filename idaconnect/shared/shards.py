@@ -0,0 +1,115 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+import os
+import socket
+import struct
+from multiprocessing import reduction
+
+from .sockets import ServerSocket
+
+# Header of the state of a connection handed off
+HEADER = struct.Struct('!I')
+
+
+def shard_of(hash, count):
+    """
+    Get the shard storing a repository. It only depends on the hash and
+    the number of shards, so it is the same in every process.
+
+    :param hash: the repository hash
+    :param count: the number of shards
+    :return: the shard index
+    """
+    digest = hashlib.sha1(hash.encode('utf-8')).digest()
+    return struct.unpack('!I', digest[:4])[0] % count
+
+
+def send_connection(channel, sock, state):
+    """
+    Send the socket of a connection and its state over a channel.
+
+    :param channel: the channel socket
+    :param sock: the socket of the connection
+    :param state: the state of the connection
+    """
+    reduction.send_handle(channel, sock.fileno(), None)
+    data = json.dumps(state).encode('utf-8')
+    channel.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_connection(channel):
+    """
+    Receive the socket of a connection and its state from a channel.
+
+    :param channel: the channel socket
+    :return: the socket and the state
+    """
+    fd = reduction.recv_handle(channel)
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    os.close(fd)
+    try:
+        size, = HEADER.unpack(_recv_exactly(channel, HEADER.size))
+        state = json.loads(_recv_exactly(channel, size).decode('utf-8'))
+    except Exception:
+        sock.close()
+        raise
+    return sock, state
+
+
+def _recv_exactly(channel, size):
+    """
+    Receive a number of bytes from a blocking channel.
+
+    :param channel: the channel socket
+    :param size: the number of bytes
+    :return: the bytes
+    """
+    data = b''
+    while len(data) < size:
+        chunk = channel.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Channel closed")
+        data += chunk
+    return data
+
+
+class ShardChannel(ServerSocket):
+    """
+    A socket connecting two processes of a server split into shards, over
+    which the connections of the clients are handed off. Like the server
+    socket, subclasses integrate it into an event loop.
+    """
+
+    def connect(self, sock):
+        ServerSocket.connect(self, sock)
+        sock.setblocking(True)  # the messages are read whole
+
+    def _notify_accept(self):
+        try:
+            sock, state = recv_connection(self._socket)
+        except (EOFError, IOError, OSError, RuntimeError, ValueError) as e:
+            self.disconnect(e)
+            return
+        sock.setblocking(False)
+        self.parent().adopt_client(sock, state)
+
+    def send_connection(self, sock, state):
+        """
+        Hand off a connection to the process at the other end.
+
+        :param sock: the socket of the connection
+        :param state: the state of the connection
+        """
+        send_connection(self._socket, sock, state)
@@ -10,33 +10,116 @@
 
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
+import base64
 import collections
 import errno
-import json
+import itertools
 import socket
+import time
+import zlib
 
-from PyQt5.QtCore import QCoreApplication, QEvent, QObject, QSocketNotifier
+from .commands import Error, Handshake, Ping, Pong
+from .framing import Framer
+from .packets import (CODECS, BinaryCodec, Codec, JsonCodec, Packet,
+                      PacketDeferred, Query, Reply, Container, registry)
+from .streams import (CHUNK_SIZE, ChunkPipeline, chunk_size,
+                      compress_chunk, decompress_chunk, get_pool)
 
-from .packets import Packet, PacketDeferred, Query, Reply, Container
 
-
-class PacketEvent(QEvent):
+class Request(object):
     """
-    A Qt-event fired when a new packet is received by the client.
+    A query sent to the other party, waiting for its reply.
     """
+    __slots__ = ('query', 'deferred', 'timeout', 'sent', 'active')
+
+    def __init__(self, query, deferred, timeout):
+        """
+        Initialize a request.
+
+        :param query: the query
+        :param deferred: the deferred of the reply
+        :param timeout: the seconds without progress before giving up
+        """
+        self.query = query
+        self.deferred = deferred
+        self.timeout = timeout
+        self.sent = None
+        self.active = None
 
-    def __init__(self):
+    @property
+    def command(self):
         """
-        Initializes the new packet event.
+        Get the type of the command being requested.
+
+        :return: the command type
         """
-        evtype = QEvent.Type(QEvent.registerEventType())
-        super(PacketEvent, self).__init__(evtype)
+        return self.query.__parent__.__command__
 
 
-class ClientSocket(QObject):
+class ClientSocket(object):
     """
-    A class wrapping a Python socket and integrated into the Qt event loop.
+    A class wrapping a Python socket and implementing the protocol. It is
+    independent of any event loop: subclasses integrate it into one by
+    implementing the methods watching the socket and scheduling callbacks.
     """
+    # Framing modes enumeration
+    FRAMING_LINE = 'line'
+    FRAMING_BINARY = 'binary'
+
+    # Compression methods enumeration
+    COMPRESSION_NONE = 'none'
+    COMPRESSION_ZLIB = 'zlib'
+    COMPRESSION_LEVEL = 6
+
+    # Packet codecs enumeration
+    CODEC_JSON = JsonCodec.__codec__
+    CODEC_BINARY = BinaryCodec.__codec__
+
+    # Size of the history of a compression stream (the deflate window)
+    COMPRESSION_WINDOW = 1 << zlib.MAX_WBITS
+
+    # Size of the data frames used when sending files
+    FILE_FRAME_SIZE = 1 << 20
+
+    # Bounds of the adaptive size of the receive calls
+    READ_SIZE_MIN = 4096
+    READ_SIZE_MAX = 1 << 20
+
+    # Maximum number of buffers gathered into a single send
+    SEND_BUFFERS = 1024
+    # Maximum number of bytes joined when sendmsg is not available
+    SEND_JOIN_SIZE = 65536
+
+    # Maximum number of events sent in a single batch
+    BATCH_SIZE = 1000
+
+    # Seconds a query can go without progress before it times out
+    REQUEST_TIMEOUT = 60
+    # Maximum number of queries waiting for their reply, the next are queued
+    REQUESTS_MAX = 16
+    # Interval between the checks of the timeouts of the queries
+    REQUEST_SWEEP = 1
+
+    # Seconds between the pings sent to the other party
+    HEARTBEAT_INTERVAL = 15
+    # Seconds without receiving anything before the other party is dead
+    HEARTBEAT_TIMEOUT = 60
+    # Gains of the smoothed round-trip time and of its variation
+    RTT_ALPHA = 1.0 / 8
+    RTT_BETA = 1.0 / 4
+
+    # Supported features, by order of preference
+    FEATURES = {
+        'framing': [FRAMING_BINARY, FRAMING_LINE],
+        'batch': [True, False],
+        'compression': [COMPRESSION_ZLIB, COMPRESSION_NONE],
+        'codec': [CODEC_JSON, CODEC_BINARY],  # see Server.set_codec
+        'resume': [True, False],
+        'dedup': [True, False],
+        'resubscribe': [True, False],
+        'listing': [True, False],
+        'heartbeat': [True, False],
+    }
 
     def __init__(self, logger, parent=None):
         """
@@ -45,20 +128,53 @@ class ClientSocket(QObject):
         :param logger: the logger to user
         :param parent: the parent object
         """
-        QObject.__init__(self, parent)
+        self._parent = parent
         self._logger = logger
         self._socket = None
 
-        self._read_buffer = b''
-        self._read_notifier = None
+        self._framer = Framer()
+        self._read_size = ClientSocket.READ_SIZE_MIN
+        self._read_pending = False
+        self._read_paused = False
 
-        self._write_buffer = b''
-        self._write_notifier = None
+        self._write_offset = 0
+        self._outgoing_size = 0
+        self._file_offset = 0
+        self._file_end = 0
+        self._file_wire = 0
+        self._pipeline = None
 
         self._connected = False
         self._outgoing = collections.deque()
-        self._incoming = collections.deque()
+        self._framing = ClientSocket.FRAMING_LINE
+        self._features = {}
+        self._batching = False
+        self._codecs = dict(CODECS)
+        self._codec = CODECS[ClientSocket.CODEC_JSON]
+        self._names = None
+        self._rtt = None
+        self._rttvar = None
+        self._heartbeat = False
+        self._beating = False
+        self._last_read = 0
+        self._compressor = None
+        self._decompressor = None
+        self._deflate_started = False
+        self._inflate_history = bytearray()
+
         self._container = None
+        self._container_framing = None
+        self._container_chunks = []
+        self._container_count = 0
+        self._container_wire = 0
+
+        self._requests = {}
+        self._waiting = collections.deque()
+        self._request_ids = itertools.count()
+        self._sweeping = False
+        self._latencies = collections.defaultdict(collections.Counter)
+
+        self._stats = collections.Counter()
 
     @staticmethod
     def _chunkify(bs, n=65535):
@@ -72,6 +188,14 @@ class ClientSocket(QObject):
         for i in range(0, len(bs), n):
             yield bs[i:i + n]
 
+    def parent(self):
+        """
+        Get the parent object.
+
+        :return: the parent
+        """
+        return self._parent
+
     @property
     def connected(self):
         """
@@ -81,24 +205,262 @@ class ClientSocket(QObject):
         """
         return self._connected
 
+    @property
+    def features(self):
+        """
+        Get the features negotiated with the other party.
+
+        :return: the features
+        """
+        return self._features
+
+    @property
+    def batching(self):
+        """
+        Returns if the other party accepts batches of events.
+
+        :return: is batching?
+        """
+        return self._batching
+
+    @property
+    def rtt(self):
+        """
+        Get the smoothed round-trip time measured with the other party.
+
+        :return: the time in seconds, or None if not measured yet
+        """
+        return self._rtt
+
+    @property
+    def rttvar(self):
+        """
+        Get the smoothed variation of the round-trip time.
+
+        :return: the time in seconds, or None if not measured yet
+        """
+        return self._rttvar
+
+    @property
+    def pending(self):
+        """
+        Get the number of bytes queued in memory waiting to be sent. The
+        content of the files being sent is not accounted for.
+
+        :return: the size
+        """
+        return self._outgoing_size - self._write_offset
+
+    @property
+    def stats(self):
+        """
+        Get the counters measuring the activity of the socket.
+
+        :return: the counters
+        """
+        stats = dict(self._stats)
+        stats['outgoing_bytes'] = self.pending
+        stats['queries_in_flight'] = len(self._requests)
+        stats['queries_waiting'] = len(self._waiting)
+        if self._rtt is not None:
+            stats['rtt'] = self._rtt
+            stats['rttvar'] = self._rttvar
+        if self._stats['write_flushes']:
+            flushes = float(self._stats['write_flushes'])
+            stats['write_syscalls_per_flush'] = \
+                self._stats['write_syscalls'] / flushes
+            stats['write_bytes_per_flush'] = \
+                self._stats['write_bytes'] / flushes
+        if self._stats['compress_out']:
+            stats['compress_ratio'] = self._stats['compress_in'] \
+                / float(self._stats['compress_out'])
+        if self._stats['decompress_in']:
+            stats['decompress_ratio'] = self._stats['decompress_out'] \
+                / float(self._stats['decompress_in'])
+        return stats
+
+    @property
+    def latencies(self):
+        """
+        Get the histograms of the time taken by the other party to reply, by
+        command type. The buckets are powers of two of milliseconds, each
+        counting the replies received in at most that time.
+
+        :return: the histograms
+        """
+        return {command: dict(buckets)
+                for command, buckets in self._latencies.items()}
+
     def connect(self, sock):
         """
         Wraps the socket with the current object.
 
         :param sock: the socket
         """
-        self._read_notifier = QSocketNotifier(sock.fileno(),
-                                              QSocketNotifier.Read, self)
-        self._read_notifier.activated.connect(self._notify_read)
-        self._read_notifier.setEnabled(True)
-
-        self._write_notifier = QSocketNotifier(sock.fileno(),
-                                               QSocketNotifier.Write, self)
-        self._write_notifier.activated.connect(self._notify_write)
-        self._write_notifier.setEnabled(False)
+        self._watch(sock)
 
         self._socket = sock
         self._connected = True
+        self._read_paused = False
+        self._framing = ClientSocket.FRAMING_LINE
+        self._features = {}
+        self._batching = False
+        self._codecs = dict(CODECS)
+        self._codec = CODECS[ClientSocket.CODEC_JSON]
+        self._names = None
+        self._rtt = None
+        self._rttvar = None
+        self._heartbeat = False
+        self._last_read = time.time()
+        self._compressor = None
+        self._decompressor = None
+        self._deflate_started = False
+        self._inflate_history = bytearray()
+
+    def detach(self):
+        """
+        Stop handling the connection without closing it, so that another
+        process can carry on with it. The outgoing queue must be empty.
+
+        :return: the socket and the state of the connection
+        """
+        # The streams are continued raw: the zlib headers were already sent
+        inflate = None
+        if self._decompressor:
+            inflate = base64.b64encode(bytes(self._inflate_history))
+            inflate = inflate.decode('ascii')
+        incoming = self._framer.read(len(self._framer))
+        state = {
+            'features': self._features,
+            'names': self._names,
+            'deflate': self._deflate_started,
+            'inflate': inflate,
+            'incoming': base64.b64encode(incoming).decode('ascii'),
+        }
+
+        sock = self._socket
+        self._unwatch()
+        self._release()
+        return sock, state
+
+    def attach(self, sock, state):
+        """
+        Carry on with a connection detached by another process.
+
+        :param sock: the socket
+        :param state: the state of the connection
+        """
+        self.connect(sock)
+        self.set_names(state['names'])
+        self.set_features(state['features'])
+        if self._compressor and state['deflate']:
+            self._compressor = zlib.compressobj(
+                ClientSocket.COMPRESSION_LEVEL, zlib.DEFLATED,
+                -zlib.MAX_WBITS)
+            self._deflate_started = True
+
+        # Give the back-references of the incoming stream their target
+        if state['inflate'] is not None:
+            history = base64.b64decode(state['inflate'])
+            primer = zlib.compressobj(0, zlib.DEFLATED, -zlib.MAX_WBITS)
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._decompressor.decompress(primer.compress(history)
+                                          + primer.flush(zlib.Z_SYNC_FLUSH))
+            self._inflate_history = bytearray(history)
+
+        incoming = base64.b64decode(state['incoming'])
+        if incoming:
+            self._framer.feed(incoming)
+            self._read_pending = True
+            self._post_dispatch()
+
+    def handshake(self):
+        """
+        Negotiate with the other party the features used by the connection,
+        and the names identified by integers. Until it replies, and forever
+        if it is too old to understand the query, the connection keeps using
+        newline-terminated JSON packets.
+        """
+        start = time.time()
+
+        def handshakeReplied(reply):
+            self._measure_rtt(time.time() - start)
+            self._logger.debug("Negotiated features: %s" % reply.features)
+            self.set_names(getattr(reply, 'names', None))
+            self.set_features(reply.features)
+
+        d = self.send_packet(Handshake.Query(self.FEATURES, registry()))
+        d.add_callback(handshakeReplied)
+        d.add_errback(self._logger.exception)
+
+    def negotiate(self, features):
+        """
+        Select, among the features offered by the other party, the preferred
+        value of each that is also supported locally.
+
+        :param features: the offered features
+        :return: the selected features
+        """
+        selected = {}
+        for name, values in features.items():
+            supported = self.FEATURES.get(name, [])
+            for value in values:
+                if value in supported:
+                    selected[name] = value
+                    break
+        return selected
+
+    def agree_names(self, names):
+        """
+        Agree on the names identified by integers, from the names known to
+        the other party followed by those only known locally.
+
+        :param names: the offered names, or None if not supported
+        :return: the agreed names, or None
+        """
+        if names is None:
+            return None
+        known = set(names)
+        return list(names) + [name for name in registry()
+                              if name not in known]
+
+    def set_names(self, names):
+        """
+        Start identifying the agreed names by integers in binary packets,
+        the index of each in the list.
+
+        :param names: the agreed names, or None
+        """
+        self._names = names
+        self._codecs[ClientSocket.CODEC_BINARY] = BinaryCodec.shared(names)
+
+    def set_features(self, features):
+        """
+        Start using the negotiated features for the outgoing packets. The
+        incoming packets are detected as lines or frames as they arrive.
+
+        :param features: the selected features
+        """
+        self._features = features
+        self._framing = features.get('framing', ClientSocket.FRAMING_LINE)
+        self._batching = features.get('batch', False)
+        self._heartbeat = features.get('heartbeat', False)
+        if self._heartbeat:
+            self._schedule_heartbeat()
+
+        # Binary packets may contain newlines, so they need binary framing
+        codec = features.get('codec', ClientSocket.CODEC_JSON)
+        if self._framing != ClientSocket.FRAMING_BINARY:
+            codec = ClientSocket.CODEC_JSON
+        self._codec = self._codecs[codec]
+
+        # Compress the packet frames using a single stream
+        compression = features.get('compression',
+                                   ClientSocket.COMPRESSION_NONE)
+        if compression == ClientSocket.COMPRESSION_ZLIB \
+                and self._framing == ClientSocket.FRAMING_BINARY:
+            self._compressor = zlib.compressobj(
+                ClientSocket.COMPRESSION_LEVEL)
 
     def disconnect(self, err=None):
         """
@@ -111,101 +473,490 @@ class ClientSocket(QObject):
         if err:
             self._logger.warning("Connection lost")
             self._logger.exception(err)
-        self._read_notifier.setEnabled(False)
-        self._write_notifier.setEnabled(False)
+        self._unwatch()
         try:
             self._socket.close()
         except socket.error:
             pass
+        self._release()
+        self._fail_requests(IOError("Connection lost"))
+
+    def _release(self):
+        """
+        Forget about the socket and everything still queued for it.
+        """
         self._socket = None
         self._connected = False
+        self._framer.clear()
+        self._compressor = None
+        self._decompressor = None
+        if self._container and self._container.sink:
+            self._container.sink.abort()
+        self._reset_container()
+
+        # Release the files that were being sent
+        for data in self._outgoing:
+            if isinstance(data, tuple) and data[0].source is not None:
+                data[0].source.close()
+        self._outgoing.clear()
+        self._outgoing_size = 0
+        self._write_offset = 0
+        self._reset_file()
 
     def _notify_read(self):
         """
         Callback called when some data is ready to be read on the socket.
+        The data is received directly into the framer, and the receive size
+        grows under sustained throughput and shrinks back when idle.
         """
-        while True:
+        received = False
+        while self._socket:
+            view = self._framer.reserve(self._read_size)
             try:
-                data = self._socket.recv(4096)
+                count = self._socket.recv_into(view, self._read_size)
             except socket.error as e:
                 if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
                     self.disconnect(e)
                 break
-            if not data:
+            finally:
+                del view  # the buffer cannot grow while it is exported
+            self._stats['read_syscalls'] += 1
+            if not count:
+                self.disconnect()
                 break
-            self._incoming.append(data)
-        if self._incoming:
-            QCoreApplication.instance().postEvent(self, PacketEvent())
+            self._stats['read_bytes'] += count
+            self._framer.commit(count)
+            self._last_read = time.time()
+            received = True
+
+            # Adapt the size of the next receive call
+            if count == self._read_size:
+                self._read_size = min(self._read_size * 2,
+                                      ClientSocket.READ_SIZE_MAX)
+            elif count < self._read_size // 4:
+                self._read_size = max(self._read_size // 2,
+                                      ClientSocket.READ_SIZE_MIN)
+
+        if received and not self._read_pending:
+            self._read_pending = True
+            self._post_dispatch()
 
     def _notify_write(self):
         """
         Callback called when some data is ready to written on the socket.
         """
-        while True:
-            if not self._write_buffer:
-                if not self._outgoing:
-                    break
-                data = self._outgoing.popleft()
-                if not data:
-                    continue
-                self._write_buffer = data
+        self._stats['write_flushes'] += 1
+        while self._socket and self._outgoing:
             try:
-                count = self._socket.send(self._write_buffer)
+                if isinstance(self._outgoing[0], tuple):
+                    if not self._send_file():
+                        # Wait for the pool to process the next chunk
+                        self._set_writing(False)
+                        return
+                else:
+                    self._send_buffers()
             except socket.error as e:
                 if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
                     self.disconnect(e)
                 break
-            self._write_buffer = self._write_buffer[count:]
-        if not self._write_buffer:
-            self._write_notifier.setEnabled(False)
+        if not self._outgoing:
+            self._set_writing(False)
+        if self._socket:
+            self.outgoing_written()
 
-    def event(self, event):
+    def pause_reading(self):
         """
-        Callback called when a Qt event is fired.
+        Stop reading from the socket, and processing the messages already
+        received, until the reading is resumed.
+        """
+        if self._socket and not self._read_paused:
+            self._read_paused = True
+            self._set_reading(False)
 
-        :param event: the event
-        :return: was the event handled?
+    def resume_reading(self):
         """
-        if isinstance(event, PacketEvent):
-            self._dispatch()
-            event.accept()
-            return True
+        Resume reading from the socket, starting with the messages received
+        while the reading was paused.
+        """
+        if self._socket and self._read_paused:
+            self._read_paused = False
+            self._set_reading(True)
+            if len(self._framer) and not self._read_pending:
+                self._read_pending = True
+                self._post_dispatch()
+
+    def _send_buffers(self):
+        """
+        Sends as many of the queued buffers as possible in a single call. The
+        progress in the first buffer is tracked using an offset.
+        """
+        buffers = []
+        for data in self._outgoing:
+            if isinstance(data, tuple) \
+                    or len(buffers) == ClientSocket.SEND_BUFFERS:
+                break
+            buffers.append(data)
+        buffers[0] = memoryview(buffers[0])[self._write_offset:]
+
+        if hasattr(self._socket, 'sendmsg'):
+            count = self._socket.sendmsg(buffers)
         else:
-            event.ignore()
+            # Join the smallest buffers to save on system calls
+            size, joined = 0, []
+            for data in buffers:
+                if joined and size + len(data) > ClientSocket.SEND_JOIN_SIZE:
+                    break
+                joined.append(data)
+                size += len(data)
+            if len(joined) > 1:
+                joined[0] = joined[0].tobytes()
+                joined = [b''.join(joined)]
+            count = self._socket.send(joined[0])
+        self._stats['write_syscalls'] += 1
+        self._stats['write_bytes'] += count
+
+        # Drop the buffers that have been completely sent
+        count += self._write_offset
+        while count and count >= len(self._outgoing[0]):
+            data = self._outgoing.popleft()
+            count -= len(data)
+            self._outgoing_size -= len(data)
+        self._write_offset = count
+
+    def _send_file(self):
+        """
+        Sends the next part of the content of the container being sent. The
+        content is sent straight from the file when the other party accepts
+        it as stored, and processed chunk by chunk on the pool otherwise.
+
+        :return: False if waiting for the pool, True otherwise
+        """
+        container, framing, chunked = self._outgoing[0]
+        source = container.source
+        if source is not None and source.packed == chunked:
+            self._send_file_range()
+            return True
+
+        if not self._pipeline:
+            self._pipeline = self._create_pipeline(container, chunked)
+        if self._pipeline.finished:
+            self._finish_file()
+            return True
+        if not self._pipeline.ready():
             return False
 
+        # Queue the next chunk before the container
+        data = self._pipeline.pop()
+        if chunked:
+            buffers = [Framer.header(Framer.FRAME_DATA, len(data),
+                                     Framer.FLAG_CHUNK), data]
+            self._file_offset += chunk_size(data)
+        else:
+            buffers = [data]
+            if framing == ClientSocket.FRAMING_BINARY:
+                buffers.insert(0, Framer.header(Framer.FRAME_DATA, len(data)))
+            self._file_offset += len(data)
+        self._file_wire += len(data)
+        self._outgoing.extendleft(reversed(buffers))
+        self._outgoing_size += sum(len(buf) for buf in buffers)
+        self._request_progress(container, Query)
+        if container.upback:  # trigger upload callback
+            total = len(source) if source is not None \
+                else len(container.content)
+            container.upback(self._file_offset, total, self._file_wire)
+        return True
+
+    def _send_file_range(self):
+        """
+        Sends the next part of the content of the container being sent from
+        a file. In binary framing, the content is split into data frames,
+        unless it is already made of them.
+        """
+        container, framing, chunked = self._outgoing[0]
+        source = container.source
+        if self._file_offset == self._file_end:
+            if self._file_offset == source.wire_size:
+                self._finish_file()
+                return
+
+            # Start the next data frame
+            if framing == ClientSocket.FRAMING_BINARY and not source.packed:
+                size = min(ClientSocket.FILE_FRAME_SIZE,
+                           source.wire_size - self._file_offset)
+                self._file_end = self._file_offset + size
+                header = Framer.header(Framer.FRAME_DATA, size)
+                self._outgoing.appendleft(header)
+                self._outgoing_size += len(header)
+                return
+            self._file_end = source.wire_size
+
+        count = source.send(self._socket, self._file_offset,
+                            self._file_end - self._file_offset)
+        self._stats['write_syscalls'] += 1
+        self._stats['write_bytes'] += count
+        if not count:
+            self.disconnect(EOFError("File %s is truncated" % source.path))
+            return
+        self._file_offset += count
+        self._request_progress(container, Query)
+        if container.upback:  # trigger upload callback
+            # The raw progress of a packed file is only estimated
+            raw = len(source) * self._file_offset // max(source.wire_size, 1)
+            container.upback(raw, len(source), self._file_offset)
+
+    def _create_pipeline(self, container, chunked):
+        """
+        Creates the pipeline processing the content of a container.
+
+        :param container: the container
+        :param chunked: does the other party accept compressed chunks?
+        :return: the pipeline
+        """
+        source = container.source
+        if not chunked:
+            # Only packed files have to be decompressed
+            return ChunkPipeline(source.chunks(), decompress_chunk,
+                                 self._notify_chunk)
+        if source is not None:
+            blocks = source.blocks()
+        else:
+            blocks = self._chunkify(container.content, CHUNK_SIZE)
+        return ChunkPipeline(blocks, compress_chunk, self._notify_chunk)
+
+    def _notify_chunk(self):
+        """
+        Callback called from the pool when a chunk has been processed. As it
+        is called from another thread, it must only schedule _chunk_ready.
+        """
+        raise NotImplementedError("_notify_chunk() not implemented")
+
+    def _chunk_ready(self):
+        """
+        Called in the event loop when a chunk has been processed.
+        """
+        if self._socket and self._outgoing:
+            self._set_writing(True)
+
+    def _finish_file(self):
+        """
+        Forgets about the container whose content has been completely sent.
+        """
+        container = self._outgoing.popleft()[0]
+        if container.source is not None:
+            container.source.close()
+        self._reset_file()
+
+    def _reset_file(self):
+        """
+        Resets the state of the content being sent.
+        """
+        if self._pipeline:
+            self._pipeline.close()
+        self._pipeline = None
+        self._file_offset = self._file_end = self._file_wire = 0
+
+    def _watch(self, sock):
+        """
+        Start watching the socket, for reading only.
+
+        :param sock: the socket
+        """
+        raise NotImplementedError("_watch() not implemented")
+
+    def _unwatch(self):
+        """
+        Stop watching the socket, before it is closed.
+        """
+        raise NotImplementedError("_unwatch() not implemented")
+
+    def _set_reading(self, enabled):
+        """
+        Enable or disable calling _notify_read when the socket is readable.
+
+        :param enabled: is it enabled?
+        """
+        raise NotImplementedError("_set_reading() not implemented")
+
+    def _set_writing(self, enabled):
+        """
+        Enable or disable calling _notify_write when the socket is writable.
+
+        :param enabled: is it enabled?
+        """
+        raise NotImplementedError("_set_writing() not implemented")
+
+    def _is_writing(self):
+        """
+        Returns if _notify_write is called when the socket is writable.
+
+        :return: is it enabled?
+        """
+        raise NotImplementedError("_is_writing() not implemented")
+
+    def _post_dispatch(self):
+        """
+        Schedule a call to _dispatch, once the control returns to the loop.
+        """
+        raise NotImplementedError("_post_dispatch() not implemented")
+
+    def _call_later(self, delay, callback):
+        """
+        Schedule a call to a function, after some time.
+
+        :param delay: the delay in seconds
+        :param callback: the function
+        """
+        raise NotImplementedError("_call_later() not implemented")
+
+    def _call_from_thread(self, callback):
+        """
+        Schedule a call to a function in the event loop, from another thread.
+
+        :param callback: the function
+        """
+        raise NotImplementedError("_call_from_thread() not implemented")
+
+    def _run_in_pool(self, func, args, callback):
+        """
+        Run a function on the pool of threads, so that it doesn't block the
+        event loop, then call back with its result from the event loop.
+
+        :param func: the function
+        :param args: the arguments
+        :param callback: called with the result, or None and the error
+        """
+        def run():
+            try:
+                result, error = func(*args), None
+            except Exception as e:
+                result, error = None, e
+            self._call_from_thread(lambda: callback(result, error))
+        get_pool().apply_async(run)
+
     def _dispatch(self):
         """
-        Callback called when a packet event is fired.
+        Callback called to process the data received.
+        """
+        self._read_pending = False
+        self._read_raw()
+
+    def _read_raw(self):
+        """
+        Reads the complete messages contained in the framer.
         """
-        while self._incoming:
-            data = self._incoming.popleft()
-            self._read_raw(data)
+        while self._socket and not self._read_paused and len(self._framer):
+            if self._container_framing == ClientSocket.FRAMING_LINE:
+                # Raw data directly follows the container
+                remaining = len(self._container) - self._container_count
+                self._read_content(self._framer.read(remaining))
+            elif self._framer.is_frame():
+                frame = self._framer.read_frame()
+                if frame is None:
+                    break
+                self._read_frame(*frame)
+            else:
+                line = self._framer.read_line()
+                if line is None:
+                    break
+                self._read_line(line)
 
-    def _read_raw(self, data):
+    def _read_frame(self, type, flags, payload):
         """
-        Reads some raw from the underlying socket.
+        Reads a binary frame from the underlying socket.
+
+        :param type: the frame type
+        :param flags: the frame flags
+        :param payload: the frame payload
+        """
+        if flags & Framer.FLAG_COMPRESSED:
+            try:
+                payload = self._decompress(payload)
+            except zlib.error as e:
+                self.disconnect(e)
+                return
+
+        if type == Framer.FRAME_PACKET:
+            self._read_packet(payload, ClientSocket.FRAMING_BINARY)
+        elif self._container_framing == ClientSocket.FRAMING_BINARY \
+                and flags & Framer.FLAG_CHUNK:
+            self._read_chunk(payload)
+        elif self._container_framing == ClientSocket.FRAMING_BINARY:
+            self._read_content(payload)
+        else:
+            self._logger.warning("Unexpected data frame received")
+
+    def _read_content(self, data):
+        """
+        Reads some raw data belonging to the current container.
 
         :param data: the raw bytes
         """
-        self._read_buffer += data
-
-        while b'\n' in self._read_buffer and not self._container:
-            lines = self._read_buffer.split(b'\n')
-            self._read_buffer = b'\n'.join(lines[1:])
-            self._read_line(lines[0])
-
-        if self._container:
-            # Append raw data to content already received
-            if self._container.downback:  # trigger download callback
-                self._container.downback(len(self._read_buffer),
-                                         len(self._container))
-            if len(self._read_buffer) >= len(self._container):
-                content = self._read_buffer[:len(self._container)]
-                self._read_buffer = self._read_buffer[len(content):]
-                self._container.content = content
-                self._handle_packet(self._container)
-                self._container = None
+        container = self._container
+        if container.sink:
+            try:
+                container.sink.write(data)
+            except (IOError, OSError, ValueError) as e:
+                self.disconnect(e)
+                return
+        else:
+            self._container_chunks.append(data)
+        self._content_read(len(data), len(data))
+
+    def _read_chunk(self, chunk):
+        """
+        Reads a compressed chunk belonging to the current container.
+
+        :param chunk: the compressed chunk
+        """
+        container = self._container
+        try:
+            if container.sink:
+                count = container.sink.write_chunk(chunk)
+            else:
+                data = decompress_chunk(chunk)
+                self._container_chunks.append(data)
+                count = len(data)
+        except (IOError, OSError, ValueError, zlib.error) as e:
+            self.disconnect(e)
+            return
+        self._content_read(count, len(chunk))
+
+    def _content_read(self, count, wire):
+        """
+        Accounts for some content of the current container having been read.
+
+        :param count: the number of raw bytes
+        :param wire: the number of bytes received
+        """
+        container = self._container
+        self._container_count += count
+        self._container_wire += wire
+        self._request_progress(container, Reply)
+        if container.downback:  # trigger download callback
+            container.downback(self._container_count, len(container),
+                               self._container_wire)
+
+        if self._container_count >= len(container):
+            if container.sink:
+                try:
+                    container.sink.commit()
+                except (IOError, OSError, ValueError) as e:
+                    self.disconnect(e)
+                    return
+            else:
+                container.content = b''.join(self._container_chunks)
+            self._reset_container()
+            self._handle_packet(container)
+
+    def _reset_container(self):
+        """
+        Forget about the container currently being received.
+        """
+        self._container = None
+        self._container_framing = None
+        self._container_chunks = []
+        self._container_count = 0
+        self._container_wire = 0
 
     def _write_raw(self, data):
         """
@@ -213,11 +964,15 @@ class ClientSocket(QObject):
 
         :param data: the raw bytes
         """
-        if not self._socket:
+        if not self._socket or not len(data):
             return
         self._outgoing.append(data)
-        if not self._write_notifier.isEnabled():
-            self._write_notifier.setEnabled(True)
+        if not isinstance(data, tuple):
+            self._outgoing_size += len(data)
+            if self.pending > self._stats['outgoing_peak']:
+                self._stats['outgoing_peak'] = self.pending
+        if not self._is_writing():
+            self._set_writing(True)
 
     def _read_line(self, line):
         """
@@ -225,29 +980,115 @@ class ClientSocket(QObject):
 
         :param line: the line
         """
-        # Try to parse the line as a packet
+        self._read_packet(line, ClientSocket.FRAMING_LINE)
+
+    def _read_packet(self, data, framing):
+        """
+        Reads an encoded packet from the underlying socket.
+
+        :param data: the encoded packet
+        :param framing: the framing mode it was received with
+        """
+        # Try to parse the data as a packet, whatever its codec
         try:
-            dct = json.loads(line.decode('utf-8'))
+            dct = Codec.detect(data, self._codecs).decode(data)
             packet = Packet.parse_packet(dct)
         except Exception as e:
-            self._logger.warning("Invalid packet received: %s" % line)
+            self._logger.warning("Invalid packet received: %s" % data)
             self._logger.exception(e)
             return
+        self._process_packet(packet, framing)
+
+    def _process_packet(self, packet, framing):
+        """
+        Processes a packet, waiting for its content if it is a container.
+
+        :param packet: the packet
+        :param framing: the framing mode it was received with
+        """
+        if isinstance(packet, Reply):
+            self._reply_started(packet)
 
         # Wait for raw data if it is a container
         if isinstance(packet, Container):
             self._container = packet
+            self._container_framing = framing
+            self.recv_container(packet)
+            if self._socket and self._container is packet \
+                    and not len(packet):
+                self._read_content(b'')
             return  # do not go any further
 
         self._handle_packet(packet)
 
-    def _write_line(self, line):
+    def _write_packet(self, data):
         """
-        Writes a line to the underlying socket.
+        Writes an encoded packet to the underlying socket.
 
-        :param line: the line
+        :param data: the encoded packet
+        """
+        if self._framing == ClientSocket.FRAMING_BINARY:
+            flags = 0
+            if self._compressor:
+                data = self._compress(data)
+                flags |= Framer.FLAG_COMPRESSED
+            self._write_raw(Framer.header(Framer.FRAME_PACKET, len(data),
+                                          flags))
+            self._write_raw(data)
+        else:
+            self._write_raw(data + b'\n')
+
+    def _compress(self, data):
+        """
+        Compresses some data using the outgoing stream. Flushing it makes
+        the output decompressable on its own, while keeping the history.
+
+        :param data: the raw bytes
+        :return: the compressed bytes
+        """
+        start = time.time()
+        output = self._compressor.compress(data)
+        output += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._deflate_started = True
+        self._stats['compress_time'] += time.time() - start
+        self._stats['compress_in'] += len(data)
+        self._stats['compress_out'] += len(output)
+        return output
+
+    def _decompress(self, data):
+        """
+        Decompresses some data using the incoming stream.
+
+        :param data: the compressed bytes
+        :return: the raw bytes
+        """
+        if not self._decompressor:
+            self._decompressor = zlib.decompressobj()
+        start = time.time()
+        output = self._decompressor.decompress(data)
+        self._stats['decompress_time'] += time.time() - start
+
+        # Keep the window, in case the connection is handed off
+        window = ClientSocket.COMPRESSION_WINDOW
+        if len(output) >= window:
+            self._inflate_history = bytearray(output[-window:])
+        else:
+            self._inflate_history += output
+            if len(self._inflate_history) > 2 * window:
+                del self._inflate_history[:-window]
+        self._stats['decompress_in'] += len(data)
+        self._stats['decompress_out'] += len(output)
+        return output
+
+    def _write_content(self, data):
+        """
+        Writes some raw data belonging to a container.
+
+        :param data: the raw bytes
         """
-        self._write_raw(line.encode('utf-8') + b'\n')
+        if self._framing == ClientSocket.FRAMING_BINARY:
+            self._write_raw(Framer.header(Framer.FRAME_DATA, len(data)))
+        self._write_raw(data)
 
     def _handle_packet(self, packet):
         """
@@ -259,49 +1100,261 @@ class ClientSocket(QObject):
 
         # Notify for replies
         if isinstance(packet, Reply):
-            packet.trigger_callback()
+            self._reply_finished(packet)
+
+        # Answer the pings, and measure the time taken by the pongs
+        elif isinstance(packet, Ping):
+            self.send_packet(Pong(packet.time))
+        elif isinstance(packet, Pong):
+            self._measure_rtt(time.time() - packet.time)
 
         # Otherwise forward to the subclass
         elif not self.recv_packet(packet):
             self._logger.warning("Unhandled packet received: %s" % packet)
 
-    def send_packet(self, packet):
+    def send_packet(self, packet, timeout=None):
         """
-        Sends a packet the other party.
+        Sends a packet the other party. Queries are only sent as long as
+        few enough are waiting for their reply, and queued otherwise.
 
         :param packet: the packet
+        :param timeout: the seconds a query can go without progress, None for
+            the default or 0 to wait forever
         :return: a packet deferred if a reply is expected
         """
         if not self._connected:
             self._logger.warning("Sending packet while disconnected")
             return None
 
-        # Try to build then sent the line
+        # Queries return a packet deferred
+        if isinstance(packet, Query):
+            d = PacketDeferred(self._cancel_request)
+            if timeout is None:
+                timeout = self.REQUEST_TIMEOUT
+            request = Request(packet, d, timeout)
+            if len(self._requests) >= self.REQUESTS_MAX:
+                self._waiting.append(request)
+                self._stats['queries_queued'] += 1
+            else:
+                self._send_request(request)
+            return d
+        self._send_packet(packet)
+        return None
+
+    def _send_packet(self, packet):
+        """
+        Writes a packet, followed by its content if it is a container.
+
+        :param packet: the packet
+        :return: was the packet built?
+        """
+        # Try to build then sent the packet
         try:
-            line = json.dumps(packet.build_packet())
-            self._write_line(line)
+            self._write_packet(self.encode_packet(packet))
         except Exception as e:
             self._logger.warning("Invalid packet being sent: %s" % packet)
             self._logger.exception(e)
+            return False
 
         self._logger.debug("Sending packet: %s" % packet)
 
-        # Write raw data for containers
-        if isinstance(packet, Container):
+        # Write raw data for containers, compressed if accepted
+        chunked = self._compressor is not None
+        if isinstance(packet, Container) and (packet.source is not None
+                                              or chunked):
+            self._write_raw((packet, self._framing, chunked))
+        elif isinstance(packet, Container):
             data = packet.content
             count, total = 0, len(data)
             for chunk in self._chunkify(data):
-                self._write_raw(chunk)
+                self._write_content(chunk)
                 count += len(chunk)
                 if packet.upback:  # trigger upload callback
-                    packet.upback(count, total)
+                    packet.upback(count, total, count)
+        return True
 
-        # Queries return a packet deferred
-        if isinstance(packet, Query):
-            d = PacketDeferred()
-            packet.register_callback(d)
-            return d
-        return None
+    def _send_request(self, request):
+        """
+        Sends a query, identified by the next id of the connection.
+
+        :param request: the request
+        """
+        request.query.id = next(self._request_ids)
+        request.sent = request.active = time.time()
+        self._requests[request.query.id] = request
+        self._stats['queries_sent'] += 1
+        if not self._send_packet(request.query):
+            del self._requests[request.query.id]
+            request.deferred.errback(ValueError("Invalid query"))
+            return
+        self._schedule_sweep()
+
+    def _send_waiting(self):
+        """
+        Sends the queued queries, as long as few enough are in flight.
+        """
+        while self._waiting and self._connected \
+                and len(self._requests) < self.REQUESTS_MAX:
+            self._send_request(self._waiting.popleft())
+
+    def _cancel_request(self, d):
+        """
+        Forgets about a query, whose reply will be ignored.
+
+        :param d: the deferred of the query
+        """
+        for id, request in self._requests.items():
+            if request.deferred is d:
+                del self._requests[id]
+                break
+        else:
+            for request in self._waiting:
+                if request.deferred is d:
+                    self._waiting.remove(request)
+                    break
+            else:
+                return
+        self._stats['queries_cancelled'] += 1
+        self._send_waiting()
+
+    def _request_progress(self, container, cls):
+        """
+        Postpones the timeout of a query, as the content of a container it
+        is made of, or replied with, is being transferred.
+
+        :param container: the container
+        :param cls: the class of the containers of the queries sent
+        """
+        if isinstance(container, cls):
+            request = self._requests.get(container.id)
+            if request:
+                request.active = time.time()
+
+    def _reply_started(self, reply):
+        """
+        Accounts for the reply to a query, before its content if any.
+
+        :param reply: the reply
+        """
+        request = self._requests.get(reply.id)
+        if not request:
+            return
+        request.active = time.time()
+        bucket = 1
+        while bucket < (request.active - request.sent) * 1000:
+            bucket <<= 1
+        self._latencies[request.command][bucket] += 1
+        if not isinstance(reply, Error):
+            request.deferred.initback(reply)
+
+    def _reply_finished(self, reply):
+        """
+        Triggers the callback of the query, once its reply is complete.
+
+        :param reply: the reply
+        """
+        request = self._requests.pop(reply.id, None)
+        if not request:
+            self._logger.debug("Ignoring reply to a forgotten query")
+            return
+        if isinstance(reply, Error):
+            self._stats['queries_failed'] += 1
+            request.deferred.errback(ValueError(reply.message))
+        else:
+            request.deferred.callback(reply)
+        self._send_waiting()
+
+    def _schedule_sweep(self):
+        """
+        Schedules the next check of the timeouts, unless already scheduled.
+        """
+        if not self._sweeping:
+            self._sweeping = True
+            self._call_later(self.REQUEST_SWEEP, self._sweep_requests)
+
+    def _sweep_requests(self):
+        """
+        Fails the queries that went without progress for too long.
+        """
+        self._sweeping = False
+        now = time.time()
+        for id, request in list(self._requests.items()):
+            if request.timeout and now - request.active > request.timeout:
+                del self._requests[id]
+                self._stats['queries_timed_out'] += 1
+                self._logger.warning("Query %s timed out" % request.command)
+                request.deferred.errback(socket.timeout(
+                    "No reply to %s after %gs" % (request.command,
+                                                  request.timeout)))
+        self._send_waiting()
+        if self._requests:
+            self._schedule_sweep()
+
+    def _schedule_heartbeat(self):
+        """
+        Schedules the next ping, unless already scheduled.
+        """
+        if not self._beating:
+            self._beating = True
+            self._call_later(self.HEARTBEAT_INTERVAL, self._beat)
+
+    def _beat(self):
+        """
+        Pings the other party, after checking that it is still alive. It is
+        dead if nothing was received from it for too long, despite the pings.
+        """
+        self._beating = False
+        if not self._connected or not self._heartbeat:
+            return
+
+        # Nothing can be received while the reading is paused
+        if self._read_paused:
+            self._last_read = time.time()
+        elif time.time() - self._last_read > self.HEARTBEAT_TIMEOUT:
+            self._stats['heartbeat_timeouts'] += 1
+            self.disconnect(IOError("Nothing received for %gs"
+                                    % self.HEARTBEAT_TIMEOUT))
+            return
+        self.send_packet(Ping(time.time()))
+        self._schedule_heartbeat()
+
+    def _measure_rtt(self, sample):
+        """
+        Updates the smoothed round-trip time and its variation with a new
+        measurement, the same way as TCP does (RFC 6298).
+
+        :param sample: the round-trip time measured
+        """
+        if self._rtt is None:
+            self._rtt = sample
+            self._rttvar = sample / 2
+        else:
+            self._rttvar += ClientSocket.RTT_BETA \
+                * (abs(self._rtt - sample) - self._rttvar)
+            self._rtt += ClientSocket.RTT_ALPHA * (sample - self._rtt)
+        self.rtt_updated()
+
+    def _fail_requests(self, error):
+        """
+        Fails all the queries still waiting for their reply.
+
+        :param error: the exception
+        """
+        requests = list(self._requests.values()) + list(self._waiting)
+        self._requests.clear()
+        self._waiting.clear()
+        for request in requests:
+            self._stats['queries_lost'] += 1
+            request.deferred.errback(error)
+
+    def encode_packet(self, packet):
+        """
+        Encodes a packet using the negotiated codec.
+
+        :param packet: the packet
+        :return: the encoded packet
+        """
+        return self._codec.encode(packet.build_packet())
 
     def recv_packet(self, packet):
         """
@@ -312,10 +1365,33 @@ class ClientSocket(QObject):
         """
         raise NotImplementedError("recv_packet() not implemented")
 
+    def recv_container(self, container):
+        """
+        Receives the header of a container, before its content. Subclasses
+        can set the sink of the container to stream its content to a file.
+
+        :param container: the container
+        """
+        pass
+
+    def outgoing_written(self):
+        """
+        Called after some of the outgoing data has been written to the socket.
+        Subclasses can check the number of bytes still pending.
+        """
+        pass
+
+    def rtt_updated(self):
+        """
+        Called after the round-trip time has been measured again.
+        """
+        pass
+
 
-class ServerSocket(QObject):
+class ServerSocket(object):
     """
-    A class wrapping a server socket and integrated into the Qt event loop.
+    A class wrapping a server socket. Like the client socket, subclasses
+    integrate it into an event loop.
     """
 
     def __init__(self, logger, parent=None):
@@ -325,11 +1401,18 @@ class ServerSocket(QObject):
         :param logger: the logger to use
         :param parent: the parent object
         """
-        QObject.__init__(self, parent)
+        self._parent = parent
         self._logger = logger
         self._socket = None
         self._connected = False
-        self._accept_notifier = None
+
+    def parent(self):
+        """
+        Get the parent object.
+
+        :return: the parent
+        """
+        return self._parent
 
     @property
     def connected(self):
@@ -347,10 +1430,7 @@ class ServerSocket(QObject):
         :param sock: the socket
         """
         sock.settimeout(0)
-        self._accept_notifier = QSocketNotifier(sock.fileno(),
-                                                QSocketNotifier.Read, self)
-        self._accept_notifier.activated.connect(self._notify_accept)
-        self._accept_notifier.setEnabled(True)
+        self._watch(sock)
 
         self._socket = sock
         self._connected = True
@@ -366,7 +1446,7 @@ class ServerSocket(QObject):
         if err:
             self._logger.warning("Connection lost")
             self._logger.exception(err)
-        self._accept_notifier.setEnabled(False)
+        self._unwatch()
         try:
             self._socket.close()
         except socket.error:
@@ -396,3 +1476,17 @@ class ServerSocket(QObject):
         :param socket: the socket
         """
         raise NotImplementedError('accept() is not implemented')
+
+    def _watch(self, sock):
+        """
+        Start calling _notify_accept when a client is connecting.
+
+        :param sock: the socket
+        """
+        raise NotImplementedError("_watch() not implemented")
+
+    def _unwatch(self):
+        """
+        Stop watching the socket, before it is closed.
+        """
+        raise NotImplementedError("_unwatch() not implemented")
@@ -0,0 +1,676 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import collections
+import errno
+import hashlib
+import multiprocessing
+import os
+import re
+import struct
+import tempfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from .framing import Framer
+
+# Size of the chunks the content of a container is compressed by
+CHUNK_SIZE = 1 << 20
+CHUNK_LEVEL = 6
+# A compressed chunk starts with its uncompressed size
+CHUNK_HEADER = struct.Struct('!I')
+
+# A packed file starts with a magic, the size and the digest of its
+# uncompressed content, followed by the compressed chunks as they are sent
+# over the network
+PACKED_MAGIC = b'IDACPACK'
+PACKED_HEADER = struct.Struct('!8sQ40s')
+
+_POOL = None
+
+
+def compress_chunk(data):
+    """
+    Compress a chunk of data independently of the other chunks.
+
+    :param data: the raw bytes
+    :return: the compressed chunk
+    """
+    return CHUNK_HEADER.pack(len(data)) + zlib.compress(data, CHUNK_LEVEL)
+
+
+def decompress_chunk(chunk):
+    """
+    Decompress a chunk of data.
+
+    :param chunk: the compressed chunk
+    :return: the raw bytes
+    """
+    data = zlib.decompress(chunk[CHUNK_HEADER.size:])
+    if len(data) != chunk_size(chunk):
+        raise zlib.error("Chunk has an invalid size")
+    return data
+
+
+def chunk_size(chunk):
+    """
+    Get the uncompressed size of a chunk, without decompressing it.
+
+    :param chunk: the compressed chunk
+    :return: the size
+    """
+    return CHUNK_HEADER.unpack_from(chunk)[0]
+
+
+def get_pool():
+    """
+    Get the pool of threads used to process the chunks. As zlib releases the
+    GIL, the chunks are effectively processed on all the cores.
+
+    :return: the pool
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPool(multiprocessing.cpu_count())
+    return _POOL
+
+
+def open_source(path, offset=0):
+    """
+    Open a file as a source, whether it is packed or not.
+
+    :param path: the path
+    :param offset: the offset of the content to send
+    :return: the source
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(PACKED_MAGIC))
+    if magic == PACKED_MAGIC:
+        return PackedFileSource(path, offset)
+    return FileSource(path, offset)
+
+
+def file_digest(path):
+    """
+    Compute the digest identifying the content of a file.
+
+    :param path: the path
+    :return: the hexadecimal digest
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def partial_path(path, digest):
+    """
+    Get the path of the partial file of a transfer that can be resumed.
+
+    :param path: the destination path
+    :param digest: the digest of the complete content
+    :return: the path
+    """
+    return '%s.%s.part' % (path, digest)
+
+
+def find_partial(path):
+    """
+    Find the most recent partial file left by an interrupted transfer.
+
+    :param path: the destination path
+    :return: the digest of the complete content, or None if there is none
+    """
+    partials = _partials(path)
+    return max(partials)[1] if partials else None
+
+
+def discard_partials(path, keep=None):
+    """
+    Remove the partial files left by interrupted transfers.
+
+    :param path: the destination path
+    :param keep: the digest of the partial file to keep, if any
+    """
+    for _, partial in _partials(path):
+        if partial != keep:
+            os.remove(partial_path(path, partial))
+
+
+def _partials(path):
+    """
+    List the partial files left by interrupted transfers.
+
+    :param path: the destination path
+    :return: the modification time and digest of each partial file
+    """
+    dirName, fileName = os.path.split(path)
+    pattern = re.compile(re.escape(fileName) + r'\.([0-9a-f]{40})\.part$')
+    partials = []
+    for name in os.listdir(dirName or '.'):
+        match = pattern.match(name)
+        if match:
+            mtime = os.path.getmtime(os.path.join(dirName, name))
+            partials.append((mtime, match.group(1)))
+    return partials
+
+
+def partial_offset(path, digest):
+    """
+    Get the offset a transfer can be resumed from, using its partial file.
+    Raw files are resumed on a chunk boundary, packed ones after their last
+    complete chunk, so that the offset is always aligned on a chunk.
+
+    :param path: the destination path
+    :param digest: the digest of the complete content
+    :return: the offset
+    """
+    partPath = partial_path(path, digest)
+    if not os.path.exists(partPath):
+        return 0
+    size = os.path.getsize(partPath)
+    with open(partPath, 'rb') as f:
+        if f.read(len(PACKED_MAGIC)) == PACKED_MAGIC:
+            return sum(raw for _, _, raw in _packed_chunks(f, size))
+    return size - size % CHUNK_SIZE
+
+
+def _packed_chunks(f, end):
+    """
+    Iterate over the complete chunks of a packed file.
+
+    :param f: the file object
+    :param end: the size of the file
+    :return: generator of the start, end and uncompressed size of each chunk
+    """
+    position = PACKED_HEADER.size
+    headerSize = Framer.HEADER.size + CHUNK_HEADER.size
+    while position + headerSize <= end:
+        f.seek(position)
+        header = f.read(headerSize)
+        _, _, size = Framer.HEADER.unpack_from(header)
+        raw, = CHUNK_HEADER.unpack_from(header, Framer.HEADER.size)
+        next = position + Framer.HEADER.size + size
+        if next > end:
+            break  # the chunk is incomplete
+        yield position, next, raw
+        position = next
+
+
+def _packed_position(f, end, offset):
+    """
+    Get the position in a packed file of an offset of its content.
+
+    :param f: the file object
+    :param end: the size of the file
+    :param offset: the offset, which must be on a chunk boundary
+    :return: the position
+    """
+    count, position = 0, PACKED_HEADER.size
+    for _, next, raw in _packed_chunks(f, end):
+        if count == offset:
+            break
+        count, position = count + raw, next
+    if count != offset:
+        raise ValueError("Offset %d is not on a chunk boundary" % offset)
+    return position
+
+
+def replace_file(src, dst):
+    """
+    Atomically replace a file by another one, on every platform.
+
+    :param src: the path of the new file
+    :param dst: the path of the file to replace
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class FileSink(object):
+    """
+    A file-like destination for the content of a container. The content is
+    written into a temporary file next to the destination, which is renamed
+    once the whole content has been received.
+
+    Compressed chunks are decompressed before being written, unless the sink
+    is packed, in which case they are stored as is.
+
+    When the digest of the complete content is known, the temporary file is
+    kept if the transfer is interrupted, so that it can be resumed later.
+    """
+
+    def __init__(self, path, packed=False, digest=None, offset=0):
+        """
+        Initialize the file sink.
+
+        :param path: the destination path
+        :param packed: keep the compressed chunks compressed
+        :param digest: the digest of the complete content
+        :param offset: the offset to resume the transfer from
+        """
+        super(FileSink, self).__init__()
+        self._path = path
+        self._packed = packed
+        self._digest = digest
+        self._chunked = False
+        self._size = 0
+        if not digest:
+            dirName, fileName = os.path.split(path)
+            fd, self._tmpPath = tempfile.mkstemp(prefix=fileName + '.',
+                                                 suffix='.part', dir=dirName)
+            self._file = os.fdopen(fd, 'wb')
+            return
+
+        # Only keep the partial file of the current content
+        discard_partials(path, digest)
+
+        self._tmpPath = partial_path(path, digest)
+        self._file = open(self._tmpPath, 'r+b' if offset else 'wb')
+        if offset:
+            self._truncate(offset)
+
+    @property
+    def path(self):
+        """
+        Get the destination path.
+
+        :return: the path
+        """
+        return self._path
+
+    def write(self, data):
+        """
+        Write some data to the temporary file.
+
+        :param data: the raw bytes
+        """
+        if self._chunked:
+            raise ValueError("Cannot mix raw data and compressed chunks")
+        self._file.write(data)
+        self._size += len(data)
+
+    def write_chunk(self, chunk):
+        """
+        Write a compressed chunk to the temporary file.
+
+        :param chunk: the compressed chunk
+        :return: the uncompressed size of the chunk
+        """
+        if not self._packed:
+            data = decompress_chunk(chunk)
+            self.write(data)
+            return len(data)
+
+        if not self._chunked:
+            if self._size:
+                raise ValueError("Cannot mix raw data and compressed chunks")
+            self._file.write(PACKED_HEADER.pack(PACKED_MAGIC, 0, b''))
+            self._chunked = True
+        self._file.write(Framer.header(Framer.FRAME_DATA, len(chunk),
+                                       Framer.FLAG_CHUNK))
+        self._file.write(chunk)
+        self._size += chunk_size(chunk)
+        return chunk_size(chunk)
+
+    def commit(self):
+        """
+        Move the temporary file to the destination path.
+        """
+        if self._chunked:  # the content size is now known
+            digest = (self._digest or '').encode('ascii')
+            self._file.seek(0)
+            self._file.write(PACKED_HEADER.pack(PACKED_MAGIC, self._size,
+                                                digest))
+        self._file.close()
+        replace_file(self._tmpPath, self._path)
+
+    def abort(self):
+        """
+        Discard the temporary file, unless the transfer can be resumed.
+        """
+        self._file.close()
+        if not self._digest and os.path.exists(self._tmpPath):
+            os.remove(self._tmpPath)
+
+    def _truncate(self, offset):
+        """
+        Drop the content of the temporary file after the specified offset.
+
+        :param offset: the offset
+        """
+        end = os.fstat(self._file.fileno()).st_size
+        if self._file.read(len(PACKED_MAGIC)) == PACKED_MAGIC:
+            position = _packed_position(self._file, end, offset)
+            self._chunked = True
+        elif offset <= end:
+            position = offset
+        else:
+            raise ValueError("Offset %d is past the partial file" % offset)
+        self._file.seek(position)
+        self._file.truncate()
+        self._size = offset
+
+
+class FileSource(object):
+    """
+    A file-like origin for the content of a container. The content is sent
+    straight from the file descriptor using sendfile when it is available,
+    and read in small chunks otherwise.
+    """
+    READ_SIZE = 65536
+
+    packed = False
+    digest = None
+
+    def __init__(self, path, offset=0):
+        """
+        Initialize the file source.
+
+        :param path: the origin path
+        :param offset: the offset of the content to send
+        """
+        super(FileSource, self).__init__()
+        self._path = path
+        self._file = open(path, 'rb')
+        self._offset = offset
+        self._size = os.fstat(self._file.fileno()).st_size - offset
+        self._sendfile = hasattr(os, 'sendfile')
+
+    def __len__(self):
+        """
+        Return the size of the content to send.
+
+        :return: the size
+        """
+        return self._size
+
+    @property
+    def wire_size(self):
+        """
+        Get the number of bytes that will be sent.
+
+        :return: the size
+        """
+        return self._size
+
+    @property
+    def path(self):
+        """
+        Get the origin path.
+
+        :return: the path
+        """
+        return self._path
+
+    def send(self, sock, offset, count):
+        """
+        Send a range of the file over a socket.
+
+        :param sock: the socket
+        :param offset: the offset of the range
+        :param count: the size of the range
+        :return: the number of bytes sent
+        """
+        offset += self._offset
+        if self._sendfile:
+            try:
+                return os.sendfile(sock.fileno(), self._file.fileno(),
+                                   offset, count)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS,
+                                   errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+                self._sendfile = False  # not supported, read the file
+
+        self._file.seek(offset)
+        return sock.send(self._file.read(min(count, self.READ_SIZE)))
+
+    def blocks(self):
+        """
+        Read the file block by block, for it to be compressed.
+
+        :return: generator of blocks
+        """
+        for offset in range(0, self._size, CHUNK_SIZE):
+            self._file.seek(self._offset + offset)
+            yield self._file.read(CHUNK_SIZE)
+
+    def close(self):
+        """
+        Close the underlying file.
+        """
+        self._file.close()
+
+
+class PackedFileSource(FileSource):
+    """
+    A file-like origin for the content of a container, read from a packed
+    file. The compressed chunks it contains are already framed, so they can be
+    sent as is to the parties that accept them.
+    """
+    packed = True
+
+    def __init__(self, path, offset=0):
+        super(PackedFileSource, self).__init__(path)
+        _, rawSize, digest = PACKED_HEADER.unpack(
+            self._file.read(PACKED_HEADER.size))
+        self._rawSize = rawSize - offset
+        self.digest = digest.rstrip(b'\0').decode('ascii') or None
+
+        # Skip the chunks before the offset
+        end = self._size
+        self._offset = _packed_position(self._file, end, offset)
+        self._size = end - self._offset
+
+    def __len__(self):
+        return self._rawSize
+
+    def chunks(self):
+        """
+        Read the compressed chunks of the file, one by one.
+
+        :return: generator of compressed chunks
+        """
+        end = self._offset + self._size
+        for start, next, _ in _packed_chunks(self._file, end):
+            if start >= self._offset:
+                self._file.seek(start + Framer.HEADER.size)
+                yield self._file.read(next - start - Framer.HEADER.size)
+
+
+class ChunkPipeline(object):
+    """
+    Transform a sequence of chunks on the pool of threads, a few chunks ahead
+    of the consumer, while preserving their order. The notify function is
+    called from the pool every time a chunk is ready.
+    """
+
+    class Slot(object):
+        """
+        The result of the transformation of a chunk.
+        """
+
+        def __init__(self):
+            self.done = False
+            self.result = None
+            self.error = None
+
+    def __init__(self, chunks, transform, notify):
+        """
+        Initialize the pipeline.
+
+        :param chunks: an iterable of chunks
+        :param transform: the transformation function
+        :param notify: the notification function
+        """
+        super(ChunkPipeline, self).__init__()
+        self._chunks = iter(chunks)
+        self._transform = transform
+        self._notify = notify
+        self._window = 2 * multiprocessing.cpu_count()
+        self._pending = collections.deque()
+        self._exhausted = False
+        self._fill()
+
+    @property
+    def finished(self):
+        """
+        Returns if all the chunks have been consumed.
+
+        :return: is finished?
+        """
+        return self._exhausted and not self._pending
+
+    def ready(self):
+        """
+        Returns if the next chunk has been transformed.
+
+        :return: is ready?
+        """
+        return bool(self._pending) and self._pending[0].done
+
+    def pop(self):
+        """
+        Get the next transformed chunk.
+
+        :return: the result
+        """
+        slot = self._pending.popleft()
+        self._fill()
+        if slot.error:
+            raise slot.error
+        return slot.result
+
+    def close(self):
+        """
+        Stop submitting new chunks to the pool.
+        """
+        self._exhausted = True
+        self._pending.clear()
+
+    def _fill(self):
+        """
+        Submit chunks to the pool until the window is full.
+        """
+        while not self._exhausted and len(self._pending) < self._window:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._exhausted = True
+                break
+            slot = ChunkPipeline.Slot()
+            self._pending.append(slot)
+            get_pool().apply_async(self._run, (slot, chunk))
+
+    def _run(self, slot, chunk):
+        """
+        Transform a chunk, from one of the threads of the pool.
+
+        :param slot: the slot of the result
+        :param chunk: the chunk
+        """
+        try:
+            slot.result = self._transform(chunk)
+        except Exception as e:
+            slot.error = e
+        slot.done = True
+        self._notify()
+
+
+class SpillQueue(object):
+    """
+    A first-in first-out queue of messages backed by a temporary file, used
+    to hold a backlog that shouldn't be kept in memory. Every message is
+    prefixed by its size, and the file is truncated once emptied.
+    """
+    HEADER = struct.Struct('!I')
+
+    def __init__(self, dir=None):
+        """
+        Initialize the spill queue.
+
+        :param dir: the directory of the temporary file
+        """
+        super(SpillQueue, self).__init__()
+        self._dir = dir
+        self._file = None
+        self._read = 0
+        self._write = 0
+        self._count = 0
+
+    def __len__(self):
+        """
+        Return the number of messages in the queue.
+
+        :return: the count
+        """
+        return self._count
+
+    @property
+    def size(self):
+        """
+        Get the number of bytes held on disk.
+
+        :return: the size
+        """
+        return self._write - self._read
+
+    def push(self, data):
+        """
+        Append a message at the end of the queue.
+
+        :param data: the message
+        """
+        if self._file is None:
+            if self._dir and not os.path.isdir(self._dir):
+                os.makedirs(self._dir)
+            self._file = tempfile.TemporaryFile(dir=self._dir)
+        self._file.seek(self._write)
+        self._file.write(SpillQueue.HEADER.pack(len(data)))
+        self._file.write(data)
+        self._write += SpillQueue.HEADER.size + len(data)
+        self._count += 1
+
+    def pop(self):
+        """
+        Remove the message at the front of the queue.
+
+        :return: the message, or None if the queue is empty
+        """
+        if not self._count:
+            return None
+        self._file.seek(self._read)
+        size, = SpillQueue.HEADER.unpack(
+            self._file.read(SpillQueue.HEADER.size))
+        data = self._file.read(size)
+        self._read += SpillQueue.HEADER.size + size
+        self._count -= 1
+        if not self._count:
+            self._file.seek(0)
+            self._file.truncate()
+            self._read = self._write = 0
+        return data
+
+    def close(self):
+        """
+        Discard the messages and delete the temporary file.
+        """
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._read = self._write = self._count = 0
@@ -12,23 +12,25 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import argparse
 import logging
+import multiprocessing
 import os
 import signal
+import socket
 import sys
 
-from PyQt5.QtCore import QCoreApplication
-
-from idaconnect.shared.server import Server
+from idaconnect.shared.packets import CODECS
+from idaconnect.shared.server import Server, ServerClient
+from idaconnect.shared.shards import ShardChannel
 
 
 class DedicatedServer(Server):
     """
-    The dedicated server implementation.
+    The dedicated server implementation, independent of the event loop.
     """
 
-    def __init__(self, parent=None):
+    def __init__(self, shard=None, shards=1, parent=None):
         logger = self.start_logging()
-        Server.__init__(self, logger, parent)
+        Server.__init__(self, logger, parent, shard, shards)
 
     def local_file(self, filename):
         filesDir = os.path.join(os.path.dirname(__file__), 'files')
@@ -65,6 +67,140 @@ class DedicatedServer(Server):
         return logger
 
 
+def run_qt(args, shard=None, channels=None):
+    """
+    Run the server in the Qt event loop.
+    """
+    from PyQt5.QtCore import QCoreApplication, QObject
+    from idaconnect.shared.qtsockets import QtServerSocket, QtSocket
+
+    class QtServerClient(QtSocket, ServerClient, QObject):
+        def __init__(self, logger, parent=None):
+            QObject.__init__(self, parent)
+            ServerClient.__init__(self, logger, parent)
+
+    class QtShardChannel(QtServerSocket, ShardChannel, QObject):
+        def __init__(self, logger, parent=None):
+            QObject.__init__(self, parent)
+            ShardChannel.__init__(self, logger, parent)
+
+    class QtDedicatedServer(QtServerSocket, DedicatedServer, QObject):
+        def __init__(self, shard=None, shards=1, parent=None):
+            QObject.__init__(self, parent)
+            DedicatedServer.__init__(self, shard, shards, parent)
+
+        def create_client(self):
+            return QtServerClient(self._logger, self)
+
+        def create_channel(self):
+            return QtShardChannel(self._logger, self)
+
+    app = QCoreApplication(sys.argv)
+    server = QtDedicatedServer(shard, args.workers or 1)
+    if not start(server, args, channels):
+        return 1
+    return app.exec_()
+
+
+def run_asyncio(args, shard=None, channels=None):
+    """
+    Run the server in an asyncio event loop, without PyQt5.
+    """
+    import asyncio
+    from idaconnect.shared.aiosockets import AsyncioServerSocket, \
+        AsyncioSocket
+
+    class AsyncioServerClient(AsyncioSocket, ServerClient):
+        pass
+
+    class AsyncioShardChannel(AsyncioServerSocket, ShardChannel):
+        pass
+
+    class AsyncioDedicatedServer(AsyncioServerSocket, DedicatedServer):
+        def create_client(self):
+            return AsyncioServerClient(self._logger, self)
+
+        def create_channel(self):
+            return AsyncioShardChannel(self._logger, self)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = AsyncioDedicatedServer(shard, args.workers or 1)
+    if not start(server, args, channels):
+        return 1
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+    return 0
+
+
+def run(args, shard=None, channels=None):
+    """
+    Run the server in the event loop selected.
+
+    :param args: the command line arguments
+    :param shard: the shard stored by this process, if a worker
+    :param channels: the sockets to the other processes, by shard
+    :return: the exit code
+    """
+    if args.loop == 'asyncio':
+        return run_asyncio(args, shard, channels)
+    return run_qt(args, shard, channels)
+
+
+def run_worker(args, shard, channel):
+    """
+    The entry point of a worker process, storing a shard.
+
+    :param args: the command line arguments
+    :param shard: the shard index
+    :param channel: the socket to the supervisor
+    """
+    sys.exit(run(args, shard, {None: channel}))
+
+
+def run_supervisor(args):
+    """
+    Start a worker process per shard, then accept the connections in this
+    process and hand them off to the workers.
+
+    :param args: the command line arguments
+    :return: the exit code
+    """
+    channels = {}
+    for shard in range(args.workers):
+        channel, workerChannel = socket.socketpair()
+        worker = multiprocessing.Process(target=run_worker,
+                                         args=(args, shard, workerChannel),
+                                         name='shard-%d' % shard)
+        worker.daemon = True
+        worker.start()
+        workerChannel.close()
+        channels[shard] = channel
+    return run(args, None, channels)
+
+
+def start(server, args, channels=None):
+    """
+    Configure then start the server. The workers don't listen, they are
+    handed off connections by the supervisor.
+
+    :param server: the server
+    :param args: the command line arguments
+    :param channels: the sockets to the other processes, by shard
+    :return: did the operation succeed?
+    """
+    server.set_queue_policy(args.queue_policy, args.queue_high << 20,
+                            args.queue_low << 20)
+    server.set_codec(args.codec)
+    for shard, channel in (channels or {}).items():
+        server.connect_channel(shard, channel)
+    if None in (channels or {}):
+        return True
+    return server.start(args.host, args.port)
+
+
 def main(args):
     """
     The entry point of a Python program.
@@ -72,14 +208,28 @@ def main(args):
     # Allow the use of Ctrl-C to stop the server
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    app = QCoreApplication(sys.argv)
-    server = DedicatedServer()
-    server.start(args.host, args.port)
-    return app.exec_()
+    if args.workers:
+        return run_supervisor(args)
+    return run(args)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--host', type=str, default='127.0.0.1')
     parser.add_argument('--port', type=int, default=31013)
-    main(parser.parse_args())
+    parser.add_argument('--loop', type=str, choices=('qt', 'asyncio'),
+                        default='qt')
+    parser.add_argument('--queue-policy', type=str, choices=Server.POLICIES,
+                        default=Server.POLICY_SPILL)
+    parser.add_argument('--queue-high', type=int,
+                        default=Server.QUEUE_HIGH >> 20, metavar='MIB')
+    parser.add_argument('--queue-low', type=int,
+                        default=Server.QUEUE_LOW >> 20, metavar='MIB')
+    parser.add_argument('--codec', type=str, choices=sorted(CODECS),
+                        default=ServerClient.CODEC_JSON,
+                        help='codec preferred for the clients supporting '
+                             'it (binary is smaller, json is faster)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes, each storing a '
+                             'shard of the repositories (keep it constant)')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,229 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+# The tests only cover the modules that depend on neither IDA nor PyQt5
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from idaconnect.shared import sockets  # noqa: E402
+from idaconnect.shared.aiosockets import (AsyncioServerSocket,  # noqa: E402
+                                          AsyncioSocket)
+from idaconnect.shared.commands import Subscribe  # noqa: E402
+from idaconnect.shared.packets import Batch, GenericEvent  # noqa: E402
+from idaconnect.shared.server import Server, ServerClient  # noqa: E402
+from idaconnect.shared.shards import ShardChannel  # noqa: E402
+from idaconnect.shared.sockets import ClientSocket  # noqa: E402
+
+HASH = '0' * 32
+UUID = '12345678-1234-1234-1234-123456789abc'
+
+
+class Clock(object):
+    """
+    A clock only moving forward when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeSocket(ClientSocket):
+    """
+    A client socket writing nowhere, whose timers only run when told to.
+    """
+
+    def __init__(self):
+        ClientSocket.__init__(self, logging.getLogger('test'))
+        self._connected = True
+        self.written = []
+        self.timers = []
+        self.updates = 0
+
+    def _write_packet(self, data):
+        self.written.append(data)
+
+    def _call_later(self, delay, callback):
+        self.timers.append(callback)
+
+    def rtt_updated(self):
+        self.updates += 1
+
+    def run_timers(self):
+        timers, self.timers = self.timers, []
+        for callback in timers:
+            callback()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sockets, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def sock():
+    return FakeSocket()
+
+
+class LoopServerClient(AsyncioSocket, ServerClient):
+    pass
+
+
+class LoopShardChannel(AsyncioServerSocket, ShardChannel):
+    pass
+
+
+class LoopServer(AsyncioServerSocket, Server):
+    """
+    A server running in the asyncio event loop, storing its files in a
+    temporary directory.
+    """
+
+    def __init__(self, tmpdir, shard=None, shards=1):
+        self._tmpdir = tmpdir
+        Server.__init__(self, logging.getLogger('test'), None, shard, shards)
+
+    def local_file(self, filename):
+        return str(self._tmpdir.join(filename))
+
+    def create_client(self):
+        return LoopServerClient(self._logger, self)
+
+    def create_channel(self):
+        return LoopShardChannel(self._logger, self)
+
+    @property
+    def clients(self):
+        return [client for client in self._connections if client.connected]
+
+
+class Peer(AsyncioSocket, ClientSocket):
+    """
+    A client running in the asyncio event loop, keeping the packets it
+    received, which supports the features given.
+    """
+
+    def __init__(self, **features):
+        ClientSocket.__init__(self, logging.getLogger('test'))
+        self.FEATURES = dict(ClientSocket.FEATURES, **features)
+        self.received = []
+
+    def recv_packet(self, packet):
+        self.received.append(packet)
+        return True
+
+    @property
+    def events(self):
+        events = []
+        for packet in self.received:
+            if isinstance(packet, Batch):
+                events.extend(packet.events)
+            elif isinstance(packet, GenericEvent):
+                events.append(packet)
+        return events
+
+    @property
+    def ticks(self):
+        return [event.tick for event in self.events]
+
+
+def event(tick, **fields):
+    """
+    Create an event of the test type.
+
+    :param tick: the tick
+    :param fields: the other fields
+    :return: the event
+    """
+    return GenericEvent.new(dict(fields, type='event',
+                                 event_type='test_event', tick=tick))
+
+
+def run_until(loop, condition, timeout=5):
+    """
+    Run the event loop until a condition is true.
+
+    :param loop: the event loop
+    :param condition: the function checking the condition
+    :param timeout: the time after which the test fails (seconds)
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out"
+        loop.run_until_complete(asyncio.sleep(0.001))
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.fixture
+def server(loop, tmpdir):
+    server = LoopServer(tmpdir)
+    assert server.start('127.0.0.1', 0)
+    yield server
+    for client in server.clients:
+        client.disconnect()
+    server.disconnect()
+
+
+@pytest.fixture
+def connect(loop, server):
+    """
+    Get a function connecting a peer to the server, which returns once the
+    handshake is done, with the server side of the connection.
+    """
+    peers = []
+
+    def connect(**features):
+        clients = set(server.clients)
+        peer = Peer(**features)
+        sock = socket.create_connection(server._socket.getsockname())
+        sock.setblocking(False)
+        peer.connect(sock)
+        peers.append(peer)
+        peer.handshake()
+        run_until(loop, lambda: peer.features)
+        client, = set(server.clients) - clients
+        return peer, client
+    yield connect
+    for peer in peers:
+        peer.disconnect()
+
+
+@pytest.fixture
+def subscribe(loop, server):
+    """
+    Get a function subscribing a peer to a branch, which returns once the
+    server side of its connection is registered.
+    """
+    def subscribe(peer, client, uuid=UUID, tick=0):
+        peer.send_packet(Subscribe(HASH, uuid, tick))
+        run_until(loop, lambda: client in server.find_subscribers(HASH, uuid))
+    return subscribe
@@ -0,0 +1,46 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import random
+
+import pytest
+
+from idaconnect.network.backoff import backoff_delay
+
+
+@pytest.fixture(params=['lowest', 'highest'])
+def jitter(request, monkeypatch):
+    def uniform(a, b):
+        return a if request.param == 'lowest' else b
+    monkeypatch.setattr(random, 'uniform', uniform)
+    return request.param
+
+
+def test_delay_doubles_up_to_the_maximum(jitter):
+    delays = [backoff_delay(attempts, 1, 60) for attempts in range(9)]
+    full = [1, 2, 4, 8, 16, 32, 60, 60, 60]
+    if jitter == 'lowest':
+        assert delays == [delay / 2.0 for delay in full]
+    else:
+        assert delays == full
+
+
+def test_delay_after_many_attempts(jitter):
+    assert backoff_delay(10 ** 6, 1, 60) == (30 if jitter == 'lowest'
+                                             else 60)
+
+
+def test_delay_is_jittered():
+    random.seed(0)
+    delays = [backoff_delay(3, 1, 60) for _ in range(100)]
+    assert all(4 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) == 100
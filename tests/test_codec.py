@@ -0,0 +1,122 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import json
+
+import pytest
+
+from idaconnect.shared.packets import (CODECS, BinaryCodec, Codec,
+                                       JsonCodec)
+
+PACKET = {
+    'type': 'event',
+    'event_type': 'renamed',
+    'tick': 1234567,
+    'ea': 0x401000,
+    'new_name': u'sub_401000_\xe9',
+    'local_name': False,
+    'flags': None,
+    'delta': -129,
+    'ratio': 0.25,
+    'items': [1, [2, 3], {'nested': True}],
+}
+
+
+@pytest.mark.parametrize('value', [
+    0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 2 ** 64, -1, -0x80, -2 ** 64,
+    u'', u'short', u'x' * 1000, 1.5, None, True, False, [], {},
+])
+def test_binary_round_trip_of_each_value(value):
+    codec = BinaryCodec()
+    assert codec.decode(codec.encode({'value': value})) == {'value': value}
+
+
+def test_binary_round_trip_of_a_packet():
+    codec = BinaryCodec()
+    assert codec.decode(codec.encode(PACKET)) == PACKET
+
+
+def test_binary_is_smaller_than_json():
+    assert len(BinaryCodec().encode(PACKET)) \
+        < len(JsonCodec().encode(PACKET))
+
+
+def test_common_names_are_never_sent():
+    data = BinaryCodec().encode({'ea': 1, 'tick': 2, 'event_type': 'x'})
+    for name in (b'ea', b'tick', b'event_type'):
+        assert name not in data
+
+
+def test_repeated_strings_are_sent_once():
+    codec = BinaryCodec()
+    data = codec.encode({'a': [u'repeated'] * 10})
+    assert data.count(b'repeated') == 1
+    assert codec.decode(data) == {'a': [u'repeated'] * 10}
+
+    # Long strings are not interned
+    data = codec.encode({'a': [u'y' * 100] * 2})
+    assert data.count(b'y' * 100) == 2
+
+
+def test_strings_are_interned_per_packet():
+    codec = BinaryCodec()
+    first = codec.encode({'name': u'repeated'})
+    assert codec.encode({'name': u'repeated'}) == first
+
+
+def test_agreed_names_are_interned():
+    names = ['renamed', 'my_field']
+    data = BinaryCodec(names).encode({'event_type': 'renamed',
+                                      'my_field': 1})
+    assert b'renamed' not in data and b'my_field' not in data
+    assert BinaryCodec(names).decode(data) == {'event_type': 'renamed',
+                                               'my_field': 1}
+
+
+def test_shared_codecs_are_the_same_object():
+    assert BinaryCodec.shared(['a', 'b']) is BinaryCodec.shared(['a', 'b'])
+    assert BinaryCodec.shared(['a']) is not BinaryCodec.shared(['a', 'b'])
+
+
+def test_decode_header_stops_at_the_keys():
+    codec = BinaryCodec()
+    dct = {'type': 'event', 'event_type': 'renamed', 'ea': 1}
+    header = codec.decode_header(codec.encode(dct), ['type'])
+    assert header['type'] == 'event'
+
+
+@pytest.mark.parametrize('data', [
+    b'', b'\x00', b'\x09\x01', b'\x09\x01\x07\x00\x00\x00', b'\x0a',
+])
+def test_binary_rejects_invalid_packets(data):
+    with pytest.raises((ValueError, IndexError)):
+        BinaryCodec().decode(data)
+
+
+def test_binary_rejects_unserializable_values():
+    with pytest.raises(TypeError):
+        BinaryCodec().encode({'value': object()})
+
+
+def test_json_round_trip():
+    codec = JsonCodec()
+    data = codec.encode(PACKET)
+    assert json.loads(data.decode('utf-8')) == PACKET
+    assert codec.decode(bytearray(data)) == PACKET
+
+
+def test_detect():
+    assert isinstance(Codec.detect(JsonCodec().encode(PACKET)), JsonCodec)
+    assert isinstance(Codec.detect(BinaryCodec().encode(PACKET)),
+                      BinaryCodec)
+    assert Codec.detect(b'{}') is CODECS['json']
+    assert Codec.detect(bytearray(b'\x09\x00')) is CODECS['binary']
@@ -0,0 +1,125 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import json
+
+import pytest
+
+from idaconnect.shared.database import Database
+from idaconnect.shared.models import Branch, Repository
+from idaconnect.shared.packets import BinaryCodec, GenericEvent
+from idaconnect.shared.server import check_count
+
+HASH = '0' * 32
+UUID = '12345678-1234-1234-1234-123456789abc'
+
+
+class Client(object):
+    repo = HASH
+    branch = UUID
+
+
+@pytest.fixture
+def database(tmpdir):
+    database = Database(str(tmpdir.join('test.db')))
+    database.initialize()
+    return database
+
+
+def event(tick, **fields):
+    return GenericEvent.new(dict(fields, type='event',
+                                 event_type='test_event', tick=tick))
+
+
+def test_events_are_stored_with_their_names(database):
+    database.insert_events(Client(), [event(1, ea=1, field_one=u'a'),
+                                      event(2, field_two=2)])
+    events = database.select_events(HASH, UUID, 0)
+    assert [e.tick for e in events] == [1, 2]
+    assert events[0].field_one == u'a'
+    assert events[1].field_two == 2
+    assert database.add_names([]) == ['test_event', 'field_one',
+                                      'field_two']
+
+
+def test_json_rows_are_decoded(database):
+    dct = {'type': 'event', 'event_type': 'old_event', 'ea': 3}
+    database.insert_encoded(Client(), 5, json.dumps(dct).encode('utf-8'))
+    event, = database.select_events(HASH, UUID, 0)
+    assert (event.tick, event.event_type, event.ea) == (5, 'old_event', 3)
+
+
+def test_binary_rows_starting_with_a_brace_are_decoded(database):
+    # The number of names is encoded first, and 123 is an opening brace
+    names = database.add_names(['name_%d' % i for i in range(123)])
+    data = BinaryCodec(names).encode({'type': 'event',
+                                      'event_type': 'name_5', 'ea': 7})
+    database.insert_encoded(Client(), 1, data, names)
+    event, = database.select_events(HASH, UUID, 0)
+    assert (event.event_type, event.ea) == ('name_5', 7)
+
+
+def test_names_are_reloaded(database, tmpdir):
+    database.add_names([u'first', u'second', u'first'])
+    other = Database(str(tmpdir.join('test.db')))
+    other.initialize()
+    assert other.add_names([u'third']) == ['first', 'second', 'third']
+
+
+def test_names_table_is_bounded(database, monkeypatch):
+    monkeypatch.setattr(Database, 'NAMES_MAX', 10)
+    names = database.add_names([u'name_%d' % i for i in range(100)])
+    assert len(names) == 10
+
+    # The events keep their names that could not be added
+    database.insert_events(Client(), [event(1, unknown_field=1)])
+    event_, = database.select_events(HASH, UUID, 0)
+    assert event_.unknown_field == 1
+
+
+def test_names_are_only_agreed_without_interning(tmpdir):
+    database = Database(str(tmpdir.join('worker.db')), interning=False)
+    database.initialize()
+    database.insert_events(Client(), [event(1, field_one=1)])
+    event_, = database.select_events(HASH, UUID, 0)
+    assert event_.field_one == 1
+    assert database.add_names([]) == []
+
+    assert database.add_names([u'first']) == ['first']
+
+
+def test_repositories_and_branches_are_paged(database):
+    for i in range(5):
+        hash = '%032x' % i
+        database.insert_repo(Repository(hash, 'file%d.idb' % (4 - i),
+                                        'ELF', 'date'))
+        database.insert_branch(Branch('%08x-0000-0000-0000-000000000000' % i,
+                                      HASH, 'date', 64))
+    listing = database.list_repos(limit=2)
+    assert [repo.file for repo, _ in listing] == ['file0.idb', 'file1.idb']
+    assert len(database.list_repos(u'file')) == 5
+
+    branches = database.select_branches(None, HASH, 2, 1)
+    assert [branch.uuid[:8] for branch in branches] == ['00000001',
+                                                        '00000002']
+    assert len(database.select_branches(None, HASH, offset=3)) == 2
+
+
+def test_check_count():
+    assert check_count(None, 'limit') is None
+    assert check_count(0, 'offset') == 0
+    assert check_count(25, 'limit') == 25
+    assert check_count('25', 'limit') == 25
+    for value in ('1; drop table repos', -1, 2 ** 63, [], 1.5e300,
+                  float('inf')):
+        with pytest.raises(ValueError):
+            check_count(value, 'limit')
@@ -0,0 +1,215 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import os
+import random
+
+import pytest
+
+from idaconnect.shared.dedup import (SEGMENT_MAX, SEGMENT_MIN, FileSegmentSink,
+                                     SegmentSource, SegmentStore,
+                                     check_digest, missing_segments,
+                                     segment_offsets, split_file, split_files)
+from idaconnect.shared.server import HASH_FORMAT, check_format
+from idaconnect.shared.streams import find_partial, partial_path
+
+
+def random_bytes(size, seed=0):
+    rand = random.Random(seed)
+    return bytes(bytearray(rand.getrandbits(8) for _ in range(size)))
+
+
+def write_file(tmpdir, name, data):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_segments_cover_the_file(tmpdir):
+    data = random_bytes(1 << 20)
+    digest, segments = split_file(write_file(tmpdir, 'file', data))
+    assert digest == hashlib.sha1(data).hexdigest()
+    assert sum(size for _, size in segments) == len(data)
+    for segment, size in segments[:-1]:
+        assert SEGMENT_MIN <= size <= SEGMENT_MAX
+
+    offset = 0
+    for segment, size in segments:
+        chunk = data[offset:offset + size]
+        assert hashlib.sha1(chunk).hexdigest() == segment
+        offset += size
+
+
+def test_insertion_only_changes_the_segments_around_it(tmpdir):
+    data = random_bytes(1 << 20)
+    edited = data[:500000] + b'inserted bytes' + data[500000:]
+    _, before = split_file(write_file(tmpdir, 'before', data))
+    _, after = split_file(write_file(tmpdir, 'after', edited))
+
+    known = set(segment for segment, _ in before)
+    changed = [segment for segment, _ in after if segment not in known]
+    assert len(before) > 8
+    assert 1 <= len(changed) <= 2
+
+
+def test_data_without_entropy_is_split_at_the_maximum_size(tmpdir):
+    _, segments = split_file(write_file(tmpdir, 'zeros',
+                                        b'\0' * (3 * SEGMENT_MAX + 5)))
+    assert [size for _, size in segments] == [SEGMENT_MAX] * 3 + [5]
+    assert len(set(segment for segment, _ in segments)) == 2
+
+
+def test_empty_file(tmpdir):
+    digest, segments = split_file(write_file(tmpdir, 'empty', b''))
+    assert digest == hashlib.sha1(b'').hexdigest()
+    assert segments == []
+
+
+def test_split_files_skips_the_missing_ones(tmpdir):
+    path = write_file(tmpdir, 'file', b'data')
+    result = split_files([path, str(tmpdir.join('missing'))])
+    assert [p for p, _ in result] == [path]
+
+
+def test_missing_segments_are_ordered_and_unique():
+    segments = [['a', 10], ['b', 20], ['a', 10], ['c', 5], ['b', 20]]
+    assert segment_offsets(segments) == {'a': 0, 'b': 10, 'c': 40}
+    missing, ranges = missing_segments(segments, ['c'])
+    assert missing == ['a', 'b']
+    assert ranges == [(0, 10), (10, 20)]
+
+
+def test_segment_source_sends_the_ranges(tmpdir):
+    data = random_bytes(100000)
+    path = write_file(tmpdir, 'file', data)
+    source = SegmentSource(path, [(10, 100), (50000, 30000), (0, 5)])
+    try:
+        assert len(source) == 30105
+        assert b''.join(source.blocks()) \
+            == data[10:110] + data[50000:80000] + data[:5]
+    finally:
+        source.close()
+
+
+def test_check_digest():
+    assert check_digest('0123456789abcdef0123456789abcdef01234567')
+    for digest in ('../../etc/passwd', 'A' * 40, 'a' * 39, 'a' * 40 + '\n',
+                   None, 42):
+        with pytest.raises(ValueError):
+            check_digest(digest)
+
+
+def test_check_repository_hash():
+    assert check_format('0123456789ABCDEF0123456789abcdef', HASH_FORMAT,
+                        'repository')
+    for hash in ('..', '../' * 11, 'g' * 32, None):
+        with pytest.raises(ValueError):
+            check_format(hash, HASH_FORMAT, 'repository')
+
+
+def test_segment_store(tmpdir):
+    store = SegmentStore(str(tmpdir.join('store')))
+    data = b'segment'
+    segment = hashlib.sha1(data).hexdigest()
+    assert not store.has(segment)
+    store.put(segment, data)
+    assert store.has(segment)
+    assert store.get(segment) == data
+
+    with pytest.raises(ValueError):
+        store.put('0' * 40, data)
+    with pytest.raises(ValueError):
+        store.has('../../../etc/passwd')
+
+
+def assemble(tmpdir, data, cached, count=None):
+    """
+    Download a file made of segments, knowing the segments of other files.
+
+    :param tmpdir: the directory
+    :param data: the content of the file
+    :param cached: the path and segments of each other file
+    :param count: the number of bytes received before the interruption
+    :return: the destination path
+    """
+    path = str(tmpdir.join('download'))
+    digest, segments = split_file(write_file(tmpdir, 'origin', data))
+    known = set(segment for _, other in cached for segment, _ in other)
+    missing, ranges = missing_segments(segments, known)
+    content = b''.join(data[offset:offset + size] for offset, size in ranges)
+
+    sink = FileSegmentSink(path, digest, segments, missing, cached)
+    if count is None:
+        sink.write(content)
+        sink.commit()
+    else:
+        sink.write(content[:count])
+        sink.abort()
+    return path
+
+
+def test_sink_takes_the_known_segments_from_the_cached_file(tmpdir):
+    old = random_bytes(1 << 20)
+    new = old[:300000] + random_bytes(1000, 1) + old[300000:]
+    cachedPath = write_file(tmpdir, 'cached', old)
+    path = assemble(tmpdir, new, [(cachedPath, split_file(cachedPath)[1])])
+    assert read_file(path) == new
+    assert find_partial(path) is None
+
+
+def test_interrupted_download_keeps_its_partial_file(tmpdir):
+    data = random_bytes(1 << 20)
+    path = assemble(tmpdir, data, [], count=600000)
+    digest = hashlib.sha1(data).hexdigest()
+    assert find_partial(path) == digest
+
+    # The partial file only holds complete segments
+    partial = read_file(partial_path(path, digest))
+    assert 0 < len(partial) <= 600000
+    assert data.startswith(partial)
+
+
+def test_resumed_download_only_needs_the_rest(tmpdir):
+    data = random_bytes(1 << 20)
+    path = assemble(tmpdir, data, [], count=600000)
+    partPath = partial_path(path, find_partial(path))
+    cached = split_files([path, partPath])
+    path = assemble(tmpdir, data, cached)
+    assert read_file(path) == data
+    assert find_partial(path) is None
+
+
+def test_resumed_download_skips_the_segments_sent_again(tmpdir):
+    data = random_bytes(1 << 20)
+    path = assemble(tmpdir, data, [], count=600000)
+
+    # Nothing is known, so the whole content is sent again
+    path = assemble(tmpdir, data, [])
+    assert read_file(path) == data
+
+
+def test_download_discards_the_partial_of_another_version(tmpdir):
+    old = random_bytes(1 << 20)
+    new = old[:700000] + b'edit' + old[700000:]
+    path = assemble(tmpdir, old, [], count=800000)
+    oldPart = partial_path(path, find_partial(path))
+    cached = split_files([path, oldPart])
+    path = assemble(tmpdir, new, cached)
+    assert read_file(path) == new
+    assert not os.path.exists(oldPart)
@@ -0,0 +1,98 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+from idaconnect.shared.framing import Framer
+
+
+def test_read_line_waits_for_the_newline():
+    framer = Framer()
+    framer.feed(b'{"a": ')
+    assert framer.read_line() is None
+    framer.feed(b'1}\n{"b"')
+    assert framer.read_line() == b'{"a": 1}'
+    assert framer.read_line() is None
+    framer.feed(b': 2}\n')
+    assert framer.read_line() == b'{"b": 2}'
+    assert len(framer) == 0
+
+
+def test_read_line_byte_by_byte():
+    framer = Framer()
+    lines = []
+    for byte in b'first\nsecond\n\nthird\n':
+        framer.feed(bytes(bytearray([byte])))
+        line = framer.read_line()
+        if line is not None:
+            lines.append(line)
+    assert lines == [b'first', b'second', b'', b'third']
+
+
+def test_read_frame_waits_for_the_payload():
+    framer = Framer()
+    data = Framer.header(Framer.FRAME_PACKET, 5, Framer.FLAG_COMPRESSED) \
+        + b'hello'
+    framer.feed(data[:3])
+    assert framer.is_frame()
+    assert framer.read_frame() is None
+    framer.feed(data[3:-1])
+    assert framer.read_frame() is None
+    framer.feed(data[-1:])
+    assert framer.read_frame() == (Framer.FRAME_PACKET,
+                                   Framer.FLAG_COMPRESSED, b'hello')
+    assert framer.peek() is None
+
+
+def test_frames_and_lines_are_not_confused():
+    framer = Framer()
+    framer.feed(b'line\n')
+    assert not framer.is_frame()
+    framer.feed(Framer.header(Framer.FRAME_DATA, 2) + b'\n\n')
+    assert framer.read_line() == b'line'
+    assert framer.is_frame()
+    assert framer.read_frame() == (Framer.FRAME_DATA, 0, b'\n\n')
+
+
+def test_reserve_grows_and_compacts_the_buffer():
+    framer = Framer()
+    size = Framer.INITIAL_SIZE
+    framer.feed(b'x' * (size - 10) + b'\n' + b'y' * 5)
+    assert framer.read_line() == b'x' * (size - 10)
+
+    # The remaining bytes are moved to the front rather than growing
+    view = framer.reserve(size - 10)
+    assert len(view) >= size - 10
+    view[:3] = b'yy\n'
+    framer.commit(3)
+    del view  # an exported buffer cannot be resized
+    assert framer.read_line() == b'y' * 7
+
+    # A message larger than the buffer makes it grow
+    framer.feed(b'z' * (3 * size) + b'\n')
+    assert framer.read_line() == b'z' * (3 * size)
+
+
+def test_read_returns_the_available_bytes():
+    framer = Framer()
+    framer.feed(b'abcdef')
+    assert framer.read(4) == b'abcd'
+    assert framer.read(4) == b'ef'
+    assert framer.read(4) == b''
+
+
+def test_clear_discards_everything():
+    framer = Framer()
+    framer.feed(b'partial line')
+    assert framer.read_line() is None
+    framer.clear()
+    assert len(framer) == 0
+    framer.feed(b'new\n')
+    assert framer.read_line() == b'new'
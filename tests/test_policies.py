@@ -0,0 +1,147 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import binascii
+import os
+import socket
+
+import pytest
+
+from conftest import HASH, UUID, event, run_until
+from idaconnect.shared.commands import Resubscribe
+from idaconnect.shared.server import Server
+
+HIGH = 64 << 10
+LOW = 16 << 10
+COUNT = 400  # events of about 1 KiB, well above the high watermark
+
+
+@pytest.fixture
+def producer(connect, subscribe):
+    peer, client = connect()
+    subscribe(peer, client)
+    return peer, client
+
+
+@pytest.fixture
+def consumer(connect, subscribe):
+    """
+    Get a function connecting a subscriber that doesn't read what it is
+    sent until told to. The send buffer of the server is shrunk, so that
+    the events queue up in memory sooner.
+    """
+    def consumer(**features):
+        peer, client = connect(compression=['none'], **features)
+        client._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        subscribe(peer, client)
+        peer.pause_reading()
+        return peer, client
+    return consumer
+
+
+def produce(peer):
+    for tick in range(1, COUNT + 1):
+        padding = binascii.hexlify(os.urandom(512)).decode('ascii')
+        peer.send_packet(event(tick, padding=padding))
+
+
+def stored(server):
+    return len(server.database.select_events(HASH, UUID, 0))
+
+
+def test_spilled_events_are_sent_in_order(loop, server, producer, consumer,
+                                          monkeypatch):
+    server.set_queue_policy(Server.POLICY_SPILL, HIGH, LOW)
+    producerPeer, _ = producer
+    peer, client = consumer()
+
+    # Refilling from the spill starts below the low watermark
+    refills = []
+    pop = client._spill.pop
+
+    def spy():
+        refills.append(client.pending)
+        return pop()
+    monkeypatch.setattr(client._spill, 'pop', spy)
+
+    produce(producerPeer)
+    run_until(loop, lambda: stored(server) == COUNT)
+    assert client.stats['spilled_packets'] > 0
+    assert client.pending <= HIGH + 2048  # only the last event goes over
+
+    peer.resume_reading()
+    run_until(loop, lambda: len(peer.ticks) == COUNT)
+    assert peer.ticks == list(range(1, COUNT + 1))
+    assert client.stats['spilled_packets'] == 0
+    assert refills[0] <= LOW
+    assert max(refills) <= HIGH
+
+
+def test_producer_is_paused_until_caught_up(loop, server, producer,
+                                            consumer, monkeypatch):
+    server.set_queue_policy(Server.POLICY_PAUSE, HIGH, LOW)
+    producerPeer, producerClient = producer
+    peer, client = consumer()
+
+    resumed = []
+    resume_reading = producerClient.resume_reading
+
+    def spy():
+        resumed.append(client.pending)
+        resume_reading()
+    monkeypatch.setattr(producerClient, 'resume_reading', spy)
+
+    produce(producerPeer)
+    run_until(loop, lambda: producerClient.stats['paused'])
+    assert client.stats['paused_producers'] == 1
+    assert stored(server) < COUNT
+
+    # Reading resumes below the low watermark, not right below the high one
+    peer.resume_reading()
+    run_until(loop, lambda: len(peer.ticks) == COUNT)
+    assert stored(server) == COUNT
+    assert not producerClient.stats['paused']
+    assert resumed and all(pending <= LOW for pending in resumed)
+    assert peer.ticks == list(range(1, COUNT + 1))
+
+
+def test_dropped_subscriber_is_told_to_resubscribe(loop, server, producer,
+                                                   consumer):
+    server.set_queue_policy(Server.POLICY_DROP, HIGH, LOW)
+    producerPeer, _ = producer
+    peer, client = consumer()
+
+    produce(producerPeer)
+    run_until(loop, lambda: stored(server) == COUNT)
+    assert client.stats['dropped'] == 1
+    assert client not in server.find_subscribers(HASH, UUID)
+
+    # The events it was dropped for come first
+    peer.resume_reading()
+    run_until(loop, lambda: any(isinstance(packet, Resubscribe)
+                                for packet in peer.received))
+    assert isinstance(peer.received[-1], Resubscribe)
+    ticks = peer.ticks
+    assert ticks == list(range(1, len(ticks) + 1))
+    assert client.connected
+
+
+def test_dropped_subscriber_is_disconnected(loop, server, producer,
+                                            consumer):
+    server.set_queue_policy(Server.POLICY_DROP, HIGH, LOW)
+    producerPeer, _ = producer
+    _, client = consumer(resubscribe=[False])
+
+    produce(producerPeer)
+    run_until(loop, lambda: not client.connected)
+    assert client.stats['dropped'] == 1
+    assert client not in server.find_subscribers(HASH, UUID)
@@ -0,0 +1,176 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import socket
+
+import pytest
+
+from idaconnect.shared.commands import Error, GetRepositories, Ping, Pong
+from idaconnect.shared.sockets import ClientSocket
+
+
+class Outcome(object):
+    """
+    The result of a query, or its error.
+    """
+
+    def __init__(self, d):
+        self.result = self.error = None
+        d.add_callback(self.set_result)
+        d.add_errback(self.set_error)
+
+    def set_result(self, result):
+        self.result = result
+
+    def set_error(self, error):
+        self.error = error
+
+
+def query(sock, timeout=None):
+    packet = GetRepositories.Query()
+    return packet, Outcome(sock.send_packet(packet, timeout))
+
+
+def test_query_times_out_without_progress(clock, sock):
+    _, outcome = query(sock, timeout=5)
+    assert len(sock.timers) == 1
+
+    clock.now += 4
+    sock.run_timers()
+    assert outcome.error is None
+    assert len(sock.timers) == 1
+
+    clock.now += 2
+    sock.run_timers()
+    assert isinstance(outcome.error, socket.timeout)
+    assert sock.stats['queries_timed_out'] == 1
+    assert sock.stats['queries_in_flight'] == 0
+    assert sock.timers == []
+
+
+def test_reply_postpones_the_timeout(clock, sock):
+    packet, outcome = query(sock, timeout=5)
+    clock.now += 4
+    sock._reply_started(GetRepositories.Reply(packet, []))
+    clock.now += 4
+    sock.run_timers()
+    assert outcome.error is None
+
+    reply = GetRepositories.Reply(packet, [])
+    sock._reply_finished(reply)
+    assert outcome.result is reply
+    assert sock.stats['queries_in_flight'] == 0
+
+
+def test_query_without_timeout_waits_forever(clock, sock):
+    _, outcome = query(sock, timeout=0)
+    clock.now += 10 * ClientSocket.REQUEST_TIMEOUT
+    sock.run_timers()
+    assert outcome.error is None
+    assert sock.stats['queries_in_flight'] == 1
+
+
+def test_late_reply_is_ignored(clock, sock):
+    packet, outcome = query(sock, timeout=5)
+    clock.now += 6
+    sock.run_timers()
+    sock._reply_finished(GetRepositories.Reply(packet, []))
+    assert outcome.result is None
+    assert isinstance(outcome.error, socket.timeout)
+
+
+def test_error_reply_fails_the_query(clock, sock):
+    packet, outcome = query(sock)
+    sock._reply_started(Error(packet, "Invalid limit"))
+    sock._reply_finished(Error(packet, "Invalid limit"))
+    assert isinstance(outcome.error, ValueError)
+    assert str(outcome.error) == "Invalid limit"
+    assert sock.stats['queries_failed'] == 1
+
+
+def test_queries_beyond_the_maximum_wait_their_turn(clock, sock):
+    sent = [query(sock, timeout=5) for _ in range(ClientSocket.REQUESTS_MAX)]
+    waiting = [query(sock, timeout=5) for _ in range(2)]
+    assert len(sock.written) == ClientSocket.REQUESTS_MAX
+    assert sock.stats['queries_waiting'] == 2
+
+    # A reply makes room for a single query
+    packet, _ = sent[0]
+    sock._reply_finished(GetRepositories.Reply(packet, []))
+    assert len(sock.written) == ClientSocket.REQUESTS_MAX + 1
+    assert sock.stats['queries_waiting'] == 1
+
+    # The last query is only sent, and timed, once the others time out
+    clock.now += 4
+    sock.run_timers()
+    clock.now += 2
+    sock.run_timers()
+    assert all(isinstance(outcome.error, socket.timeout)
+               for _, outcome in sent[1:])
+    assert waiting[0][1].error is not None
+    assert waiting[1][1].error is None
+    assert sock.stats['queries_in_flight'] == 1
+
+
+def test_cancelled_query_makes_room(clock, sock):
+    sent = [query(sock) for _ in range(ClientSocket.REQUESTS_MAX)]
+    query(sock)
+    packet, _ = sent[0]
+    sock._requests[packet.id].deferred.cancel()
+    assert sock.stats['queries_cancelled'] == 1
+    assert sock.stats['queries_waiting'] == 0
+    assert sock.stats['queries_in_flight'] == ClientSocket.REQUESTS_MAX
+
+
+def test_lost_connection_fails_every_query(clock, sock):
+    outcomes = [query(sock)[1]
+                for _ in range(ClientSocket.REQUESTS_MAX + 3)]
+    sock._fail_requests(IOError("Connection lost"))
+    assert all(isinstance(outcome.error, IOError) for outcome in outcomes)
+    assert sock.stats['queries_lost'] == ClientSocket.REQUESTS_MAX + 3
+    assert sock.stats['queries_in_flight'] == 0
+    assert sock.stats['queries_waiting'] == 0
+
+
+def test_first_rtt_sample(sock):
+    assert sock.rtt is None
+    sock._measure_rtt(0.1)
+    assert sock.rtt == pytest.approx(0.1)
+    assert sock.rttvar == pytest.approx(0.05)
+    assert sock.updates == 1
+
+
+def test_rtt_is_smoothed_as_by_rfc_6298(sock):
+    sock._measure_rtt(0.1)
+    sock._measure_rtt(0.3)
+
+    # The variation is updated with the previous smoothed time
+    assert sock.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.2)
+    assert sock.rtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.3)
+    assert sock.stats['rtt'] == sock.rtt
+    assert sock.stats['rttvar'] == sock.rttvar
+
+
+def test_rtt_converges_to_a_steady_sample(sock):
+    sock._measure_rtt(1.0)
+    for _ in range(100):
+        sock._measure_rtt(0.2)
+    assert sock.rtt == pytest.approx(0.2, abs=1e-4)
+    assert sock.rttvar == pytest.approx(0, abs=1e-4)
+
+
+def test_pings_are_answered_and_pongs_measured(clock, sock):
+    sock._handle_packet(Ping(12.5))
+    assert b'"pong"' in sock.written[-1] and b'12.5' in sock.written[-1]
+
+    sock._handle_packet(Pong(clock.now - 0.25))
+    assert sock.rtt == pytest.approx(0.25)
@@ -0,0 +1,98 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import pytest
+
+from conftest import HASH, UUID, event, run_until
+from idaconnect.shared.commands import Unsubscribe
+from idaconnect.shared.packets import Batch
+from idaconnect.shared.sockets import ClientSocket
+
+
+def test_json_codec_is_preferred(connect):
+    assert ClientSocket.FEATURES['codec'][0] == ClientSocket.CODEC_JSON
+    peer, client = connect()
+    assert peer.features['codec'] == ClientSocket.CODEC_JSON
+    assert client.features['codec'] == ClientSocket.CODEC_JSON
+
+
+def test_binary_codec_is_opt_in(server, connect):
+    server.set_codec(ClientSocket.CODEC_BINARY)
+    peer, _ = connect()
+    assert peer.features['codec'] == ClientSocket.CODEC_BINARY
+
+    # Unless the client doesn't support it
+    peer, _ = connect(codec=[ClientSocket.CODEC_JSON])
+    assert peer.features['codec'] == ClientSocket.CODEC_JSON
+
+    with pytest.raises(ValueError):
+        server.set_codec('xml')
+
+
+def test_events_are_relayed_in_the_codec_of_each_subscriber(
+        loop, server, connect, subscribe):
+    server.set_codec(ClientSocket.CODEC_BINARY)
+    producer, client = connect()
+    subscribe(producer, client)
+    consumers = [connect(codec=[ClientSocket.CODEC_JSON],
+                         compression=[ClientSocket.COMPRESSION_NONE]),
+                 connect(),
+                 connect(batch=[False],
+                         compression=[ClientSocket.COMPRESSION_NONE])]
+    for peer, client in consumers:
+        subscribe(peer, client)
+
+    producer.send_packet(event(1, ea=1, name=u'main'))
+    producer.send_packet(Batch([event(2, ea=2),
+                                event(3, ea=3, comment=u'line\nline')]))
+    for peer, client in consumers:
+        run_until(loop, lambda: len(peer.events) == 3)
+        assert [(e.tick, e.ea) for e in peer.events] == [(1, 1), (2, 2),
+                                                         (3, 3)]
+        assert peer.events[0].name == u'main'
+        assert peer.events[2].comment == u'line\nline'
+    assert [e.tick for e in server.database.select_events(HASH, UUID, 0)] \
+        == [1, 2, 3]
+
+    # Only the packets that the subscriber can read are sent as they are
+    json, binary, unbatched = [client for _, client in consumers]
+    assert json.stats.get('relayed', 0) == 0
+    assert binary.stats['relayed'] == 2
+    assert unbatched.stats['relayed'] == 1
+    assert not any(isinstance(packet, Batch)
+                   for packet in consumers[2][0].received)
+
+
+def test_subscribers_are_indexed_by_branch(loop, server, connect, subscribe):
+    other = '87654321-4321-4321-4321-cba987654321'
+    (peer, client), (otherPeer, otherClient) = connect(), connect()
+    subscribe(peer, client)
+    subscribe(otherPeer, otherClient)
+    assert set(server.find_subscribers(HASH, UUID)) == {client, otherClient}
+
+    # Subscribing to another branch leaves the previous one
+    subscribe(otherPeer, otherClient, uuid=other)
+    assert set(server.find_subscribers(HASH, UUID)) == {client}
+    assert server.subscriber_counts() == {(HASH, UUID): 1, (HASH, other): 1}
+
+    otherPeer.send_packet(Unsubscribe())
+    run_until(loop, lambda: not server.find_subscribers(HASH, other))
+    assert otherClient.branch is None
+    assert server.subscriber_counts() == {(HASH, UUID): 1}
+
+    # Disconnecting leaves the branch too
+    subscribe(otherPeer, otherClient)
+    peer.disconnect()
+    run_until(loop, lambda: not client.connected)
+    assert set(server.find_subscribers(HASH, UUID)) == {otherClient}
+    assert server.subscriber_counts() == {(HASH, UUID): 1}
+    assert client not in server._subscriptions
@@ -0,0 +1,106 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import socket
+
+import pytest
+
+from conftest import HASH, UUID, LoopServer, Peer, event, run_until
+from idaconnect.shared.commands import GetRepositories, Subscribe
+from idaconnect.shared.shards import (recv_connection, send_connection,
+                                      shard_of)
+from idaconnect.shared.sockets import ClientSocket
+
+SHARDS = 2
+
+
+def tcp_pair():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def test_connection_is_received_with_its_state():
+    channel, otherChannel = socket.socketpair()
+    client, server = tcp_pair()
+    state = {'hash': HASH, 'names': [u'ea', u'name'], 'incoming': ''}
+    send_connection(channel, server, state)
+    server.close()
+
+    sock, received = recv_connection(otherChannel)
+    assert received == state
+    sock.sendall(b'handed off')
+    assert client.recv(64) == b'handed off'
+    for s in (sock, client, channel, otherChannel):
+        s.close()
+
+
+@pytest.fixture
+def supervisor(loop, tmpdir):
+    """
+    Get a supervisor and its workers, running in the same process.
+    """
+    supervisor = LoopServer(tmpdir, None, SHARDS)
+    supervisor.set_codec(ClientSocket.CODEC_BINARY)
+    supervisor.workers = []
+    for shard in range(SHARDS):
+        worker = LoopServer(tmpdir, shard, SHARDS)
+        channel, workerChannel = socket.socketpair()
+        supervisor.connect_channel(shard, channel)
+        worker.connect_channel(None, workerChannel)
+        supervisor.workers.append(worker)
+    assert supervisor.start('127.0.0.1', 0)
+    yield supervisor
+    for server in [supervisor] + supervisor.workers:
+        for client in server.clients:
+            client.disconnect()
+        server.disconnect()
+
+
+def test_connection_is_handed_off_to_its_shard(loop, supervisor):
+    peer = Peer()
+    sock = socket.create_connection(supervisor._socket.getsockname())
+    sock.setblocking(False)
+    peer.connect(sock)
+    peer.handshake()
+    run_until(loop, lambda: peer.features)
+    assert peer.features['compression'] == ClientSocket.COMPRESSION_ZLIB
+    assert peer.features['codec'] == ClientSocket.CODEC_BINARY
+
+    # Start both zlib streams before the connection is handed off
+    replies = []
+    peer.send_packet(GetRepositories.Query()).add_callback(replies.append)
+    run_until(loop, lambda: replies)
+
+    worker = supervisor.workers[shard_of(HASH, SHARDS)]
+    peer.send_packet(Subscribe(HASH, UUID, 0))
+    run_until(loop, lambda: worker.find_subscribers(HASH, UUID))
+    client, = worker.clients
+    assert not supervisor.clients
+
+    # The events are decompressed, and stored as they were encoded using
+    # the names agreed by the supervisor
+    for tick in range(1, 4):
+        peer.send_packet(event(tick, ea=tick))
+    run_until(loop, lambda: len(worker.database.select_events(
+        HASH, UUID, 0)) == 3)
+    assert client._stores_encoded
+    assert worker.database.add_names([]) == peer._names
+
+    # And the replies are compressed following the previous ones
+    peer.send_packet(GetRepositories.Query()).add_callback(replies.append)
+    run_until(loop, lambda: len(replies) == 2)
+    peer.disconnect()
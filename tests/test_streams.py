@@ -0,0 +1,89 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import os
+
+from idaconnect.shared.streams import (CHUNK_SIZE, FileSink, compress_chunk,
+                                       find_partial, partial_offset,
+                                       partial_path)
+
+DIGEST = 'a' * 40
+
+
+def test_no_partial_file(tmpdir):
+    path = str(tmpdir.join('db.i64'))
+    assert find_partial(path) is None
+    assert partial_offset(path, DIGEST) == 0
+
+
+def test_raw_partial_is_resumed_on_a_chunk_boundary(tmpdir):
+    path = str(tmpdir.join('db.i64'))
+    sink = FileSink(path, digest=DIGEST)
+    sink.write(b'x' * (2 * CHUNK_SIZE + 123))
+    sink.abort()
+
+    assert os.path.exists(partial_path(path, DIGEST))
+    assert find_partial(path) == DIGEST
+    assert partial_offset(path, DIGEST) == 2 * CHUNK_SIZE
+    assert partial_offset(path, 'b' * 40) == 0
+
+
+def test_packed_partial_is_resumed_after_its_last_complete_chunk(tmpdir):
+    path = str(tmpdir.join('db.i64'))
+    sink = FileSink(path, packed=True, digest=DIGEST)
+    sink.write_chunk(compress_chunk(b'a' * CHUNK_SIZE))
+    sink.write_chunk(compress_chunk(b'b' * 1000))
+    sink.abort()
+    assert partial_offset(path, DIGEST) == CHUNK_SIZE + 1000
+
+    # Cut the last chunk in the middle
+    partPath = partial_path(path, DIGEST)
+    with open(partPath, 'r+b') as f:
+        f.truncate(os.path.getsize(partPath) - 5)
+    assert partial_offset(path, DIGEST) == CHUNK_SIZE
+
+
+def test_resumed_sink_completes_the_file(tmpdir):
+    path = str(tmpdir.join('db.i64'))
+    content = os.urandom(CHUNK_SIZE + 4096)
+    digest = hashlib.sha1(content).hexdigest()
+
+    sink = FileSink(path, digest=digest)
+    sink.write(content[:CHUNK_SIZE + 100])
+    sink.abort()
+
+    offset = partial_offset(path, digest)
+    assert offset == CHUNK_SIZE
+    sink = FileSink(path, digest=digest, offset=offset)
+    sink.write(content[offset:])
+    sink.commit()
+
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    assert find_partial(path) is None
+
+
+def test_new_transfer_discards_the_other_partials(tmpdir):
+    path = str(tmpdir.join('db.i64'))
+    FileSink(path, digest=DIGEST).abort()
+    FileSink(path, digest='b' * 40).abort()
+    assert not os.path.exists(partial_path(path, DIGEST))
+    assert find_partial(path) == 'b' * 40
+
+
+def test_sink_without_digest_leaves_nothing(tmpdir):
+    path = str(tmpdir.join('db.i64'))
+    sink = FileSink(path)
+    sink.write(b'data')
+    sink.abort()
+    assert os.listdir(str(tmpdir)) == []
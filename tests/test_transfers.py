@@ -0,0 +1,174 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import socket
+
+import pytest
+
+from idaconnect.interface.transfers import Transfer
+from idaconnect.shared.commands import Error, GetRepositories
+
+
+class Signal(object):
+    """
+    A signal calling the slots connected to it.
+    """
+
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self):
+        for slot in self.slots:
+            slot()
+
+
+class Progress(object):
+    """
+    A progress dialog, whose cancel button can be shown and clicked.
+    """
+
+    def __init__(self):
+        self.canceled = Signal()
+        self.text = "Downloading"
+        self.button = None
+        self.closed = False
+
+    def labelText(self):
+        return self.text
+
+    def setLabelText(self, text):
+        self.text = text
+
+    def setCancelButtonText(self, text):
+        self.button = text
+
+    def setCancelButton(self, button):
+        self.button = button
+
+    def close(self):
+        self.closed = True
+
+
+class Network(object):
+    """
+    A network module using a single socket.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    @property
+    def connected(self):
+        return self.sock.connected
+
+    def send_packet(self, packet, timeout=None):
+        return self.sock.send_packet(packet, timeout)
+
+
+class Handler(object):
+    """
+    An action handler making a transfer of a single query.
+    """
+
+    def __init__(self, sock):
+        self.network = Network(sock)
+        self.progress = Progress()
+        self.queries = []
+        self.errors = []
+        self.transfer = Transfer(self.network, self.progress, self.restart,
+                                 self.errors.append)
+
+    def restart(self):
+        query = GetRepositories.Query()
+        self.queries.append(query)
+        d = self.network.send_packet(query, 5)
+        d.add_errback(self.transfer.failed)
+
+
+@pytest.fixture
+def handler(sock):
+    handler = Handler(sock)
+    handler.restart()
+    return handler
+
+
+def test_timed_out_request_ends_the_transfer(clock, sock, handler):
+    clock.now += 6
+    sock.run_timers()
+    assert handler.progress.closed
+    assert handler.transfer.ended
+    error, = handler.errors
+    assert isinstance(error, socket.timeout)
+
+    # It is not resumed once reconnected
+    handler.transfer.resume()
+    assert len(handler.queries) == 1
+
+
+def test_error_reply_ends_the_transfer(sock, handler):
+    query, = handler.queries
+    sock._reply_finished(Error(query, "Invalid digest"))
+    assert handler.progress.closed
+    assert [str(error) for error in handler.errors] == ["Invalid digest"]
+
+
+def test_lost_connection_keeps_the_transfer(sock, handler):
+    sock._connected = False
+    sock._fail_requests(IOError("Connection lost"))
+    assert not handler.progress.closed
+    assert not handler.transfer.ended
+    assert handler.errors == []
+
+    sock._connected = True
+    handler.transfer.resume()
+    assert len(handler.queries) == 2
+
+
+def test_transfer_ends_once(sock, handler):
+    handler.transfer.succeeded()
+    assert handler.progress.closed
+    handler.transfer.abort(IOError("Too late"))
+    assert handler.errors == []
+
+
+def test_interrupted_transfer_can_be_cancelled(sock, handler):
+    handler.progress.canceled.emit()
+    assert not handler.transfer.ended
+
+    sock._connected = False
+    sock._fail_requests(IOError("Connection lost"))
+    handler.transfer.interrupt()
+    assert handler.progress.button == "Cancel"
+
+    handler.progress.canceled.emit()
+    assert handler.progress.closed
+    assert handler.errors == [None]
+
+    sock._connected = True
+    handler.transfer.resume()
+    assert len(handler.queries) == 1
+
+
+def test_resumed_transfer_cannot_be_cancelled(sock, handler):
+    sock._connected = False
+    handler.transfer.interrupt()
+    handler.transfer.interrupt()
+    sock._connected = True
+    handler.transfer.resume()
+    assert handler.progress.button is None
+    assert handler.progress.text == "Downloading"
+
+    handler.progress.canceled.emit()
+    assert not handler.transfer.ended